@@ -1,20 +1,21 @@
-#!/usr/bin/env python
 """Dynamic Calculation, yikes"""
-import cgi
+import sys
 import re
-import os
 import datetime
 
 import pandas as pd
 from pandas.io.sql import read_sql
-from pyiem.util import get_dbconn, ssw
+from paste.request import parse_formvars
+
+sys.path.append("/opt/datateam/lib")
+from datateam import dbpool, export  # noqa
 
 VARRE = re.compile(r"(AGR[0-9]{1,2})")
 
 
 def get_df(equation):
     """Attempt to compute what was asked for"""
-    pgconn = get_dbconn("sustainablecorn")
+    pgconn = dbpool.get_dbconn("sustainablecorn")
     varnames = VARRE.findall(equation)
     df = read_sql(
         """
@@ -24,6 +25,7 @@ def get_df(equation):
         params=(tuple(varnames),),
         index_col=None,
     )
+    pgconn.close()
     df["value"] = pd.to_numeric(df["value"], errors="coerce")
     df = pd.pivot_table(
         df,
@@ -39,38 +41,30 @@ def get_df(equation):
     return df
 
 
-def main():
+def application(environ, start_response):
     """Go Main"""
 
-    form = cgi.FieldStorage()
-    equation = form.getfirst("equation", "AGR33 / AGR4").upper()
-    fmt = form.getfirst("fmt", "html")
+    form = parse_formvars(environ)
+    equation = form.get("equation", "AGR33 / AGR4").upper()
+    fmt = form.get("fmt", "html")
     df = get_df(equation)
 
-    if fmt == "excel":
-        ssw("Content-type: application/octet-stream\n")
-        ssw(
-            ("Content-Disposition: attachment; filename=cscap_%s.xlsx\n\n")
-            % (datetime.datetime.now().strftime("%Y%m%d%H%M"),)
-        )
-        writer = pd.ExcelWriter("/tmp/ss.xlsx")
-        df.to_excel(writer, "Data", index=False)
-        writer.save()
-        ssw(open("/tmp/ss.xlsx", "rb").read())
-        os.unlink("/tmp/ss.xlsx")
-        return
-    if fmt == "csv":
-        ssw("Content-type: application/octet-stream\n")
-        ssw(
-            ("Content-Disposition: attachment; filename=cscap_%s.csv\n\n")
-            % (datetime.datetime.now().strftime("%Y%m%d%H%M"),)
+    if fmt in ["excel", "csv"]:
+        fn = "cscap_%s.%s" % (
+            datetime.datetime.now().strftime("%Y%m%d%H%M"),
+            "xlsx" if fmt == "excel" else "csv",
         )
-        ssw(df.to_csv(index=False))
-        return
+        headers = [
+            ("Content-type", "application/octet-stream"),
+            ("Content-Disposition", f"attachment; filename={fn}"),
+        ]
+        start_response("200 OK", headers)
+        if fmt == "csv":
+            return export.iter_csv(df)
+        return [export.to_xlsx(df)]
 
-    ssw("Content-type: text/html\n\n")
-    ssw(
-        """<!DOCTYPE html>
+    start_response("200 OK", [("Content-type", "text/html")])
+    res = """<!DOCTYPE html>
 <html lang='en'>
 <head>
  <link href="/vendor/bootstrap/3.3.5/css/bootstrap.min.css" rel="stylesheet">
@@ -100,10 +94,7 @@ body {padding: 30px;}
 
 </body>
 </html>
-    """
-        % (df.to_html(index=False).replace("NaN", "M"),)
+    """ % (
+        df.to_html(index=False).replace("NaN", "M"),
     )
-
-
-if __name__ == "__main__":
-    main()
+    return [res.encode("utf-8")]
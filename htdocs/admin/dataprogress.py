@@ -1,22 +1,20 @@
-#!/usr/bin/env python
 """ Print out a big thing of progress bars, gasp """
-import cgi
-
+import sys
+from paste.request import parse_formvars
 import pyiem.cscap_utils as util
-from pyiem.util import get_dbconn, ssw
 
-DBCONN = get_dbconn("sustainablecorn")
-cursor = DBCONN.cursor()
+sys.path.append("/opt/datateam/lib")
+from datateam import dbpool  # noqa
 
 ALL = " ALL SITES"
-varorder = []
-varlookup = {}
 
 CFG = "/opt/datateam/config/mytokens.json"
 
 
 def build_vars(mode):
-    """build vars"""
+    """build vars, returns the variable order and name lookup"""
+    varorder = []
+    varlookup = {}
     config = util.get_config(CFG)
     spr_client = util.get_spreadsheet_client(config)
     feed = spr_client.get_list_feed(config["cscap"]["sdckey"], "od6")
@@ -28,9 +26,10 @@ def build_vars(mode):
             continue
         varorder.append(data["key"].strip())
         varlookup[data["key"].strip()] = data["name"].strip()
+    return varorder, varlookup
 
 
-def get_data(year, mode):
+def get_data(cursor, year, mode):
     """Do stuff"""
     data = {ALL: {}}
     dvars = []
@@ -115,19 +114,20 @@ def make_progress(row):
     )
 
 
-def main():
+def application(environ, start_response):
     """Go Main Go"""
-    ssw("Content-type: text/html\n\n")
-    form = cgi.FieldStorage()
-    year = int(form.getfirst("year", 2011))
-    mode = form.getfirst("mode", "agronomic")
-    build_vars(mode)
+    form = parse_formvars(environ)
+    year = int(form.get("year", 2011))
+    mode = form.get("mode", "agronomic")
+    varorder, varlookup = build_vars(mode)
 
-    data, dvars = get_data(year, mode)
+    pgconn = dbpool.get_dbconn("sustainablecorn")
+    data, dvars = get_data(pgconn.cursor(), year, mode)
+    pgconn.close()
 
     sites = list(data.keys())
     sites.sort()
-    ssw(
+    res = [
         """<!DOCTYPE html>
     <html lang='en'>
     <head>
@@ -163,16 +163,18 @@ def main():
     Select Year; <select name="year">
     """
         % (mode,)
-    )
+    ]
     for yr in range(2011, 2016):
         checked = ""
         if year == yr:
             checked = " selected='selected'"
-        ssw("""<option value="%s" %s>%s</option>\n""" % (yr, checked, yr))
+        res.append(
+            """<option value="%s" %s>%s</option>\n""" % (yr, checked, yr)
+        )
 
-    ssw("</select><br />")
+    res.append("</select><br />")
 
-    ids = form.getlist("ids")
+    ids = form.getall("ids")
     dvars = varorder
     if ids:
         dvars = ids
@@ -180,14 +182,14 @@ def main():
         checked = ""
         if varid in ids:
             checked = "checked='checked'"
-        ssw(
+        res.append(
             """<input type='checkbox' name='ids'
         value='%s'%s><abbr title="%s">%s</abbr></input> &nbsp;
         """
             % (varid, checked, varlookup[varid], varid)
         )
 
-    ssw(
+    res.append(
         """
     <input type="submit" value="Generate Table">
     </form>
@@ -200,19 +202,21 @@ def main():
 
     """
     )
-    ssw("<thead><tr><th>SiteID</th>")
+    res.append("<thead><tr><th>SiteID</th>")
     for dv in dvars:
-        ssw("""<th><abbr title="%s">%s</abbr></th>""" % (varlookup[dv], dv))
-    ssw("</tr></thead>")
+        res.append(
+            """<th><abbr title="%s">%s</abbr></th>""" % (varlookup[dv], dv)
+        )
+    res.append("</tr></thead>")
     for sid in sites:
-        ssw("""<tr><th>%s</th>""" % (sid,))
+        res.append("""<tr><th>%s</th>""" % (sid,))
         for datavar in dvars:
             row = data[sid].get(datavar, None)
-            ssw("<td>%s</td>" % (make_progress(row)))
-        ssw("</tr>\n\n")
-    ssw("</table>")
+            res.append("<td>%s</td>" % (make_progress(row)))
+        res.append("</tr>\n\n")
+    res.append("</table>")
 
-    ssw(
+    res.append(
         """
     <h3>Data summary for all sites included</h3>
     <p>
@@ -228,13 +232,11 @@ def main():
     )
     for datavar in dvars:
         row = data[ALL].get(datavar, None)
-        ssw(
+        res.append(
             ("<tr><th>%s %s</th><td>%s</td></tr>")
             % (datavar, varlookup[datavar], make_progress(row))
         )
 
-    ssw("</table></p>")
-
-
-if __name__ == "__main__":
-    main()
+    res.append("</table></p>")
+    start_response("200 OK", [("Content-type", "text/html")])
+    return ["".join(res).encode("utf-8")]
@@ -1,15 +1,15 @@
-#!/usr/bin/env python
-import cgi
+"""Agronomic and soils data progress of the research sites."""
+import sys
 import datetime
 
 from pandas.io.sql import read_sql
-from pyiem.util import get_dbconn, ssw
+from paste.request import parse_formvars
 
-DBCONN = get_dbconn("sustainablecorn")
-cursor = DBCONN.cursor()
+sys.path.append("/opt/datateam/lib")
+from datateam import dbpool  # noqa
 
 
-def get_data(mode, data, arr):
+def get_data(cursor, mode, data, arr):
     """Do stuff"""
     table = "agronomic_data" if mode == "agronomic" else "soil_data"
     cursor.execute(
@@ -93,7 +93,7 @@ def make_progress(row):
     )
 
 
-def do_site(site):
+def do_site(pgconn, site):
     """Print out a simple listing of trouble"""
     df = read_sql(
         """
@@ -108,19 +108,20 @@ def do_site(site):
 
     SELECT * from ag UNION select * from soil ORDER by year ASC, varname ASC
     """,
-        DBCONN,
+        pgconn,
         params=(site, site),
         index_col=None,
     )
-    ssw("Content-type: text/plain\n\n")
-    ssw("CSCAP Variable Progress Report\n")
-    ssw("Site: %s\n" % (site,))
-    ssw(
+    res = ["CSCAP Variable Progress Report\n"]
+    res.append("Site: %s\n" % (site,))
+    res.append(
         "Generated: %s\n"
         % (datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),)
     )
-    ssw("Total Missing: %s\n" % (df["count"].sum(),))
-    ssw("%4s %-10s %-10s %-6s\n" % ("YEAR", "VARNAME", "VALUE", "COUNT"))
+    res.append("Total Missing: %s\n" % (df["count"].sum(),))
+    res.append(
+        "%4s %-10s %-10s %-6s\n" % ("YEAR", "VARNAME", "VALUE", "COUNT")
+    )
 
     def nice(val):
         if val is None:
@@ -132,23 +133,28 @@ def do_site(site):
         return val
 
     for _, row in df.iterrows():
-        ssw(
+        res.append(
             "%s %-10s %-10s %-6s\n"
             % (row["year"], row["varname"], nice(row["value"]), row["count"])
         )
+    return "".join(res)
 
 
-def main():
-    form = cgi.FieldStorage()
+def application(environ, start_response):
+    """Do Stuff"""
+    form = parse_formvars(environ)
+    pgconn = dbpool.get_dbconn("sustainablecorn")
     if "site" in form:
-        do_site(form.getfirst("site"))
-        return
-    # mode = form.getfirst('mode', 'agronomic')
-    show_has = form.getfirst("has", "0") == "1"
-    show_period = form.getfirst("period", "0") == "1"
-    show_dnc = form.getfirst("dnc", "0") == "1"
-    show_no = form.getfirst("no", "0") == "1"
-    if form.getfirst("a") is None:
+        res = do_site(pgconn, form.get("site"))
+        pgconn.close()
+        start_response("200 OK", [("Content-type", "text/plain")])
+        return [res.encode("utf-8")]
+    # mode = form.get('mode', 'agronomic')
+    show_has = form.get("has", "0") == "1"
+    show_period = form.get("period", "0") == "1"
+    show_dnc = form.get("dnc", "0") == "1"
+    show_no = form.get("no", "0") == "1"
+    if form.get("a") is None:
         show_has = True
         show_period = True
         show_dnc = True
@@ -160,13 +166,14 @@ def main():
     show_no = True
     data = {}
     arr = [show_has, show_period, show_dnc, show_no]
-    get_data("agronomic", data, arr)
-    get_data("soils", data, arr)
+    cursor = pgconn.cursor()
+    get_data(cursor, "agronomic", data, arr)
+    get_data(cursor, "soils", data, arr)
+    pgconn.close()
 
     sites = list(data.keys())
     sites.sort()
-    ssw("Content-type: text/html\n\n")
-    ssw(
+    res = [
         """<!DOCTYPE html>
 <html lang='en'>
 <head>
@@ -223,11 +230,11 @@ def main():
             "" if not show_dnc else ' checked="checked"',
             "" if not show_no else ' checked="checked"',
         )
-    )
+    ]
     for sid in sites:
         if sid == "_ALL":
             continue
-        ssw(
+        res.append(
             """
         <tr><th>
 <a href="siteprogress.py?site=%s">
@@ -236,19 +243,21 @@ def main():
             % (sid, sid)
         )
         row = data[sid]
-        ssw("<td>%s</td>" % (make_progress(row)))
-        ssw("<td>%.0f</td>" % (row["tot"],))
-        ssw("<td>%.0f%%</td>" % (((row["hits2"]) / float(row["all"])) * 100.0))
-        ssw("</tr>\n\n")
+        res.append("<td>%s</td>" % (make_progress(row)))
+        res.append("<td>%.0f</td>" % (row["tot"],))
+        res.append(
+            "<td>%.0f%%</td>" % (((row["hits2"]) / float(row["all"])) * 100.0)
+        )
+        res.append("</tr>\n\n")
     sid = "_ALL"
-    ssw("""<tr><th>%s</th>""" % (sid,))
+    res.append("""<tr><th>%s</th>""" % (sid,))
     row = data[sid]
-    ssw("<td>%s</td>" % (make_progress(row)))
-    ssw("<td>%.0f</td>" % (row["tot"],))
-    ssw("<td>%.0f%%</td>" % (((row["hits2"]) / float(row["all"])) * 100.0))
-    ssw("</tr>\n\n")
-    ssw("</table>")
-
-
-if __name__ == "__main__":
-    main()
+    res.append("<td>%s</td>" % (make_progress(row)))
+    res.append("<td>%.0f</td>" % (row["tot"],))
+    res.append(
+        "<td>%.0f%%</td>" % (((row["hits2"]) / float(row["all"])) * 100.0)
+    )
+    res.append("</tr>\n\n")
+    res.append("</table>")
+    start_response("200 OK", [("Content-type", "text/html")])
+    return ["".join(res).encode("utf-8")]
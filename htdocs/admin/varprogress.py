@@ -1,22 +1,22 @@
-#!/usr/bin/env python
+"""Plot the upload progress of an agronomic variable."""
+import sys
 from io import BytesIO
 import datetime
-import cgi
 
 import numpy as np
-import matplotlib
+from matplotlib.figure import Figure
+from paste.request import parse_formvars
 
-matplotlib.use("agg")
-import matplotlib.pyplot as plt
-from pyiem.util import get_dbconn, ssw
+sys.path.append("/opt/datateam/lib")
+from datateam import dbpool  # noqa
 
 
 def make_plot(form):
     """Make the make_plot"""
-    year = int(form.getfirst("year", 2013))
-    varname = form.getfirst("varname", "AGR1")[:10]
+    year = int(form.get("year", 2013))
+    varname = form.get("varname", "AGR1")[:10]
 
-    pgconn = get_dbconn("sustainablecorn")
+    pgconn = dbpool.get_dbconn("sustainablecorn")
     cursor = pgconn.cursor()
     cursor.execute(
         """
@@ -37,6 +37,7 @@ def make_plot(form):
         x.append(row[0])
         y.append(y[-1] + row[1])
         total += row[2]
+    pgconn.close()
 
     xticks = []
     xticklabels = []
@@ -48,7 +49,9 @@ def make_plot(form):
             xticklabels.append(now.strftime(fmt))
         now += datetime.timedelta(days=1)
 
-    (fig, ax) = plt.subplots(1, 1)
+    # a Figure of our own, pyplot keeps its figures in one global registry
+    fig = Figure()
+    ax = fig.add_subplot(1, 1, 1)
     ax.plot(x, np.array(y) / float(total) * 100.0)
     ax.set_ylim(0, 100)
     ax.set_yticks([0, 25, 50, 75, 100])
@@ -60,20 +63,12 @@ def make_plot(form):
     return fig
 
 
-def main():
+def application(environ, start_response):
     """Make a plot please"""
-    form = cgi.FieldStorage()
+    form = parse_formvars(environ)
     fig = make_plot(form)
 
-    ssw("Content-type: image/png\n\n")
-
     ram = BytesIO()
     fig.savefig(ram, format="png", dpi=100)
-    ram.seek(0)
-    res = ram.read()
-    ssw(res)
-
-
-if __name__ == "__main__":
-    # Go Main
-    main()
+    start_response("200 OK", [("Content-type", "image/png")])
+    return [ram.getvalue()]
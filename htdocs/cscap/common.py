@@ -0,0 +1,79 @@
+"""Some common stuff."""
+import sys
+from io import BytesIO
+
+import pandas as pd
+from matplotlib.figure import Figure
+
+sys.path.append("/opt/datateam/lib")
+from datateam import datadict, export  # noqa
+
+ERRMSG = (
+    "No data found. Check the start date falls within the "
+    "applicable date range for the research site. "
+    "If yes, try expanding the number of days included."
+)
+
+
+def bling_rows(tabname, cols):
+    """Build the description and units header rows for these columns."""
+    metarows = [{}, {}]
+    vardf = datadict.get_vardf("sustainablecorn", tabname)
+    for i, colname in enumerate(cols):
+        if i == 0:
+            metarows[0][colname] = "description"
+            metarows[1][colname] = "units"
+            continue
+        if colname in vardf.index:
+            metarows[0][colname] = vardf.at[colname, "short_description"]
+            metarows[1][colname] = vardf.at[colname, "units"]
+    return metarows
+
+
+def send_error(start_response, viewopt, msg=ERRMSG):
+    """ " """
+    if viewopt == "js":
+        start_response("200 OK", [("Content-type", "application/javascript")])
+        return ("alert('" + ERRMSG + "');").encode("utf-8")
+    # not pyplot, whose figure bookkeeping is shared by the threads
+    fig = Figure()
+    ax = fig.add_subplot(1, 1, 1)
+    ax.text(0.5, 0.5, msg, transform=ax.transAxes, ha="center")
+    start_response("200 OK", [("Content-type", "image/png")])
+    ram = BytesIO()
+    fig.savefig(ram, format="png")
+    return ram.getvalue()
+
+
+def send_table(start_response, df, viewopt, filename, bling=None, freeze=3):
+    """Send the plotted data as a table.
+
+    Args:
+      start_response: the WSGI start_response.
+      df (DataFrame): the data.
+      viewopt (str): html, csv or excel.
+      filename (str): the download's name, less the suffix.
+      bling (callable): optional, takes the columns and returns the header
+        rows following the column names, such as a partial of `bling_rows`.
+      freeze (int): rows to freeze at the top of the excel sheet.
+
+    Returns:
+      bytes
+    """
+    if viewopt == "html":
+        if bling is not None:
+            # all text in the end, so the header rows can join the frame
+            df = pd.concat(
+                [pd.DataFrame(bling(df.columns)), df], ignore_index=True
+            ).reindex(df.columns, axis=1)
+        start_response("200 OK", [("Content-type", "text/html")])
+        return df.to_html(index=False).encode("utf-8")
+    suffix = "xlsx" if viewopt == "excel" else "csv"
+    headers = [
+        ("Content-type", "application/octet-stream"),
+        ("Content-Disposition", f"attachment; filename={filename}.{suffix}"),
+    ]
+    start_response("200 OK", headers)
+    if viewopt != "excel":
+        return b"".join(export.iter_csv(df, bling))
+    return export.to_xlsx(df, "Data", bling, freeze)
@@ -92,6 +92,30 @@ function runfilter(){
 	});
 };
 
+function pollstatus(jobid){
+	// Check back with the server until our queued request is built
+	$.ajax({
+		url: 'status.py',
+		data: {jobid: jobid},
+		success: function(data)
+		{
+			if (data.state == "done"){
+				$("#dlmsg2").show();
+				$("#dlmsg").hide();
+			} else if (data.state == "failed" || data.state == "unknown"){
+				alert("Sorry, script failure occurred :(");
+				$("#dlmsg").hide();
+			} else {
+				setTimeout(function(){ pollstatus(jobid); }, 5000);
+			}
+		},
+		error: function(data)
+		{
+			setTimeout(function(){ pollstatus(jobid); }, 5000);
+		}
+	});
+};
+
 function build_ui(){
 	// Prevent submit
 	$('#mainform').submit(function(e){
@@ -108,8 +132,12 @@ function build_ui(){
 		    data: $(this).serialize(),
 		    success: function(data)
 		    {
-		    	$("#dlmsg2").show();
-		    	$("#dlmsg").hide();
+		    	if (! data.jobid){
+		    		alert(data.msg);
+		    		$("#dlmsg").hide();
+		    		return;
+		    	}
+		    	pollstatus(data.jobid);
 		    },
 		    error: function(data)
 		    {
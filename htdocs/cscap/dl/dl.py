@@ -1,4 +1,3 @@
-#!/usr/bin/env python
 """This is our fancy pants download function
 
 select string_agg(column_name, ', ') from
@@ -8,10 +7,12 @@ select string_agg(column_name, ', ') from
 import sys
 import os
 import re
-import cgi
+import json
 import datetime
+from functools import partial
 import shutil
 import smtplib
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
@@ -19,10 +20,16 @@ from email.mime.multipart import MIMEMultipart
 from pymemcache import Client
 import pandas as pd
 import numpy as np
-from pyiem.util import get_dbconnstr, get_dbconn, ssw, logger
+from paste.request import parse_formvars
+from pyiem.util import logger
 from sqlalchemy import text
 
+sys.path.append("/opt/datateam/lib")
+from datateam import datadict, dbpool, dlcache, export  # noqa
+from datateam import jobqueue, sheetpool  # noqa
+
 LOG = logger()
+QUEUE = "cscap_dl"
 VARNAME_RE = re.compile(r"^[A-Z]+[0-9]$")
 EMAILTEXT = """
 Sustainable Corn CAP - Research and Management Data
@@ -64,7 +71,7 @@ regarding usage and application of the data available at this site.
 
 """
 
-PGCONN = get_dbconnstr("sustainablecorn")
+PGCONN = dbpool.get_engine("sustainablecorn")
 FERTELEM = [
     "nitrogen",
     "phosphorus",
@@ -114,8 +121,26 @@ AGG = {
         "SOIL19.13",
     ],
 }
-# runtime storage
-MEMORY = dict(stamp=datetime.datetime.utcnow())
+# Tables a download may read from, any change to these invalidates the cache
+TABLES = [
+    "data_dictionary_export",
+    "plotids",
+    "xref_rotation",
+    "agronomic_data",
+    "soil_data",
+    "ghg_data",
+    "ipm_data",
+    "operations",
+    "pesticides",
+    "management",
+    "metadata_master",
+    "dwm",
+    "highvalue_notes",
+]
+# Sheets written without the description and units header rows
+NOBLING = ["Data Dictionary", "Residue, Irrigation", "Notes"]
+# runtime storage, each request thread times its own steps
+MEMORY = threading.local()
 ROT_CODES = {
     "ROT10": "ROT7v",
     "ROT11": "ROT8v",
@@ -138,17 +163,54 @@ TIL_CODES = {
 
 def get_vardf(tabname):
     """Get a dataframe of descriptors for this tabname"""
-    return pd.read_sql(
-        """
-        select element_or_value_display_name as varname,
-        number_of_decimal_places_to_round_up::numeric::int as round,
-        short_description, units from data_dictionary_export WHERE
-        spreadsheet_tab = %s
-    """,
-        PGCONN,
-        params=(tabname,),
-        index_col="varname",
-    )
+    return datadict.get_vardf("sustainablecorn", tabname)
+
+
+def pivot_values(df, index):
+    """Reshape the long value column into a column per varname.
+
+    Values keep their dtype, only the keys having more than one value get
+    those values joined into a string.
+    """
+    keys = list(index) + ["varname"]
+    # pivot_table never included rows with null keys
+    df = df.dropna(subset=keys)
+    dups = df.duplicated(subset=keys, keep=False)
+    values = df[~dups].set_index(keys)["value"]
+    if dups.any():
+        joined = (
+            df[dups]
+            .groupby(keys)["value"]
+            .agg(lambda x: " ".join(str(v) for v in x))
+        )
+        values = pd.concat([values, joined])
+    df = values.unstack("varname").sort_index()
+    # only the columns with joined strings need to remain objects
+    return df.infer_objects() if dups.any() else df
+
+
+def round_values(values, places):
+    """Vectorized round() of a float array, with identical results."""
+    result = np.round(values, places)
+    # numpy and round() only disagree when the scaled value is near a tie
+    scaled = np.abs(values * 10.0**places)
+    ties = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    result[ties] = [round(v, places) for v in values[ties].tolist()]
+    return result
+
+
+def round_columns(df, vardf):
+    """Round float columns to their data dictionary decimal places."""
+    for colname in df.columns:
+        if df[colname].dtype.kind != "f":
+            continue
+        places = 0
+        if colname in vardf.index.values:
+            places = vardf.at[colname, "round"]
+        if pd.isnull(places):
+            continue
+        df[colname] = round_values(df[colname].to_numpy(), int(places))
+    return df
 
 
 def replace_varname(varname):
@@ -161,8 +223,8 @@ def replace_varname(varname):
 def pprint(msg):
     """log a pretty message for my debugging fun"""
     utcnow = datetime.datetime.utcnow()
-    delta = (utcnow - MEMORY["stamp"]).total_seconds()
-    MEMORY["stamp"] = utcnow
+    delta = (utcnow - getattr(MEMORY, "stamp", utcnow)).total_seconds()
+    MEMORY.stamp = utcnow
     sys.stderr.write("timedelta: %.3f %s\n" % (delta, msg))
 
 
@@ -205,8 +267,59 @@ def conv(value, detectlimit):
         return value
 
 
-def do_dictionary(writer):
-    """Add Data Dictionary to the spreadsheet"""
+def _conv_distinct(uniques, detectlimit):
+    """conv() the given distinct, non-null values in bulk."""
+    out = np.full(len(uniques), None, dtype=object)
+    strs = pd.Series(uniques, dtype=object).astype(str)
+    missing = strs.isin(["", "n/a", "did not collect"]).to_numpy()
+    below = ~missing & strs.str.startswith("<").to_numpy()
+    other = ~(missing | below)
+    # The bulk of the values are numbers, let pandas parse these in one go
+    idx = np.flatnonzero(other)
+    floats = np.array(pd.to_numeric(strs[other], errors="coerce"), float)
+    parsed = ~np.isnan(floats)
+    out[idx[parsed]] = floats[parsed].tolist()
+    # Free text and anything else pandas refuses gets the exact treatment
+    for i in idx[~parsed]:
+        out[i] = conv(uniques[i], detectlimit)
+    idx = np.flatnonzero(below)
+    if detectlimit == "1" or len(idx) == 0:
+        out[idx] = uniques[idx]
+        return out
+    floats = np.array(
+        pd.to_numeric(strs[below].str.slice(1), errors="coerce"), float
+    )
+    for i in np.flatnonzero(np.isnan(floats)):
+        floats[i] = float(uniques[idx[i]][1:])
+    if detectlimit == "2":
+        out[idx] = (floats / 2.0).tolist()
+    elif detectlimit == "3":
+        out[idx] = (floats / 2**0.5).tolist()
+    elif detectlimit == "4":
+        out[idx] = "M"
+    else:
+        out[idx] = [conv(v, detectlimit) for v in uniques[idx]]
+    return out
+
+
+def conv_series(values, detectlimit):
+    """Vectorized conv() of a Series, with identical results.
+
+    Measurement values repeat a lot, so each distinct value is converted
+    once and the results broadcast back to the rows.
+    """
+    codes, uniques = pd.factorize(values.to_numpy(dtype=object))
+    converted = _conv_distinct(uniques.astype(object), detectlimit)
+    # Give back the same dtype that Series.apply(conv) would infer
+    if len(converted) and all(isinstance(v, float) for v in converted):
+        lookup = np.append(converted.astype(float), np.nan)
+    else:
+        lookup = np.append(converted, None)
+    return pd.Series(lookup[codes], index=values.index, name=values.name)
+
+
+def get_dictionary():
+    """Get the Data Dictionary"""
     df = pd.read_sql(
         """
         SELECT * from data_dictionary_export
@@ -217,6 +330,11 @@ def do_dictionary(writer):
     )
     for col in ["ss_order", "number_of_decimal_places_to_round_up"]:
         df.drop(col, axis=1, inplace=True)
+    return df
+
+
+def do_dictionary(writer, df):
+    """Add Data Dictionary to the spreadsheet"""
     df.to_excel(writer, "Data Dictionary", index=False)
     # Increase column width
     worksheet = writer.sheets["Data Dictionary"]
@@ -227,7 +345,7 @@ def do_dictionary(writer):
     worksheet.set_column("K:K", 60)
 
 
-def do_metadata_master(writer, sites, missing):
+def get_metadata_master(sites, missing):
     """get Metadata master data"""
     df = pd.read_sql(
         text(
@@ -253,12 +371,17 @@ def do_metadata_master(writer, sites, missing):
     df.replace(["None", None, ""], np.nan, inplace=True)
     df.dropna(how="all", inplace=True)
     df.fillna(missing, inplace=True)
+    return df
+
+
+def do_metadata_master(writer, df):
+    """Write Metadata master data"""
     df, worksheet = add_bling(writer, df, "Site Metadata", "Site Metadata")
     worksheet.set_column("A:A", 12)
     worksheet.set_column("L:R", 12)
 
 
-def do_ghg(writer, sites, ghg, years, missing):
+def get_ghg(sites, ghg, years, missing):
     """get GHG data"""
     cols = ", ".join(['%s as "%s"' % (s, s) for s in ghg])
     df = pd.read_sql(
@@ -278,11 +401,16 @@ def do_ghg(writer, sites, ghg, years, missing):
         index_col=None,
     )
     df.fillna(missing, inplace=True)
+    return df
+
+
+def do_ghg(writer, df):
+    """Write GHG data"""
     df, worksheet = add_bling(writer, df, "GHG", "GHG")
     worksheet.set_column("C:C", 12)
 
 
-def do_ipm(writer, sites, ipm, years, missing):
+def get_ipm(sites, ipm, years, missing):
     """get IPM data"""
     cols = ", ".join(ipm)
     df = pd.read_sql(
@@ -302,11 +430,16 @@ def do_ipm(writer, sites, ipm, years, missing):
     )
     df.fillna(missing, inplace=True)
     df.columns = [s.upper() if s.startswith("ipm") else s for s in df.columns]
+    return df
+
+
+def do_ipm(writer, df):
+    """Write IPM data"""
     df, worksheet = add_bling(writer, df, "IPM", "IPM")
     worksheet.set_column("C:C", 12)
 
 
-def do_agronomic(writer, sites, agronomic, years, detectlimit, missing):
+def get_agronomic(sites, agronomic, years, detectlimit, missing):
     """get agronomic data"""
     df = pd.read_sql(
         text(
@@ -327,47 +460,35 @@ def do_agronomic(writer, sites, agronomic, years, detectlimit, missing):
         },
         index_col=None,
     )
-    df["value"] = df["value"].apply(lambda x: conv(x, detectlimit))
-    df = pd.pivot_table(
-        df,
-        index=("uniqueid", "plotid", "year"),
-        values="value",
-        columns=("varname",),
-        aggfunc=lambda x: " ".join(str(v) for v in x),
-    )
+    df["value"] = conv_series(df["value"], detectlimit)
+    df = pivot_values(df, ("uniqueid", "plotid", "year"))
     # fix column names
     df.columns = map(replace_varname, df.columns)
-    vardf = get_vardf("Agronomic")
-    for colname in df.columns:
-        places = 0
-        if colname in vardf.index.values:
-            places = vardf.at[colname, "round"]
-        df[colname] = pd.to_numeric(df[colname], errors="coerce")
-        df[colname] = df[colname].apply(
-            (
-                lambda x: round(x, int(places))
-                if isinstance(x, (int, float))
-                else x
-            )
-        )
+    # Agronomic values are always numbers
+    objcols = df.columns[df.dtypes == object]
+    df[objcols] = df[objcols].apply(pd.to_numeric, errors="coerce")
+    df = round_columns(df, get_vardf("Agronomic"))
     # reorder columns
     cols = df.columns.values.tolist()
     cols.sort()
     df = df.reindex(cols, axis=1)
-    # String aggregate above creates a mixture of None and "None"
+    # Make sure all empty cells are NaN prior to filling
     df.replace(["None", None], np.nan, inplace=True)
     df.dropna(how="all", inplace=True)
     df.fillna(missing, inplace=True)
     df.reset_index(inplace=True)
     valid2date(df)
+    return df
+
+
+def do_agronomic(writer, df):
+    """Write agronomic data"""
     df, _worksheet = add_bling(writer, df, "Agronomic", "Agronomic")
 
 
-def add_bling(writer, df, sheetname, tabname):
-    """Do fancy things"""
-    # Insert some headers rows
+def bling_rows(tabname, cols):
+    """Build the description and units header rows for these columns."""
     metarows = [{}, {}]
-    cols = df.columns
     vardf = get_vardf(tabname)
     for i, colname in enumerate(cols):
         if i == 0:
@@ -377,6 +498,14 @@ def add_bling(writer, df, sheetname, tabname):
         if colname in vardf.index:
             metarows[0][colname] = vardf.at[colname, "short_description"]
             metarows[1][colname] = vardf.at[colname, "units"]
+    return metarows
+
+
+def add_bling(writer, df, sheetname, tabname):
+    """Do fancy things"""
+    # Insert some headers rows
+    cols = df.columns
+    metarows = bling_rows(tabname, cols)
     df = pd.concat([pd.DataFrame(metarows), df], ignore_index=True)
     # re-establish the correct column sorting
     df = df.reindex(cols, axis=1)
@@ -386,7 +515,7 @@ def add_bling(writer, df, sheetname, tabname):
     return df, worksheet
 
 
-def do_soil(writer, sites, soil, years, detectlimit, missing):
+def get_soil(sites, soil, years, detectlimit, missing):
     """get soil data"""
     # pprint("do_soil: " + str(soil))
     # pprint("do_soil: " + str(sites))
@@ -413,44 +542,20 @@ def do_soil(writer, sites, soil, years, detectlimit, missing):
         index_col=None,
     )
     pprint("do_soil() query done")
-    df["value"] = df["value"].apply(lambda x: conv(x, detectlimit))
+    df["value"] = conv_series(df["value"], detectlimit)
     pprint("do_soil() value replacement done")
-    df = pd.pivot_table(
-        df,
-        index=(
-            "uniqueid",
-            "plotid",
-            "depth",
-            "subsample",
-            "year",
-            "sampledate",
-        ),
-        values="value",
-        columns=("varname",),
-        aggfunc=lambda x: " ".join(str(v) for v in x),
+    df = pivot_values(
+        df, ("uniqueid", "plotid", "depth", "subsample", "year", "sampledate")
     )
     # fix column names
     df.columns = map(replace_varname, df.columns)
-    vardf = get_vardf("Soil")
-    for colname in df.columns:
-        places = 0
-        if colname in vardf.index.values:
-            places = vardf.at[colname, "round"]
-        if pd.isnull(places):
-            continue
-        df[colname] = pd.to_numeric(df[colname], errors="ignore")
-        df[colname] = df[colname].apply(
-            (
-                lambda x: round(x, int(places))
-                if isinstance(x, (int, float))
-                else x
-            )
-        )
+    # Columns with text in them are not rounded
+    df = round_columns(df, get_vardf("Soil"))
     # reorder columns
     cols = df.columns.values.tolist()
     cols.sort()
     df = df.reindex(cols, axis=1)
-    # String aggregate above creates a mixture of None and "None"
+    # Make sure all empty cells are NaN prior to filling
     df.replace(["None", None], np.nan, inplace=True)
     pprint(
         "do_soil() len of inbound df %s"
@@ -470,11 +575,16 @@ def do_soil(writer, sites, soil, years, detectlimit, missing):
             )
         )
     )
-    pprint("do_soil() pivot_table done")
+    pprint("do_soil() pivot done")
     df.reset_index(inplace=True)
     df["sampledate"] = df["sampledate"].replace("", missing)
     valid2date(df)
     pprint("do_soil() valid2date done")
+    return df
+
+
+def do_soil(writer, df):
+    """Write soil data"""
     df, worksheet = add_bling(writer, df, "Soil", "Soil")
     pprint("do_soil() to_excel done")
     workbook = writer.book
@@ -482,7 +592,7 @@ def do_soil(writer, sites, soil, years, detectlimit, missing):
     worksheet.set_column("B:B", 12, format1)
 
 
-def do_operations(writer, sites, years, missing):
+def get_operations(sites, years, missing):
     """Return a DataFrame for the operations"""
     opdf = pd.read_sql(
         text(
@@ -529,6 +639,11 @@ def do_operations(writer, sites, years, missing):
         del opdf[elem]
     valid2date(opdf)
     del opdf["productrate"]
+    return opdf
+
+
+def do_operations(writer, opdf):
+    """Write the operations"""
     opdf, worksheet = add_bling(
         writer, opdf, "Field Operations", "Field Operations"
     )
@@ -537,7 +652,7 @@ def do_operations(writer, sites, years, missing):
     worksheet.set_column("M:N", 12)
 
 
-def do_management(writer, sites, years):
+def get_management(sites, years):
     """Return a DataFrame for the management"""
     opdf = pd.read_sql(
         text(
@@ -553,10 +668,15 @@ def do_management(writer, sites, years):
         PGCONN,
         params={"sites": tuple(sites), "years": tuple(years)},
     )
+    return opdf
+
+
+def do_management(writer, opdf):
+    """Write the management"""
     opdf.to_excel(writer, "Residue, Irrigation", index=False)
 
 
-def do_pesticides(writer, sites, years):
+def get_pesticides(sites, years):
     """Return a DataFrame for the pesticides"""
     opdf = pd.read_sql(
         text(
@@ -578,12 +698,17 @@ def do_pesticides(writer, sites, years):
         params={"sites": tuple(sites), "years": tuple(years)},
     )
     valid2date(opdf)
+    return opdf
+
+
+def do_pesticides(writer, opdf):
+    """Write the pesticides"""
     opdf, worksheet = add_bling(writer, opdf, "Pesticides", "Pesticides")
     worksheet.set_column("D:D", 12)
 
 
-def do_plotids(writer, sites):
-    """Write plotids to the spreadsheet"""
+def get_plotids(sites):
+    """Get the plotids"""
     opdf = pd.read_sql(
         text(
             """
@@ -623,6 +748,11 @@ def do_plotids(writer, sites):
     opdf.replace({"rotation": ROT_CODES}, inplace=True)
     # Fake tillage codes
     opdf.replace({"tillage": TIL_CODES}, inplace=True)
+    return opdf
+
+
+def do_plotids(writer, opdf):
+    """Write plotids to the spreadsheet"""
     opdf, worksheet = add_bling(
         writer, opdf[opdf.columns], "Plot Identifiers", "Plot Identifiers"
     )
@@ -632,8 +762,8 @@ def do_plotids(writer, sites):
     worksheet.set_column("B:B", 12, format1)
 
 
-def do_notes(writer, sites, missing):
-    """Write notes to the spreadsheet"""
+def get_notes(sites, missing):
+    """Get the notes"""
     opdf = pd.read_sql(
         text(
             """
@@ -651,6 +781,11 @@ def do_notes(writer, sites, missing):
     opdf.replace(["None", None, ""], np.nan, inplace=True)
     opdf.dropna(how="all", inplace=True)
     opdf.fillna(missing, inplace=True)
+    return opdf
+
+
+def do_notes(writer, opdf):
+    """Write notes to the spreadsheet"""
     opdf[opdf.columns].to_excel(writer, "Notes", index=False)
     # Increase column width
     worksheet = writer.sheets["Notes"]
@@ -659,8 +794,8 @@ def do_notes(writer, sites, missing):
     worksheet.set_column("E:G", 36)
 
 
-def do_dwm(writer, sites, missing):
-    """Write dwm to the spreadsheet"""
+def get_dwm(sites, missing):
+    """Get the dwm"""
     opdf = pd.read_sql(
         text(
             """
@@ -676,6 +811,11 @@ def do_dwm(writer, sites, missing):
     opdf.replace(["None", None, ""], np.nan, inplace=True)
     opdf.dropna(how="all", inplace=True)
     opdf.fillna(missing, inplace=True)
+    return opdf
+
+
+def do_dwm(writer, opdf):
+    """Write dwm to the spreadsheet"""
     _df, worksheet = add_bling(
         writer,
         opdf[opdf.columns],
@@ -686,100 +826,153 @@ def do_dwm(writer, sites, missing):
     worksheet.set_column("H:H", 30)
 
 
-def do_work(form):
-    """do great things"""
-    agree = form.getfirst("agree")
-    if agree != "AGREE":
-        ssw("Content-type: text/plain\n\n")
-        ssw("You did not agree to download terms.")
-        return
-    email = form.getfirst("email")
-    sites = form.getlist("sites[]")
+def write_csv(sheetname, zfh, df):
+    """Write a sheet as a csv file within the zip file."""
+    bling = None if sheetname in NOBLING else partial(bling_rows, sheetname)
+    csvname = re.sub("[^a-z0-9]+", "_", sheetname.lower()).strip("_")
+    export.write_csv(zfh, f"{csvname}.csv", df, bling)
+
+
+def get_request(form):
+    """Normalize the submitted form into a job payload."""
+    sites = form.getall("sites[]")
     if not sites:
         sites.append("XXX")
-    # treatments = form.getlist('treatments[]')
-    agronomic = redup(form.getlist("agronomic[]"))
-    soil = redup(form.getlist("soil[]"))
-    ghg = redup(form.getlist("ghg[]"))
-    # water = redup(form.getlist('water[]'))
-    ipm = redup(form.getlist("ipm[]"))
-    years = redup(form.getlist("year[]"))
+    # treatments = form.getall('treatments[]')
+    agronomic = redup(form.getall("agronomic[]"))
+    soil = redup(form.getall("soil[]"))
+    ghg = redup(form.getall("ghg[]"))
+    # water = redup(form.getall('water[]'))
+    ipm = redup(form.getall("ipm[]"))
+    years = redup(form.getall("year[]"))
     if not years:
         years = ["2011", "2012", "2013", "2014", "2015"]
-    shm = redup(form.getlist("shm[]"))
-    missing = form.getfirst("missing", "M")
+    shm = redup(form.getall("shm[]"))
+    missing = form.get("missing", "M")
     if missing == "__custom__":
-        missing = form.getfirst("custom_missing", "M")
-    pprint("Missing is %s" % (missing,))
+        missing = form.get("custom_missing", "M")
     if years:
         years = [str(s) for s in range(2011, 2016)]
-    detectlimit = form.getfirst("detectlimit", "1")
-
-    writer = pd.ExcelWriter("/tmp/cscap.xlsx", engine="xlsxwriter")
+    return {
+        "email": form.get("email"),
+        "sites": sites,
+        "agronomic": agronomic,
+        "soil": soil,
+        "ghg": ghg,
+        "ipm": ipm,
+        "years": years,
+        "shm": shm,
+        "missing": missing,
+        "detectlimit": form.get("detectlimit", "1"),
+        "format": "csv" if form.get("format") == "csv" else "xlsx",
+    }
+
+
+def write_workbook(filename, req):
+    """Write the requested sheets to the given spreadsheet filename."""
+    sites = req["sites"]
+    agronomic = req["agronomic"]
+    soil = req["soil"]
+    ghg = req["ghg"]
+    ipm = req["ipm"]
+    years = req["years"]
+    shm = req["shm"]
+    missing = req["missing"]
+    detectlimit = req["detectlimit"]
+    pprint("Missing is %s" % (missing,))
 
+    sheets = []
     # First sheet is Data Dictionary
     if "SHM5" in shm:
-        do_dictionary(writer)
-        pprint("do_dictionary() is done")
-
+        sheets.append(("Data Dictionary", get_dictionary, do_dictionary))
     # Sheet two is plot IDs
     if "SHM4" in shm:
-        do_plotids(writer, sites)
-        pprint("do_plotids() is done")
-
+        sheets.append(
+            ("Plot Identifiers", partial(get_plotids, sites), do_plotids)
+        )
     # Measurement Data
     if agronomic:
-        do_agronomic(writer, sites, agronomic, years, detectlimit, missing)
-        pprint("do_agronomic() is done")
+        getter = partial(
+            get_agronomic, sites, agronomic, years, detectlimit, missing
+        )
+        sheets.append(("Agronomic", getter, do_agronomic))
     if soil:
-        do_soil(writer, sites, soil, years, detectlimit, missing)
-        pprint("do_soil() is done")
+        getter = partial(get_soil, sites, soil, years, detectlimit, missing)
+        sheets.append(("Soil", getter, do_soil))
     if ghg:
-        do_ghg(writer, sites, ghg, years, missing)
-        pprint("do_ghg() is done")
+        getter = partial(get_ghg, sites, ghg, years, missing)
+        sheets.append(("GHG", getter, do_ghg))
     if ipm:
-        do_ipm(writer, sites, ipm, years, missing)
-        pprint("do_ipm() is done")
+        getter = partial(get_ipm, sites, ipm, years, missing)
+        sheets.append(("IPM", getter, do_ipm))
 
     # Management
     # Field Operations
     if "SHM1" in shm:
-        do_operations(writer, sites, years, missing)
-        pprint("do_operations() is done")
+        getter = partial(get_operations, sites, years, missing)
+        sheets.append(("Field Operations", getter, do_operations))
     # Pesticides
     if "SHM2" in shm:
-        do_pesticides(writer, sites, years)
-        pprint("do_pesticides() is done")
+        getter = partial(get_pesticides, sites, years)
+        sheets.append(("Pesticides", getter, do_pesticides))
     # Residue and Irrigation
     if "SHM3" in shm:
-        do_management(writer, sites, years)
-        pprint("do_management() is done")
+        getter = partial(get_management, sites, years)
+        sheets.append(("Residue, Irrigation", getter, do_management))
     # Site Metadata
     if "SHM8" in shm:
-        do_metadata_master(writer, sites, missing)
-        pprint("do_metadata_master() is done")
+        getter = partial(get_metadata_master, sites, missing)
+        sheets.append(("Site Metadata", getter, do_metadata_master))
     # Drainage Management
     if "SHM7" in shm:
-        do_dwm(writer, sites, missing)
-        pprint("do_dwm() is done")
+        getter = partial(get_dwm, sites, missing)
+        sheets.append(("Drainage Control Structure Mngt", getter, do_dwm))
     # Notes
     if "SHM6" in shm:
-        do_notes(writer, sites, missing)
-        pprint("do_notes() is done")
+        sheets.append(("Notes", partial(get_notes, sites, missing), do_notes))
 
-    # Send to client
+    if req.get("format") == "csv":
+        with export.open_csvzip(filename) as zfh:
+            sheetpool.build_sheets(
+                zfh, [(s[0], s[1], partial(write_csv, s[0])) for s in sheets]
+            )
+        pprint("build_sheets() is done")
+        return
+    writer = pd.ExcelWriter(filename, engine="xlsxwriter")
+    sheetpool.build_sheets(writer, sheets)
+    pprint("build_sheets() is done")
     writer.close()
+
+
+def build_workbook(job):
+    """Build the spreadsheet for a queued job and email out the link."""
+    req = job["payload"]
+    email = req["email"]
+    tmpfn = "cscap_%s.%s" % (
+        job["jobid"],
+        "zip" if req.get("format") == "csv" else "xlsx",
+    )
+    pgconn = dbpool.get_dbconn("sustainablecorn")
+    versions = dlcache.table_versions(pgconn.cursor(), TABLES)
+    pgconn.close()
+    key = None
+    if versions is not None:
+        key = dlcache.request_key("cscap", req, versions)
+    if key is None or not dlcache.fetch(key, f"/var/webtmp/{tmpfn}"):
+        write_workbook(f"/tmp/{tmpfn}", req)
+        shutil.copyfile(f"/tmp/{tmpfn}", f"/var/webtmp/{tmpfn}")
+        os.unlink(f"/tmp/{tmpfn}")
+        if key is not None:
+            dlcache.store(key, f"/var/webtmp/{tmpfn}")
+
+    # Send to client
     msg = MIMEMultipart()
     msg["Subject"] = "Sustainable Corn CAP Dataset"
     msg["From"] = "ISU Data Team <isudatateam@iastate.edu>"
     msg["To"] = email
     msg.preamble = "Data"
     # conservative limit of 8 MB
-    # if os.stat('/tmp/cscap.xlsx').st_size > 8000000:
-    tmpfn = ("cscap_%s.xlsx") % (
-        datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S"),
-    )
-    shutil.copyfile("/tmp/cscap.xlsx", "/var/webtmp/%s" % (tmpfn,))
+    # if os.stat(f"/var/webtmp/{tmpfn}").st_size > 8000000:
     uri = "https://datateam.agron.iastate.edu/tmp/%s" % (tmpfn,)
     etext = EMAILTEXT % (
         datetime.datetime.utcnow().strftime("%d %B %Y %H:%M:%S"),
@@ -790,7 +983,7 @@ def do_work(form):
     # else:
     #    msg.attach(MIMEText(EMAILTEXT))
     #    part = MIMEBase('application', "octet-stream")
-    #    part.set_payload(open('/tmp/cscap.xlsx', 'rb').read())
+    #    part.set_payload(open(f'/var/webtmp/{tmpfn}', 'rb').read())
     #    encoders.encode_base64(part)
     #    part.add_header('Content-Disposition',
     #                    'attachment; filename="cscap.xlsx"')
@@ -798,21 +991,39 @@ def do_work(form):
     _s = smtplib.SMTP("localhost")
     _s.sendmail(msg["From"], msg["To"], msg.as_string())
     _s.quit()
-    os.unlink("/tmp/cscap.xlsx")
-    ssw("Content-type: text/plain\n\n")
-    ssw("Email Delivered!")
-    pgconn = get_dbconn("sustainablecorn")
+    pprint("is done!!!")
+    return uri
+
+
+def refuse(start_response, msg):
+    """Tell the client no, and why, in place of a job identifier."""
+    start_response("200 OK", [("Content-type", "application/json")])
+    res = {"jobid": None, "state": "refused", "msg": msg}
+    return json.dumps(res).encode("utf-8")
+
+
+def do_work(form, start_response):
+    """Queue up the request and tell the client the job identifier."""
+    agree = form.get("agree")
+    if agree != "AGREE":
+        return refuse(start_response, "You did not agree to download terms.")
+    payload = get_request(form)
+    jobid = jobqueue.enqueue(QUEUE, payload)
+    pprint("Queued job %s" % (jobid,))
+    pgconn = dbpool.get_dbconn("sustainablecorn")
     cursor = pgconn.cursor()
     cursor.execute(
         "INSERT into website_downloads(email) values (%s)",
-        (email,),
+        (payload["email"],),
     )
     cursor.close()
     pgconn.commit()
-    pprint("is done!!!")
+    pgconn.close()
+    start_response("200 OK", [("Content-type", "application/json")])
+    return json.dumps({"jobid": jobid, "state": "queued"}).encode("utf-8")
 
 
-def preventive_log(pgconn):
+def preventive_log(pgconn, environ):
     """Mostly prevent scripting."""
     cursor = pgconn.cursor()
     for _ in range(4):
@@ -820,9 +1031,9 @@ def preventive_log(pgconn):
             "INSERT into weblog(client_addr, uri, referer, http_status) "
             "VALUES (%s, %s, %s, %s)",
             (
-                os.environ.get("REMOTE_ADDR"),
-                os.environ.get("REQUEST_URI", ""),
-                os.environ.get("HTTP_REFERER"),
+                environ.get("REMOTE_ADDR"),
+                environ.get("REQUEST_URI", ""),
+                environ.get("HTTP_REFERER"),
                 404,
             ),
         )
@@ -830,9 +1041,9 @@ def preventive_log(pgconn):
     cursor.close()
 
 
-def throttle():
+def throttle(environ):
     """Prevent the script kiddies."""
-    addr = os.environ.get("REMOTE_ADDR")
+    addr = environ.get("REMOTE_ADDR")
     key = (f"{addr}_datateam_dl").encode("utf-8")
     mc = Client("iem-memcached")
     if mc.get(key):
@@ -844,23 +1055,14 @@ def throttle():
     return False
 
 
-def main():
+def application(environ, start_response):
     """Do Stuff"""
-    with get_dbconn("mesosite") as pgconn:
-        preventive_log(pgconn)
-        pgconn.commit()
-    if throttle():
-        ssw("Content-type: text/plain\n\n")
-        ssw("You did not agree to download terms.")
-        return
-    form = cgi.FieldStorage()
-    do_work(form)
-
-
-if __name__ == "__main__":
-    # do_soil(None, ['MASON', ],
-    #        ['SOIL15', ],
-    #        ['2015', ], '', 'daryl')
-    # writer = pd.ExcelWriter("/tmp/cscap.xlsx", engine='xlsxwriter')
-    # do_dictionary(writer)
-    main()
+    pgconn = dbpool.get_dbconn("mesosite")
+    preventive_log(pgconn, environ)
+    pgconn.commit()
+    pgconn.close()
+    if throttle(environ):
+        msg = "Too many requests, please wait a few seconds and try again."
+        return [refuse(start_response, msg)]
+    form = parse_formvars(environ)
+    return [do_work(form, start_response)]
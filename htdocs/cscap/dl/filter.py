@@ -1,4 +1,3 @@
-#!/usr/bin/env python
 """This is our fancy pants filter function.
 
 We end up return a JSON document that lists out what is possible
@@ -10,11 +9,11 @@ We end up return a JSON document that lists out what is possible
 """
 import json
 import sys
-import cgi
 
-import pandas as pd
-from pyiem.util import get_dbconnstr, ssw
-from sqlalchemy import text
+from paste.request import parse_formvars
+
+sys.path.append("/opt/datateam/lib")
+from datateam import availability, dbpool, respcache  # noqa
 
 # NOTE: filter.py is upstream for this table, copy to dl.py
 AGG = {
@@ -81,7 +80,7 @@ def agg(arr):
 
 def do_filter(form):
     """Go."""
-    pgconn = get_dbconnstr("sustainablecorn")
+    pgconn = dbpool.get_dbconn("sustainablecorn")
     res = {
         "treatments": [],
         "agronomic": [],
@@ -91,182 +90,53 @@ def do_filter(form):
         "ipm": [],
         "year": [],
     }
-    sites = agg(form.getlist("sites[]"))
-    treatments = agg(form.getlist("treatments[]"))
-    agronomic = agg(form.getlist("agronomic[]"))
-    soil = agg(form.getlist("soil[]"))
-    ghg = agg(form.getlist("ghg[]"))
-    # water = agg(form.getlist("water[]"))
-    # ipm = agg(form.getlist("ipm[]"))
-    # year = agg(form.getlist("year[]"))
-
+    sites = agg(form.getall("sites[]"))
+    treatments = agg(form.getall("treatments[]"))
+    agronomic = agg(form.getall("agronomic[]"))
+    soil = agg(form.getall("soil[]"))
+    ghg = agg(form.getall("ghg[]"))
+    # water = agg(form.getall("water[]"))
+    # ipm = agg(form.getall("ipm[]"))
+    # year = agg(form.getall("year[]"))
+
+    index = availability.get_index(pgconn)
+    pgconn.close()
     # build a list of treatments based on the sites selected
-    df = pd.read_sql(
-        text(
-            """
-        SELECT distinct tillage, rotation, drainage, nitrogen,
-        landscape from plotids where uniqueid in :sites
-        """
-        ),
-        pgconn,
-        params={"sites": tuple(sites)},
-        index_col=None,
-    )
-    arr = []
-    for col in ["tillage", "rotation", "drainage", "nitrogen", "landscape"]:
-        for v in df[col].unique():
-            if v is None:
-                continue
-            arr.append(v)
-    res["treatments"] = redup(arr)
+    res["treatments"] = redup(index.treatments(sites))
 
     # build a list of agronomic data based on the plotids and sites
-    a = {}
-    arsql = []
-    args = {"sites": tuple(sites)}
-    for lc, col in zip(
-        ["TIL", "ROT", "DWM", "NIT", "LND"],
-        ["tillage", "rotation", "drainage", "nitrogen", "landscape"],
-    ):
-        a[lc] = [b for b in treatments if b.startswith(lc)]
+    plots = index.site_plots(sites)
+    inplots = index.plot_mask(plots)
+    for i, lc in enumerate(["TIL", "ROT", "DWM", "NIT", "LND"]):
+        codes = [b for b in treatments if b.startswith(lc)]
         if lc == "LND":
-            a[lc].append("n/a")
-        if len(a[lc]) > 0:
-            arsql.append(f" {col} in :{col}")
-            args[col] = tuple(a[lc])
-    if len(arsql) == 0:
-        sql = ""
-    else:
-        sql = " and "
-        sql = sql + " and ".join(arsql)
+            codes.append("n/a")
+        if codes:
+            plots = {k: v for k, v in plots.items() if v[i] in codes}
+    mask = index.plot_mask(plots)
+    res["agronomic"] = redup(index.varnames("agronomic", mask))
+    res["soil"] = redup(index.varnames("soil", mask))
 
-    df = pd.read_sql(
-        text(
-            f"""
-    with myplotids as (
-        SELECT uniqueid, plotid, nitrogen from plotids
-        WHERE uniqueid in :sites {sql}
-    )
-    SELECT distinct varname from agronomic_data a, myplotids p
-    WHERE a.uniqueid = p.uniqueid and a.plotid = p.plotid and
-    a.value not in ('n/a', 'did not collect')
-    """
-        ),
-        pgconn,
-        params=args,
-        index_col=None,
-    )
-    if not df.empty:
-        res["agronomic"] = redup(df["varname"].values.tolist())
-
-    # build a list of soil data based on the plotids and sites
-    df = pd.read_sql(
-        text(
-            f"""
-    with myplotids as (
-        SELECT uniqueid, plotid from plotids
-        WHERE uniqueid in :sites {sql}
-    )
-    SELECT distinct varname from soil_data a, myplotids p
-    WHERE a.uniqueid = p.uniqueid and a.plotid = p.plotid and
-    a.value not in ('n/a', 'did not collect')
-    """
-        ),
-        pgconn,
-        params=args,
-        index_col=None,
-    )
-    if not df.empty:
-        res["soil"] = redup(df["varname"].values.tolist())
-
-    # Figure out which GHG variables we have
-    df = pd.read_sql(
-        text(
-            """
-    with myplotids as (
-        SELECT uniqueid, plotid from plotids
-        WHERE uniqueid in :sites
-    )
-    SELECT * from ghg_data a, myplotids p
-    WHERE a.uniqueid = p.uniqueid and a.plotid = p.plotid
-    """
-        ),
-        pgconn,
-        params={"sites": tuple(sites)},
-        index_col=None,
-    )
-    if not df.empty:
-        for i in range(1, 17):
-            col = "ghg%02i" % (i,)
-            if len(df[df[col].notnull()].index) > 0:
-                res["ghg"].append(col.upper())
-
-    # Figure out which IPM variables we have
-    df = pd.read_sql(
-        text(
-            """
-    with myplotids as (
-        SELECT uniqueid, plotid from plotids
-        WHERE uniqueid in :sites
-    )
-    SELECT * from ipm_data a, myplotids p
-    WHERE a.uniqueid = p.uniqueid and a.plotid = p.plotid
-    """
-        ),
-        pgconn,
-        params={"sites": tuple(sites)},
-        index_col=None,
-    )
-    if not df.empty:
-        for i in range(1, 15):
-            col = "ipm%02i" % (i,)
-            if len(df[df[col].notnull()].index) > 0:
-                res["ipm"].append(col.upper())
+    # Figure out which GHG and IPM variables we have
+    res["ghg"] = index.varnames("ghg", inplots)
+    res["ipm"] = index.varnames("ipm", inplots)
 
     # Compute which years we have data for these locations
-    _g = [" %s is not null " % (g,) for g in ghg if g != "ZZZ"]
-    ghglimiter = "1 = 2"
-    if _g:
-        ghglimiter = "( %s )" % ("or".join(_g),)
-    df = pd.read_sql(
-        text(
-            f"""
-    WITH soil_years as (
-        SELECT distinct year from soil_data where varname in :soils
-        and uniqueid in :sites and value not in ('n/a', 'did not collect')),
-    agronomic_years as (
-        SELECT distinct year from agronomic_data where varname in :ags
-        and uniqueid in :sites and value not in ('n/a', 'did not collect')),
-    ghg_years as (
-        SELECT distinct year from ghg_data where uniqueid in :sites
-        and {ghglimiter}),
-    agg as (SELECT year from soil_years UNION select year from agronomic_years
-        UNION select year from ghg_years)
-
-    SELECT distinct year from agg ORDER by year
-    """
-        ),
-        pgconn,
-        params={
-            "soils": tuple(soil),
-            "sites": tuple(sites),
-            "ags": tuple(agronomic),
-        },
-        index_col=None,
+    mask = (
+        index.variable_mask("soil", soil)
+        | index.variable_mask("agronomic", agronomic)
+        | index.variable_mask("ghg", [g.upper() for g in ghg])
     )
-    for _, row in df.iterrows():
-        res["year"].append(float(row["year"]))
+    for year in index.year_list(mask & index.site_mask(sites)):
+        res["year"].append(float(year))
 
     return res
 
 
-def main():
+@respcache.wsgi("cscap/dl/filter")
+def application(environ, start_response):
     """Do Stuff"""
-    ssw("Content-type: application/json\n\n")
-    form = cgi.FieldStorage()
+    start_response("200 OK", [("Content-type", "application/json")])
+    form = parse_formvars(environ)
     res = do_filter(form)
-    ssw(json.dumps(res))
-
-
-if __name__ == "__main__":
-    main()
+    return [json.dumps(res).encode("utf-8")]
@@ -0,0 +1,32 @@
+"""Report on the status of a queued download request."""
+import sys
+import json
+
+from paste.request import parse_formvars
+
+sys.path.append("/opt/datateam/lib")
+from datateam import jobqueue  # noqa
+
+QUEUE = "cscap_dl"
+# Only these job attributes are shared with the client
+PUBLIC = [
+    "jobid",
+    "state",
+    "queued_at",
+    "started_at",
+    "finished_at",
+    "wait_seconds",
+    "run_seconds",
+]
+
+
+def application(environ, start_response):
+    """Do Stuff"""
+    form = parse_formvars(environ)
+    job = jobqueue.get_job(QUEUE, form.get("jobid"))
+    start_response("200 OK", [("Content-type", "application/json")])
+    if job is None:
+        res = {"jobid": None, "state": "unknown"}
+    else:
+        res = {key: job.get(key) for key in PUBLIC}
+    return [json.dumps(res).encode("utf-8")]
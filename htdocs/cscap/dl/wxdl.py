@@ -1,14 +1,15 @@
-#!/usr/bin/env python
 """Download weather data, please"""
-import os
-import cgi
+import sys
 import datetime
 
 import pandas as pd
-from pyiem.util import get_dbconnstr, ssw
+from paste.request import parse_formvars
 from pyiem.datatypes import distance, temperature
 from sqlalchemy import text
 
+sys.path.append("/opt/datateam/lib")
+from datateam import dbpool, export  # noqa
+
 VARDF = {
     "uniqueid": "",
     "day": "",
@@ -51,12 +52,12 @@ def sane_date(year, month, day):
 def get_cgi_dates(form):
     """Figure out which dates are requested via the form, we shall attempt
     to account for invalid dates provided!"""
-    y1 = int(form.getfirst("year1"))
-    m1 = int(form.getfirst("month1"))
-    d1 = int(form.getfirst("day1"))
-    y2 = int(form.getfirst("year2"))
-    m2 = int(form.getfirst("month2"))
-    d2 = int(form.getfirst("day2"))
+    y1 = int(form.get("year1"))
+    m1 = int(form.get("month1"))
+    d1 = int(form.get("day1"))
+    y2 = int(form.get("year2"))
+    m2 = int(form.get("month2"))
+    d2 = int(form.get("day2"))
 
     ets = sane_date(y2, m2, d2)
     archive_end = datetime.date.today() - datetime.timedelta(days=1)
@@ -66,10 +67,23 @@ def get_cgi_dates(form):
     return [sane_date(y1, m1, d1), ets]
 
 
-def do_work(form):
+def bling_rows(cols):
+    """Build the description and units header rows for these columns."""
+    metarows = [{}, {}]
+    for i, colname in enumerate(cols):
+        if i == 0:
+            metarows[0][colname] = "description"
+            metarows[1][colname] = "units"
+            continue
+        metarows[0][colname] = VARDF.get(colname, "")
+        metarows[1][colname] = UVARDF.get(colname, "")
+    return metarows
+
+
+def do_work(form, start_response):
     """do great things"""
-    pgconn = get_dbconnstr("sustainablecorn")
-    stations = form.getlist("stations")
+    pgconn = dbpool.get_engine("sustainablecorn")
+    stations = form.getall("stations")
     if not stations:
         stations.append("XXX")
     sts, ets = get_cgi_dates(form)
@@ -91,39 +105,20 @@ def do_work(form):
     df["lowc"] = temperature(df["low"].values, "F").value("C")
     df["precipmm"] = distance(df["precip"].values, "IN").value("MM")
 
-    metarows = [{}, {}]
-    cols = df.columns
-    for i, colname in enumerate(cols):
-        if i == 0:
-            metarows[0][colname] = "description"
-            metarows[1][colname] = "units"
-            continue
-        metarows[0][colname] = VARDF.get(colname, "")
-        metarows[1][colname] = UVARDF.get(colname, "")
-    df = pd.concat([pd.DataFrame(metarows), df], ignore_index=True)
-    # re-establish the correct column sorting
-    df = df.reindex(cols, axis=1)
-
-    writer = pd.ExcelWriter("/tmp/ss.xlsx", engine="xlsxwriter")
-    df.to_excel(writer, "Daily Weather", index=False)
-    worksheet = writer.sheets["Daily Weather"]
-    worksheet.freeze_panes(3, 0)
-    writer.close()
+    res = export.to_xlsx(df, "Daily Weather", bling_rows, freeze=3)
 
     fn = ",".join(stations)
     if len(stations) > 3:
         fn = "cscap"
-    ssw("Content-type: application/vnd.ms-excel\n")
-    ssw(f"Content-Disposition: attachment;Filename=wx_{fn}.xls\n\n")
-    ssw(open("/tmp/ss.xlsx", "rb").read())
-    os.unlink("/tmp/ss.xlsx")
+    headers = [
+        ("Content-type", "application/vnd.ms-excel"),
+        ("Content-Disposition", f"attachment;Filename=wx_{fn}.xls"),
+    ]
+    start_response("200 OK", headers)
+    return res
 
 
-def main():
+def application(environ, start_response):
     """Do Stuff"""
-    form = cgi.FieldStorage()
-    do_work(form)
-
-
-if __name__ == "__main__":
-    main()
+    form = parse_formvars(environ)
+    return [do_work(form, start_response)]
@@ -1,20 +1,15 @@
-#!/usr/bin/env python
 """Management Table used by cover crop paper"""
 import sys
-import cgi
 import subprocess
 import datetime
-import os
 
 from pandas.io.sql import read_sql
-from pyiem.util import get_dbconn, ssw
+from paste.request import parse_formvars
 
-DBCONN = get_dbconn("sustainablecorn")
-cursor = DBCONN.cursor()
+sys.path.append("/opt/datateam/lib")
+from datateam import dbpool  # noqa
 
 ALL = " ALL SITES"
-varorder = []
-varlookup = {}
 
 COVER_SITES = [
     "MASON",
@@ -33,9 +28,10 @@ D7 = datetime.timedelta(days=7)
 
 def reload_data():
     """Run the sync script to download data from Google"""
-    os.chdir("/opt/datateam/scripts/cscap")
+    # not chdir, that would move the whole WSGI process
     proc = subprocess.Popen(
         "python harvest_management.py",
+        cwd="/opt/datateam/scripts/cscap",
         shell=True,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
@@ -50,15 +46,15 @@ def reload_data():
     )
 
 
-def main():
+def application(environ, start_response):
     """Go Main"""
-    ssw("Content-type: text/html\n\n")
-
-    form = cgi.FieldStorage()
+    form = parse_formvars(environ)
     reloadres = ""
-    if form.getfirst("reload") is not None:
+    if form.get("reload") is not None:
         reloadres += reload_data()
 
+    pgconn = dbpool.get_dbconn("sustainablecorn")
+    cursor = pgconn.cursor()
     cursor.execute(
         """
         SELECT uniqueid, valid, cropyear, operation, biomassdate1,
@@ -172,7 +168,7 @@ def main():
     p.soilseriesname2, p.soiltaxonomicclass2 from sites s JOIN plots2 p
     on (s.uniqueid = p.uniqueid) ORDER by s.uniqueid ASC
     """,
-        DBCONN,
+        pgconn,
         index_col="uniqueid",
     )
     for uniqueid, row in df.iterrows():
@@ -269,8 +265,8 @@ def main():
                 table5 += "<td>%s</td>" % (data[site].get(yr, {}).get(op, ""),)
         table5 += "</tr>"
 
-    ssw(
-        """<!DOCTYPE html>
+    pgconn.close()
+    res = """<!DOCTYPE html>
 <html lang='en'>
 <head>
  <link href="/vendor/bootstrap/3.3.5/css/bootstrap.min.css" rel="stylesheet">
@@ -472,10 +468,14 @@ Google Data to the ISU Database Server.  You can <br />
 
 </body>
 </html>
-    """
-        % (reloadres, table0, table, table2, table3, table4, table5)
+    """ % (
+        reloadres,
+        table0,
+        table,
+        table2,
+        table3,
+        table4,
+        table5,
     )
-
-
-if __name__ == "__main__":
-    main()
+    start_response("200 OK", [("Content-type", "text/html")])
+    return [res.encode("utf-8")]
@@ -1,21 +1,18 @@
-#!/usr/bin/env python
 """Decagon SM Plot!"""
 import sys
-import cgi
 import datetime
-import os
 
 import pytz
-import numpy as np
 import pandas as pd
 from pandas.io.sql import read_sql
-from pyiem.util import get_dbconn, ssw
+from paste.request import parse_formvars
+
+sys.path.append("/opt/datateam/htdocs/cscap")
+from common import send_error, send_table  # noqa
+
+sys.path.append("/opt/datateam/lib")
+from datateam import dbpool, highcharts, respcache, rollups  # noqa
 
-ERRMSG = (
-    "No data found. Check the start date falls within the "
-    "applicable date range for the research site. "
-    "If yes, try expanding the number of days included."
-)
 DEPTHS = [None, "10 cm", "20 cm", "40 cm", "60 cm", "100 cm"]
 
 LINESTYLE = [
@@ -46,41 +43,33 @@ LINESTYLE = [
 ]
 
 
-def send_error():
-    """ " """
-    ssw("Content-type: application/javascript\n\n")
-    ssw("alert('" + ERRMSG + "');")
-    sys.exit()
-
-
-def make_plot(form):
+def make_plot(form, start_response):
     """Make the plot"""
-    (uniqueid, plotid) = form.getfirst("site", "ISUAG::302E").split("::")
+    (uniqueid, plotid) = form.get("site", "ISUAG::302E").split("::")
+    depths = list(DEPTHS)
     if uniqueid in ["KELLOGG", "MASON"]:
-        DEPTHS[1] = "-"
-        DEPTHS[5] = "80 cm"
+        depths[1] = "-"
+        depths[5] = "80 cm"
     elif uniqueid == "NAEW":
-        DEPTHS[1] = "5 cm"
-        DEPTHS[2] = "10 cm"
-        DEPTHS[3] = "20 cm"
-        DEPTHS[4] = "30 cm"
-        DEPTHS[5] = "50 cm"
+        depths[1] = "5 cm"
+        depths[2] = "10 cm"
+        depths[3] = "20 cm"
+        depths[4] = "30 cm"
+        depths[5] = "50 cm"
 
     sts = datetime.datetime.strptime(
-        form.getfirst("date", "2014-06-10"), "%Y-%m-%d"
+        form.get("date", "2014-06-10"), "%Y-%m-%d"
     )
-    days = int(form.getfirst("days", 1))
+    days = int(form.get("days", 1))
     ets = sts + datetime.timedelta(days=days)
-    pgconn = get_dbconn("sustainablecorn")
-    tzname = (
-        "America/Chicago"
-        if uniqueid in ["ISUAG", "SERF", "GILMORE"]
-        else "America/New_York"
-    )
-    viewopt = form.getfirst("view", "js")
-    ptype = form.getfirst("ptype", "1")
+    pgconn = dbpool.get_dbconn("sustainablecorn")
+    tzname = rollups.timezone("decagon", uniqueid)
+    viewopt = form.get("view", "js")
+    ptype = form.get("ptype", "1")
+    # chart width in pixels the raw series are downsampled to, 0 for all
+    width = int(form.get("width", highcharts.WIDTH))
     plotid_limit = "and plotid = '%s'" % (plotid,)
-    depth = form.getfirst("depth", "all")
+    depth = form.get("depth", "all")
     if depth != "all":
         plotid_limit = ""
     if ptype == "1":
@@ -106,49 +95,26 @@ def make_plot(form):
         )
         df["v"] = df["v"].apply(lambda x: x.astimezone(pytz.timezone(tzname)))
 
-    elif ptype in ["3", "4"]:
-        res = "hour" if ptype == "3" else "week"
-        df = read_sql(
-            """SELECT uniqueid, plotid,
-        timezone('UTC', date_trunc('"""
-            + res
-            + """', valid at time zone 'UTC')) as v,
-        avg(d1temp_qc) as d1t, avg(d2temp_qc) as d2t,
-        avg(d3temp_qc) as d3t, avg(d4temp_qc) as d4t, avg(d5temp_qc) as d5t,
-        avg(d1moisture_qc) as d1m, avg(d2moisture_qc) as d2m,
-        avg(d3moisture_qc) as d3m, avg(d4moisture_qc) as d4m,
-        avg(d5moisture_qc) as d5m
-        from decagon_data WHERE uniqueid = %s """
-            + plotid_limit
-            + """
-        and valid between %s and %s GROUP by uniqueid, v, plotid ORDER by v ASC
-        """,
-            pgconn,
-            params=(uniqueid, sts.date(), ets.date()),
-        )
-        df["v"] = pd.to_datetime(df["v"], utc=True)
-
     else:
-        df = read_sql(
-            """SELECT uniqueid, plotid,
-        timezone('UTC', date_trunc('day', valid at time zone %s)) as v,
-        avg(d1temp_qc) as d1t, avg(d2temp_qc) as d2t,
-        avg(d3temp_qc) as d3t, avg(d4temp_qc) as d4t, avg(d5temp_qc) as d5t,
-        avg(d1moisture_qc) as d1m, avg(d2moisture_qc) as d2m,
-        avg(d3moisture_qc) as d3m, avg(d4moisture_qc) as d4m,
-        avg(d5moisture_qc) as d5m
-        from decagon_data WHERE uniqueid = %s  """
-            + plotid_limit
-            + """
-        and valid between %s and %s GROUP by uniqueid, v, plotid ORDER by v ASC
-        """,
+        period = {"3": "hour", "4": "week"}.get(ptype, "day")
+        df = rollups.fetch(
             pgconn,
-            params=(tzname, uniqueid, sts.date(), ets.date()),
+            "decagon",
+            period,
+            uniqueid,
+            sts,
+            ets,
+            plotid=None if depth != "all" else plotid,
         )
+        cols = {"siteid": "uniqueid"}
+        for d in range(1, 6):
+            cols[f"d{d}temp_qc"] = f"d{d}t"
+            cols[f"d{d}moisture_qc"] = f"d{d}m"
+        df = df.rename(columns=cols).drop(columns=["depth", "treatment"])
         df["v"] = pd.to_datetime(df["v"], utc=True)
 
     if len(df.index) < 3:
-        send_error()
+        return send_error(start_response, "js")
     if ptype not in ["2"]:
         df["v"] = df["v"].apply(lambda x: x.tz_convert(tzname))
 
@@ -156,72 +122,45 @@ def make_plot(form):
         df.rename(
             columns=dict(
                 v="timestamp",
-                d1t="%s Temp (C)" % (DEPTHS[1],),
-                d2t="%s Temp (C)" % (DEPTHS[2],),
-                d3t="%s Temp (C)" % (DEPTHS[3],),
-                d4t="%s Temp (C)" % (DEPTHS[4],),
-                d5t="%s Temp (C)" % (DEPTHS[5],),
-                d1m="%s Moisture (cm3/cm3)" % (DEPTHS[1],),
-                d2m="%s Moisture (cm3/cm3)" % (DEPTHS[2],),
-                d3m="%s Moisture (cm3/cm3)" % (DEPTHS[3],),
-                d4m="%s Moisture (cm3/cm3)" % (DEPTHS[4],),
-                d5m="%s Moisture (cm3/cm3)" % (DEPTHS[5],),
+                d1t="%s Temp (C)" % (depths[1],),
+                d2t="%s Temp (C)" % (depths[2],),
+                d3t="%s Temp (C)" % (depths[3],),
+                d4t="%s Temp (C)" % (depths[4],),
+                d5t="%s Temp (C)" % (depths[5],),
+                d1m="%s Moisture (cm3/cm3)" % (depths[1],),
+                d2m="%s Moisture (cm3/cm3)" % (depths[2],),
+                d3m="%s Moisture (cm3/cm3)" % (depths[3],),
+                d4m="%s Moisture (cm3/cm3)" % (depths[4],),
+                d5m="%s Moisture (cm3/cm3)" % (depths[5],),
             ),
             inplace=True,
         )
-        if viewopt == "html":
-            ssw("Content-type: text/html\n\n")
-            ssw(df.to_html(index=False))
-            return
-        if viewopt == "csv":
-            ssw("Content-type: application/octet-stream\n")
-            ssw(
-                (
-                    "Content-Disposition: attachment; "
-                    "filename=%s_%s_%s_%s.csv\n\n"
-                )
-                % (
-                    uniqueid,
-                    plotid,
-                    sts.strftime("%Y%m%d"),
-                    ets.strftime("%Y%m%d"),
-                )
-            )
-            ssw(df.to_csv(index=False))
-            return
+        # Prevent timezone troubles
         if viewopt == "excel":
-            ssw("Content-type: application/octet-stream\n")
-            ssw(
-                (
-                    "Content-Disposition: attachment; "
-                    "filename=%s_%s_%s_%s.xlsx\n\n"
-                )
-                % (
-                    uniqueid,
-                    plotid,
-                    sts.strftime("%Y%m%d"),
-                    ets.strftime("%Y%m%d"),
-                )
-            )
-            writer = pd.ExcelWriter("/tmp/ss.xlsx")
-            # Prevent timezone troubles
             df["timestamp"] = df["timestamp"].dt.strftime("%Y-%m-%d %H:%M")
-            df.to_excel(writer, "Data", index=False)
-            writer.save()
-            ssw(open("/tmp/ss.xlsx", "rb").read())
-            os.unlink("/tmp/ss.xlsx")
-            return
+        return send_table(
+            start_response,
+            df,
+            viewopt,
+            "%s_%s_%s_%s"
+            % (
+                uniqueid,
+                plotid,
+                sts.strftime("%Y%m%d"),
+                ets.strftime("%Y%m%d"),
+            ),
+            freeze=None,
+        )
 
     # Begin highcharts output
     lbl = "Plot:%s" % (plotid,)
     if depth != "all":
-        lbl = "Depth:%s" % (DEPTHS[int(depth)],)
+        lbl = "Depth:%s" % (depths[int(depth)],)
     title = (
         "Decagon Temperature + Moisture for " "Site:%s %s Period:%s to %s"
     ) % (uniqueid, lbl, sts.date(), ets.date())
-    ssw("Content-type: application/javascript\n\n")
-    ssw(
-        """
+    start_response("200 OK", [("Content-type", "application/javascript")])
+    res = """
 /**
  * In order to synchronize tooltips and crosshairs, override the
  * built-in events with handlers defined on the parent element.
@@ -291,18 +230,24 @@ options = {
 };
 
 """
-    )
-    # to_json can't handle serialization of dt
-    df["ticks"] = df["v"].astype(np.int64) // 10**6
+    if ptype == "1":
+        # The same points of each plot are kept for all depths, as the
+        # tooltips of the two charts are synced by point
+        cols = [f"d{d}{v}" for v in ["t", "m"] for d in range(1, 6)]
+        df = pd.concat(
+            highcharts.downsample_frame(df2, cols, width)
+            for _, df2 in df.groupby("plotid")
+        )
+    df["ticks"] = highcharts.ticks(df["v"])
     lines = []
     lines2 = []
     if depth == "all":
         for i, n in enumerate(["d1t", "d2t", "d3t", "d4t", "d5t"]):
-            v = df[["ticks", n]].to_json(orient="values")
+            v = highcharts.series_data(df["ticks"], df[n])
             lines.append(
                 """{
             name: '"""
-                + DEPTHS[i + 1]
+                + depths[i + 1]
                 + """ Temp',
             type: 'line',
             connectNulls: true,
@@ -314,11 +259,11 @@ options = {
             """
             )
         for i, n in enumerate(["d1m", "d2m", "d3m", "d4m", "d5m"]):
-            v = df[["ticks", n]].to_json(orient="values")
+            v = highcharts.series_data(df["ticks"], df[n])
             lines2.append(
                 """{
             name: '"""
-                + DEPTHS[i + 1]
+                + depths[i + 1]
                 + """ VSM',
             type: 'line',
             connectNulls: true,
@@ -335,7 +280,7 @@ options = {
         plot_ids.sort()
         for i, plotid in enumerate(plot_ids):
             df2 = df[df["plotid"] == plotid]
-            v = df2[["ticks", dlevel]].to_json(orient="values")
+            v = highcharts.series_data(df2["ticks"], df2[dlevel])
             lines.append(
                 """{
             name: '"""
@@ -355,7 +300,7 @@ options = {
         plot_ids.sort()
         for i, plotid in enumerate(plot_ids):
             df2 = df[df["plotid"] == plotid]
-            v = df2[["ticks", dlevel]].to_json(orient="values")
+            v = highcharts.series_data(df2["ticks"], df2[dlevel])
             lines2.append(
                 """{
             name: '"""
@@ -372,7 +317,7 @@ options = {
             )
     series = ",".join(lines)
     series2 = ",".join(lines2)
-    ssw(
+    res += (
         """
 charts[0] = new Highcharts.Chart($.extend(true, {}, options, {
     chart: { renderTo: 'hc1'},
@@ -396,15 +341,13 @@ charts[1] = new Highcharts.Chart($.extend(true, {}, options, {
 }));
     """
     )
+    return res.encode("utf-8")
 
     # ax[1].set_xlabel("Time (%s Timezone)" % (tzname, ))
 
 
-def main():
+@respcache.wsgi("cscap/plot_decagon")
+def application(environ, start_response):
     """Do Something"""
-    form = cgi.FieldStorage()
-    make_plot(form)
-
-
-if __name__ == "__main__":
-    main()
+    form = parse_formvars(environ)
+    return [make_plot(form, start_response)]
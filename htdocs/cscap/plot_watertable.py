@@ -1,22 +1,17 @@
-#!/usr/bin/env python
 """Plot!"""
 import sys
-from io import BytesIO
-import cgi
+from functools import partial
 import datetime
-import os
 
-import pandas as pd
 from pandas.io.sql import read_sql
-import numpy as np
-from pyiem.plot.use_agg import plt
-from pyiem.util import get_dbconn, ssw
+from paste.request import parse_formvars
+
+sys.path.append("/opt/datateam/htdocs/cscap")
+from common import bling_rows, send_error, send_table  # noqa
+
+sys.path.append("/opt/datateam/lib")
+from datateam import dbpool, highcharts, respcache  # noqa
 
-ERRMSG = (
-    "No data found. Check the start date falls within the "
-    "applicable date range for the research site. "
-    "If yes, try expanding the number of days included."
-)
 LINESTYLE = [
     "-",
     "-",
@@ -45,74 +40,23 @@ LINESTYLE = [
 ]
 
 
-def get_vardf(pgconn, tabname):
-    """Get a dataframe of descriptors for this tabname"""
-    return read_sql(
-        """
-        select element_or_value_display_name as varname,
-        number_of_decimal_places_to_round_up::numeric::int as round,
-        short_description, units from data_dictionary_export WHERE
-        spreadsheet_tab = %s
-    """,
-        pgconn,
-        params=(tabname,),
-        index_col="varname",
-    )
-
-
-def add_bling(pgconn, df, tabname):
-    """Do fancy things"""
-    # Insert some headers rows
-    metarows = [{}, {}]
-    cols = df.columns
-    vardf = get_vardf(pgconn, tabname)
-    for i, colname in enumerate(cols):
-        if i == 0:
-            metarows[0][colname] = "description"
-            metarows[1][colname] = "units"
-            continue
-        if colname in vardf.index:
-            metarows[0][colname] = vardf.at[colname, "short_description"]
-            metarows[1][colname] = vardf.at[colname, "units"]
-    df = pd.concat([pd.DataFrame(metarows), df], ignore_index=True)
-    # re-establish the correct column sorting
-    df = df.reindex(cols, axis=1)
-    return df
-
-
-def send_error(viewopt, msg):
-    """ " """
-    if viewopt == "js":
-        ssw("Content-type: application/javascript\n\n")
-        ssw("alert('" + ERRMSG + "');")
-        sys.exit()
-    fig, ax = plt.subplots(1, 1)
-    ax.text(0.5, 0.5, msg, transform=ax.transAxes, ha="center")
-    ssw("Content-type: image/png\n\n")
-    ram = BytesIO()
-    fig.savefig(ram, format="png")
-    ram.seek(0)
-    ssw(ram.read())
-    sys.exit()
-
-
-def make_plot(form):
+def make_plot(form, start_response):
     """Make the plot"""
-    uniqueid = form.getfirst("site", "ISUAG")
+    uniqueid = form.get("site", "ISUAG")
 
     sts = datetime.datetime.strptime(
-        form.getfirst("date", "2014-01-01"), "%Y-%m-%d"
+        form.get("date", "2014-01-01"), "%Y-%m-%d"
     )
-    days = int(form.getfirst("days", 1))
+    days = int(form.get("days", 1))
     ets = sts + datetime.timedelta(days=days)
-    pgconn = get_dbconn("sustainablecorn")
+    pgconn = dbpool.get_dbconn("sustainablecorn")
     tzname = (
         "America/Chicago"
         if uniqueid in ["ISUAG", "SERF", "GILMORE"]
         else "America/New_York"
     )
-    viewopt = form.getfirst("view", "plot")
-    ptype = form.getfirst("ptype", "1")
+    viewopt = form.get("view", "plot")
+    ptype = form.get("ptype", "1")
     if ptype == "1":
         df = read_sql(
             """
@@ -150,7 +94,9 @@ def make_plot(form):
             params=(tzname, uniqueid, sts.date(), ets.date()),
         )
     if len(df.index) < 3:
-        send_error(viewopt, "No / Not Enough Data Found, sorry!")
+        return send_error(
+            start_response, viewopt, "No / Not Enough Data Found, sorry!"
+        )
     if ptype not in [
         "2",
     ]:
@@ -162,42 +108,17 @@ def make_plot(form):
         if viewopt == "excel":
             df["v"] = df["v"].dt.strftime("%Y-%m-%d %H:%M")
         df = df.rename(columns=dict(v="timestamp", depth="Depth (mm)"))
-        df = add_bling(pgconn, df, "Water")
-        if viewopt == "html":
-            ssw("Content-type: text/html\n\n")
-            ssw(df.to_html(index=False))
-            return
-        if viewopt == "csv":
-            ssw("Content-type: application/octet-stream\n")
-            ssw(
-                (
-                    "Content-Disposition: attachment; "
-                    "filename=%s_%s_%s.csv\n\n"
-                )
-                % (uniqueid, sts.strftime("%Y%m%d"), ets.strftime("%Y%m%d"))
-            )
-            ssw(df.to_csv(index=False))
-            return
-        if viewopt == "excel":
-            ssw("Content-type: application/octet-stream\n")
-            ssw(
-                (
-                    "Content-Disposition: attachment; "
-                    "filename=%s_%s_%s.xlsx\n\n"
-                )
-                % (uniqueid, sts.strftime("%Y%m%d"), ets.strftime("%Y%m%d"))
-            )
-            writer = pd.ExcelWriter("/tmp/ss.xlsx")
-            df.to_excel(writer, "Data", index=False)
-            worksheet = writer.sheets["Data"]
-            worksheet.freeze_panes(3, 0)
-            writer.save()
-            ssw(open("/tmp/ss.xlsx", "rb").read())
-            os.unlink("/tmp/ss.xlsx")
-            return
+        return send_table(
+            start_response,
+            df,
+            viewopt,
+            "%s_%s_%s"
+            % (uniqueid, sts.strftime("%Y%m%d"), ets.strftime("%Y%m%d")),
+            bling=partial(bling_rows, "Water"),
+        )
 
     # Begin highcharts output
-    ssw("Content-type: application/javascript\n\n")
+    start_response("200 OK", [("Content-type", "application/javascript")])
     title = ("Water Table Depth for Site: %s (%s to %s)") % (
         uniqueid,
         sts.strftime("%-d %b %Y"),
@@ -206,10 +127,10 @@ def make_plot(form):
     s = []
     plot_ids = df["plotid"].unique()
     plot_ids.sort()
-    df["ticks"] = pd.to_datetime(df["v"]).astype(np.int64) // 10**6
+    df["ticks"] = highcharts.ticks(df["v"])
     for plotid in plot_ids:
         df2 = df[df["plotid"] == plotid]
-        v = df2[["ticks", "depth"]].to_json(orient="values")
+        v = highcharts.series_data(df2["ticks"], df2["depth"])
         s.append(
             """{
             name: '"""
@@ -221,7 +142,7 @@ def make_plot(form):
         }"""
         )
     series = ",".join(s)
-    ssw(
+    res = (
         """
 $("#hc").highcharts({
     title: {text: '"""
@@ -252,13 +173,11 @@ $("#hc").highcharts({
 });
     """
     )
+    return res.encode("utf-8")
 
 
-def main():
+@respcache.wsgi("cscap/plot_watertable")
+def application(environ, start_response):
     """Do Something"""
-    form = cgi.FieldStorage()
-    make_plot(form)
-
-
-if __name__ == "__main__":
-    main()
+    form = parse_formvars(environ)
+    return [make_plot(form, start_response)]
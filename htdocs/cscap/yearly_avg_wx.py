@@ -1,15 +1,17 @@
-#!/usr/bin/env python
-
+"""Yearly average temperature and precipitation of the CSCAP sites."""
+import sys
 from pandas.io.sql import read_sql
 from pyiem.network import Table as NetworkTable
-from pyiem.util import get_dbconn, ssw
+
+sys.path.append("/opt/datateam/lib")
+from datateam import dbpool  # noqa
 
 nt = NetworkTable("CSCAP")
 
 
-def main():
-    ssw("Content-type: text/html\n\n")
-    pgconn = get_dbconn("coop")
+def application(environ, start_response):
+    """Go Main Go"""
+    pgconn = dbpool.get_dbconn("coop")
     cids = []
     for sid in nt.sts.keys():
         csite = nt.sts[sid]["climate_site"]
@@ -25,6 +27,7 @@ def main():
         params=(tuple(cids),),
         index_col=None,
     )
+    pgconn.close()
     df2 = df.copy()
     df.set_index(["station", "year"], inplace=True)
 
@@ -46,8 +49,7 @@ def main():
 
         table += "</tr>\n"
 
-    ssw(
-        """<!DOCTYPE html>
+    res = """<!DOCTYPE html>
 <html lang='en'>
 <head>
  <link href="/vendor/bootstrap/3.3.5/css/bootstrap.min.css" rel="stylesheet">
@@ -83,10 +85,8 @@ def main():
 </table>
 </body>
 </html>
-    """
-        % (table,)
+    """ % (
+        table,
     )
-
-
-if __name__ == "__main__":
-    main()
+    start_response("200 OK", [("Content-type", "text/html")])
+    return [res.encode("utf-8")]
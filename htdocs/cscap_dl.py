@@ -1,16 +1,18 @@
-#!/usr/bin/python
 """
 
 """
+from io import BytesIO
 import sys
-import cgi
 import datetime
 
+from paste.request import parse_formvars
 from psycopg2.extras import RealDictCursor
 import pandas as pd
 import pandas.io.sql as pdsql
 import pyiem.cscap_utils as util
-from pyiem.util import get_dbconn, ssw
+
+sys.path.append("/opt/datateam/lib")
+from datateam import dbpool  # noqa
 
 
 config = util.get_config("/opt/datateam/config/mytokens.json")
@@ -29,18 +31,15 @@ def clean(val):
 
 def check_auth(form):
     """Make sure request is authorized"""
-    if form.getfirst("hash") != config["appauth"]["sharedkey"]:
-        ssw("Content-type: text/plain\n\n")
-        ssw("Unauthorized request!")
-        sys.stderr.write(
-            ("Unauthorized CSCAP hash=%s") % (form.getfirst("hash"),)
-        )
-        sys.exit()
+    if form.get("hash") != config["appauth"]["sharedkey"]:
+        sys.stderr.write(("Unauthorized CSCAP hash=%s") % (form.get("hash"),))
+        return False
+    return True
 
 
 def get_nitratedata():
     """Fetch some nitrate data, for now"""
-    pgconn = get_dbconn("sustainablecorn")
+    pgconn = dbpool.get_dbconn("sustainablecorn")
     cursor = pgconn.cursor(cursor_factory=RealDictCursor)
 
     res = "uniqueid,plotid,year,depth,soil15,soil16,soil23\n"
@@ -79,7 +78,7 @@ def get_nitratedata():
 
 def get_agdata():
     """A specialized report"""
-    pgconn = get_dbconn("sustainablecorn")
+    pgconn = dbpool.get_dbconn("sustainablecorn")
     cursor = pgconn.cursor()
 
     SITES = [
@@ -228,11 +227,11 @@ def get_agdata():
     return df.to_csv(index=False)
 
 
-def get_dl(form):
+def get_dl(form, start_response):
     """Process the form provided to us from the Internal website"""
-    pgconn = get_dbconn("sustainablecorn")
+    pgconn = dbpool.get_dbconn("sustainablecorn")
 
-    years = form.getlist("years")
+    years = form.getall("years")
     if len(years) == 1:
         years.append("9")
     if "all" in years or len(years) == 0:
@@ -241,7 +240,7 @@ def get_dl(form):
         yrlist = str(tuple(years))
 
     treatlimiter = "1=1"
-    treatments = form.getlist("treatments")
+    treatments = form.getall("treatments")
     if len(treatments) > 0 and "all" not in treatments:
         if len(treatments) == 1:
             treatments.append("ZZ")
@@ -255,7 +254,7 @@ def get_dl(form):
         )
 
     sitelimiter = "1=1"
-    sites = form.getlist("sites")
+    sites = form.getall("sites")
     if len(sites) > 0 and "all" not in sites:
         if len(sites) == 1:
             sites.append("ZZ")
@@ -279,7 +278,7 @@ def get_dl(form):
         "herbicide",
         "sampledate",
     ]
-    dvars = form.getlist("data")
+    dvars = form.getall("data")
     wants_soil = False
     for dv in dvars:
         if dv.startswith("SOIL") or dv == "all":
@@ -354,8 +353,8 @@ def get_dl(form):
     sys.stderr.write("2. %s\n" % (datetime.datetime.now(),))
     # sys.stderr.write(str(df.columns))
 
-    dnc = form.getfirst("dnc", "DNC")
-    missing = form.getfirst("missing", ".")
+    dnc = form.get("dnc", "DNC")
+    missing = form.get("missing", ".")
 
     def cleaner(val):
         if val is None or val.strip() == "" or val.strip() == ".":
@@ -418,11 +417,15 @@ def get_dl(form):
     )
     sys.stderr.write("4. %s\n" % (datetime.datetime.now(),))
 
-    fmt = form.getfirst("format", "csv")
+    fmt = form.get("format", "csv")
     if fmt == "excel":
-        ssw("Content-type: application/vnd.ms-excel\n")
-        ssw(("Content-Disposition: attachment;Filename=cscap.xlsx\n\n"))
-        writer = pd.ExcelWriter("/tmp/cscap.xlsx", engine="xlsxwriter")
+        headers = [
+            ("Content-type", "application/vnd.ms-excel"),
+            ("Content-Disposition", "attachment;Filename=cscap.xlsx"),
+        ]
+        start_response("200 OK", headers)
+        bio = BytesIO()
+        writer = pd.ExcelWriter(bio, engine="xlsxwriter")
         df2.to_excel(
             writer,
             columns=cols,
@@ -435,36 +438,33 @@ def get_dl(form):
         format2 = workbook.add_format({"num_format": "@"})
         worksheet.set_column("B:E", None, format2)
         writer.close()
-        return open("/tmp/cscap.xlsx", "rb").read()
+        return bio.getvalue()
     elif fmt == "tab":
-        ssw("Content-type: application/octet-stream\n")
-        ssw(
-            ("Content-Disposition: attachment; filename=%s\n\n")
-            % ("cscap.txt",)
-        )
-        return df2.to_csv(columns=cols, sep="\t", index=False)
-    ssw("Content-type: application/octet-stream\n")
-    ssw("Content-Disposition: attachment; filename=%s\n\n" % ("cscap.csv",))
+        headers = [
+            ("Content-type", "application/octet-stream"),
+            ("Content-Disposition", "attachment; filename=cscap.txt"),
+        ]
+        start_response("200 OK", headers)
+        res = df2.to_csv(columns=cols, sep="\t", index=False)
+        return res.encode("utf-8")
+    headers = [
+        ("Content-type", "application/octet-stream"),
+        ("Content-Disposition", "attachment; filename=cscap.csv"),
+    ]
+    start_response("200 OK", headers)
     sys.stderr.write("5. %s\n" % (datetime.datetime.now(),))
-    return df2.to_csv(columns=cols, index=False)
+    return df2.to_csv(columns=cols, index=False).encode("utf-8")
 
 
-def main():
+def application(environ, start_response):
     """Main"""
-    form = cgi.FieldStorage()
-    check_auth(form)
-    report = form.getfirst("report", "ag1")
-    if report == "ag1":
-        ssw("Content-type: text/plain\n\n")
-        ssw(get_agdata())
-    elif report == "dl":  # coming from internal website
-        ssw(get_dl(form))
-    else:
-        ssw("Content-type: text/plain\n\n")
-        ssw(get_nitratedata())
-
-
-if __name__ == "__main__":
-    # Do Something
-    # get_agdata()
-    main()
+    form = parse_formvars(environ)
+    if not check_auth(form):
+        start_response("200 OK", [("Content-type", "text/plain")])
+        return [b"Unauthorized request!"]
+    report = form.get("report", "ag1")
+    if report == "dl":  # coming from internal website
+        return [get_dl(form, start_response)]
+    res = get_agdata() if report == "ag1" else get_nitratedata()
+    start_response("200 OK", [("Content-type", "text/plain")])
+    return [res.encode("utf-8")]
@@ -1,7 +1,7 @@
 """Some common stuff."""
 from io import BytesIO
 
-from pyiem.plot.use_agg import plt
+from matplotlib.figure import Figure
 
 COPYWRITE = """credits: {
         position: {align: 'left', x: 15},
@@ -58,7 +58,8 @@ def send_error(start_response, viewopt, msg=ERRMSG):
     if viewopt == "js":
         start_response("200 OK", [("Content-type", "application/javascript")])
         return b"alert('No data found, sorry');"
-    fig, ax = plt.subplots(1, 1)
+    fig = Figure()
+    ax = fig.add_subplot(1, 1, 1)
     ax.text(0.5, 0.5, msg, transform=ax.transAxes, ha="center")
     start_response("200 OK", [("Content-type", "image/png")])
     ram = BytesIO()
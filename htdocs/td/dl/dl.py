@@ -7,8 +7,11 @@ select string_agg(column_name, ', ') from
 import sys
 import os
 import datetime
+from functools import partial
 import shutil
+import uuid
 import smtplib
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
@@ -17,9 +20,12 @@ from pymemcache import Client
 from paste.request import parse_formvars, MultiDict
 import pandas as pd
 import numpy as np
-from pyiem.util import get_dbconnstr, get_dbconn, logger
+from pyiem.util import logger
 from sqlalchemy import text
 
+sys.path.append("/opt/datateam/lib")
+from datateam import datadict, dbpool, dlcache, export, sheetpool  # noqa
+
 LOG = logger()
 EMAILTEXT = """
 Transforming Drainage Research Data
@@ -72,16 +78,45 @@ FERTELEM = [
     "iron",
 ]
 KGH_LBA = 1.12085
+# Tables a download may read from, any change to these invalidates the cache
+TABLES = [
+    "data_dictionary",
+    "meta_plot_identifier",
+    "meta_treatment_identifier",
+    "agronomic_data",
+    "soil_moisture_data",
+    "tile_flow_and_n_loads_data",
+    "water_quality_data",
+    "water_table_data",
+    "water_stage_data",
+    "soil_properties_data",
+    "mngt_planting_data",
+    "mngt_tillage_data",
+    "mngt_residue_data",
+    "mngt_fertilizing_data",
+    "mngt_harvesting_data",
+    "mngt_irrigation_data",
+    "irrigation_data",
+    "mngt_dwm_data",
+    "meta_methods",
+    "mngt_notes_data",
+    "meta_site_characteristics",
+    "meta_plot_characteristics",
+]
 
-# runtime storage
-MEMORY = dict(stamp=datetime.datetime.utcnow())
+# Columns always included in generalized datatables
+STANDARD = ["siteid", "plotid", "location", "date", "comments", "year"]
+# runtime storage, each request thread times its own steps
+MEMORY = threading.local()
+# Load the data dictionary when mod_wsgi imports us, not on first download
+datadict.warm("td")
 
 
 def pprint(msg):
     """log a pretty message for my debugging fun"""
     utcnow = datetime.datetime.utcnow()
-    delta = (utcnow - MEMORY["stamp"]).total_seconds()
-    MEMORY["stamp"] = utcnow
+    delta = (utcnow - getattr(MEMORY, "stamp", utcnow)).total_seconds()
+    MEMORY.stamp = utcnow
     sys.stderr.write("timedelta: %.3f %s\n" % (delta, msg))
 
 
@@ -114,13 +149,17 @@ def conv(value, detectlimit):
         return value
 
 
-def do_dictionary(pgconn, writer):
-    """Add Data Dictionary to the spreadsheet"""
-    df = pd.read_sql(
+def get_dictionary(pgconn):
+    """Get the Data Dictionary"""
+    return pd.read_sql(
         "SELECT * from data_dictionary ORDER by file_name ASC",
         pgconn,
         index_col=None,
     )
+
+
+def do_dictionary(writer, df):
+    """Add Data Dictionary to the spreadsheet"""
     sheetname = "Data Dictionary"
     df.to_excel(writer, sheetname, index=False)
     # Increase column width
@@ -155,42 +194,58 @@ def do_metadata_master(pgconn, writer, sites, missing):
     df.dropna(how="all", inplace=True)
     df.fillna(missing, inplace=True)
     df, worksheet = add_bling(
-        pgconn, writer, df, "Site Metadata", "meta_site_characteristics.csv"
+        writer, df, "Site Metadata", "meta_site_characteristics.csv"
     )
     worksheet.set_column("A:Z", 30)
 
 
-def do_generic(pgconn, writer, tt, fn, tablename, sites, varnames, missing):
-    """generalized datatable dumper."""
-    df = pd.read_sql(
-        text(
-            f"SELECT * from {tablename} WHERE siteid in :sites "
-            "ORDER by siteid"
-        ),
+def generic_sql(pgconn, tablename, varnames):
+    """The query behind a generalized datatable, selecting wanted columns."""
+    cols = pd.read_sql(f"SELECT * from {tablename} LIMIT 0", pgconn).columns
+    if "_ALL" not in varnames:
+        cols = [c for c in cols if c in varnames or c in STANDARD]
+    collist = ", ".join('"%s"' % (c.replace('"', '""'),) for c in cols)
+    return text(
+        f"SELECT {collist} from {tablename} WHERE siteid in :sites "
+        "ORDER by siteid"
+    )
+
+
+def get_generic(pgconn, tablename, sites, varnames, missing):
+    """generalized datatable fetcher."""
+    chunks = list(iter_generic(pgconn, tablename, sites, varnames, missing))
+    return pd.concat(chunks, ignore_index=True)
+
+
+def iter_generic(pgconn, tablename, sites, varnames, missing, chunksize=None):
+    """generalized datatable fetcher, yielding cleaned chunks of rows."""
+    for df in export.read_sql_chunks(
         pgconn,
+        generic_sql(pgconn, tablename, varnames),
         params={"sites": tuple(sites)},
-        index_col=None,
-    )
-    standard = ["siteid", "plotid", "location", "date", "comments", "year"]
-    # filter out unwanted columns
-    if "_ALL" not in varnames:
-        for col in df.columns:
-            if col in varnames or col in standard:
-                continue
-            df = df.drop(col, axis=1)
-    # String aggregate above creates a mixture of None and "None"
+        chunksize=chunksize,
+    ):
+        yield clean_generic(df, missing)
+
+
+def clean_generic(df, missing):
+    """Cleanup a generalized datatable, or a chunk of it."""
+    # Text columns can have a mixture of None and "None"
     df = df.replace(["None", None], np.nan).dropna(how="all").fillna(missing)
     valid2date(df)
-    df, worksheet = add_bling(pgconn, writer, df, tt, fn)
+    return df
+
+
+def do_generic(tt, fn, writer, df):
+    """generalized datatable dumper."""
+    df, worksheet = add_bling(writer, df, tt, fn)
     worksheet.set_column("A:Z", 30)
 
 
-def add_bling(pgconn, writer, df, sheetname, filename):
-    """Do fancy things"""
-    # Insert some headers rows
+def bling_rows(filename, cols):
+    """Build the description and units header rows for these columns."""
     metarows = [{}, {}]
-    cols = df.columns
-    vardf = get_vardf(pgconn, filename)
+    vardf = get_vardf(filename)
     for i, colname in enumerate(cols):
         if i == 0:
             metarows[0][colname] = "description"
@@ -199,7 +254,14 @@ def add_bling(pgconn, writer, df, sheetname, filename):
         if colname in vardf.index:
             metarows[0][colname] = vardf.at[colname, "brief_description"]
             metarows[1][colname] = vardf.at[colname, "units"]
+    return metarows
 
+
+def add_bling(writer, df, sheetname, filename):
+    """Do fancy things"""
+    # Insert some headers rows
+    cols = df.columns
+    metarows = bling_rows(filename, cols)
     df = pd.concat([pd.DataFrame(metarows), df], ignore_index=True)
     # re-establish the correct column sorting
     df = df.reindex(columns=cols)
@@ -209,9 +271,9 @@ def add_bling(pgconn, writer, df, sheetname, filename):
     return df, worksheet
 
 
-def do_plotids(pgconn, writer, sites):
-    """Write plotids to the spreadsheet"""
-    opdf = pd.read_sql(
+def get_plotids(pgconn, sites):
+    """Get the plotids"""
+    return pd.read_sql(
         text(
             "SELECT * from meta_plot_identifier where siteid in :sites "
             "ORDER by siteid, plotid ASC"
@@ -219,8 +281,11 @@ def do_plotids(pgconn, writer, sites):
         pgconn,
         params={"sites": tuple(sites)},
     )
+
+
+def do_plotids(writer, opdf):
+    """Write plotids to the spreadsheet"""
     opdf, worksheet = add_bling(
-        pgconn,
         writer,
         opdf[opdf.columns],
         "Plot Identifiers",
@@ -233,15 +298,9 @@ def do_plotids(pgconn, writer, sites):
     worksheet.set_column("B:B", 12, format1)
 
 
-def get_vardf(pgconn, filename):
-    """Get a dataframe of descriptors for this tabname"""
-    return pd.read_sql(
-        "select element_or_value_display_name as varname, brief_description, "
-        "units from data_dictionary WHERE file_name = %s",
-        pgconn,
-        params=(filename,),
-        index_col="varname",
-    )
+def get_vardf(filename):
+    """Get a dataframe of descriptors for this filename"""
+    return datadict.get_vardf("td", filename)
 
 
 def compare(hascols, wanted):
@@ -249,46 +308,53 @@ def compare(hascols, wanted):
     return any(x in hascols for x in wanted)
 
 
-def do_work(form):
-    """do great things"""
-    pgconn = get_dbconnstr("td")
-    email = form.get("email")
-    sites = form.getall("sites[]")
-    if not sites:
-        sites.append("XXX")
-    agronomic = form.getall("agronomic[]")
-    water = form.getall("water[]")
-    soil = form.getall("soil[]")
-    shm = form.getall("shm[]")
-    missing = form.get("missing", "M")
-    if missing == "__custom__":
-        missing = form.get("custom_missing", "M")
+def write_workbook(pgconn, filename, req):
+    """Write the requested sheets to the given spreadsheet filename."""
+    sites = req["sites"]
+    agronomic = req["agronomic"]
+    water = req["water"]
+    soil = req["soil"]
+    shm = req["shm"]
+    missing = req["missing"]
+    csv = req.get("format") == "csv"
     pprint("Missing is %s" % (missing,))
-    # detectlimit = form.get("detectlimit", "1")
 
-    # pylint: disable=abstract-class-instantiated
-    tmpfn = "td_%s.xlsx" % (
-        datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S"),
-    )
-    writer = pd.ExcelWriter(f"/tmp/{tmpfn}", engine="xlsxwriter")
+    sheets = []
+
+    def generic(tt, fn, tablename, varnames):
+        """Queue up a generic datatable sheet."""
+        if csv:
+            getter = partial(
+                iter_generic, pgconn, tablename, sites, varnames, missing
+            )
+            sheets.append((fn, getter, partial(bling_rows, fn)))
+            return
+        getter = partial(
+            get_generic, pgconn, tablename, sites, varnames, missing
+        )
+        sheets.append((tt, getter, partial(do_generic, tt, fn)))
 
     # First sheet is Data Dictionary
     if "SHM5" in shm or "_ALL" in shm:
-        do_dictionary(pgconn, writer)
-        pprint("do_dictionary() is done")
+        getter = partial(get_dictionary, pgconn)
+        if csv:
+            sheets.append(("data_dictionary.csv", getter, None))
+        else:
+            sheets.append(("Data Dictionary", getter, do_dictionary))
 
     # Sheet two is plot IDs
     if "SHM4" in shm or "_ALL" in shm:
-        do_plotids(pgconn, writer, sites)
-        do_generic(
-            pgconn,
-            writer,
+        getter = partial(get_plotids, pgconn, sites)
+        if csv:
+            bling = partial(bling_rows, "meta_plot_characteristics.csv")
+            sheets.append(("meta_plot_identifier.csv", getter, bling))
+        else:
+            sheets.append(("Plot Identifiers", getter, do_plotids))
+        generic(
             "Treatments",
             "meta_treatment_identifier.csv",
             "meta_treatment_identifier",
-            sites,
             ["_ALL"],
-            missing,
         )
 
     if agronomic:
@@ -297,48 +363,33 @@ def do_work(form):
                 "crop",
             ]
         )
-        do_generic(
-            pgconn,
-            writer,
+        generic(
             "Agronomic",
             "agronomic_data.csv",
             "agronomic_data",
-            sites,
             agronomic,
-            missing,
         )
-        pprint("Agronomic is done")
     if water:
         water.extend(["depth", "dwm_treatment", "sample_type", "height"])
         cols = ["soil_moisture", "soil_temperature", "soil_ec"]
         if compare(cols, water):
-            do_generic(
-                pgconn,
-                writer,
+            generic(
                 "Soil Moisture",
                 "soil_moisture_data.csv",
                 "soil_moisture_data",
-                sites,
                 water,
-                missing,
             )
-            pprint("Soil Moisture is done")
         cols = (
             "tile_flow discharge nitrate_n_load nitrate_n_removed "
             "tile_flow_filled nitrate_n_load_filled"
         ).split()
         if compare(cols, water):
-            do_generic(
-                pgconn,
-                writer,
+            generic(
                 "Tile Flow and Load",
                 "drain_flow_and_N_loads_data.csv",
                 "tile_flow_and_n_loads_data",
-                sites,
                 water,
-                missing,
             )
-            pprint("Tile Flow and Loads is done")
         cols = (
             "nitrate_n_concentration ammonia_n_concentration "
             "total_n_filtered_concentration total_n_unfiltered_concentration "
@@ -347,156 +398,159 @@ def do_work(form):
             "ph water_ec"
         ).split()
         if compare(cols, water):
-            do_generic(
-                pgconn,
-                writer,
+            generic(
                 "Water Quality",
                 "water_quality_data.csv",
                 "water_quality_data",
-                sites,
                 water,
-                missing,
             )
-            pprint("Tile Flow and Loads is done")
         cols = [
             "water_table_depth",
         ]
         if compare(cols, water):
-            do_generic(
-                pgconn,
-                writer,
+            generic(
                 "Water Table",
                 "water_table_data.csv",
                 "water_table_data",
-                sites,
                 water,
-                missing,
             )
         cols = [
             "water_stage",
         ]
         if compare(cols, water):
-            do_generic(
-                pgconn,
-                writer,
+            generic(
                 "Water Stage",
                 "water_stage_data.csv",
                 "water_stage_data",
-                sites,
                 water,
-                missing,
             )
     if soil:
-        do_generic(
-            pgconn,
-            writer,
+        generic(
             "Soil",
             "soil_properties_data.csv",
             "soil_properties_data",
-            sites,
             soil,
-            missing,
         )
-        pprint("Soil is done")
 
     # Management
     if "SHM1" in shm or "_ALL" in shm:
         _titles = "Planting Tillage Residue Fertilizing Harvesting Irrigation"
         for mngt in _titles.split():
-            do_generic(
-                pgconn,
-                writer,
+            generic(
                 mngt if mngt != "Irrigation" else "Irrigation Event Based",
                 f"mngt_{mngt.lower()}_data.csv",
                 f"mngt_{mngt.lower()}_data",
-                sites,
                 ["_ALL"],
-                missing,
             )
         # Secondary Irrigation Tab
-        do_generic(
-            pgconn,
-            writer,
+        generic(
             "Irrigation Daily",
             "irrigation_data.csv",
             "irrigation_data",
-            sites,
             ["_ALL"],
-            missing,
         )
     # DWM
-    do_generic(
-        pgconn,
-        writer,
+    generic(
         "DWM",
         "mngt_dwm_data.csv",
         "mngt_dwm_data",
-        sites,
         ["_ALL"],
-        missing,
     )
-    pprint("do_dwm() is done")
     # Methods
     if "SHM1" in shm or "_ALL" in shm:
-        do_generic(
-            pgconn,
-            writer,
+        generic(
             "Methods",
             "meta_methods.csv",
             "meta_methods",
-            sites,
             ["_ALL"],
-            missing,
         )
 
     # Notes
     if "SHM6" in shm or "_ALL" in shm:
-        do_generic(
-            pgconn,
-            writer,
+        generic(
             "Notes",
             "mngt_notes_data.csv",
             "mngt_notes_data",
-            sites,
             ["_ALL"],
-            missing,
         )
-        pprint("do_notes() is done")
     # Notes
     if "SHM8" in shm or "_ALL" in shm:
-        do_generic(
-            pgconn,
-            writer,
+        generic(
             "Sites",
             "meta_site_characteristics.csv",
             "meta_site_characteristics",
-            sites,
             ["_ALL"],
-            missing,
         )
-        do_generic(
-            pgconn,
-            writer,
+        generic(
             "Plots",
             "meta_plot_characteristics.csv",
             "meta_plot_characteristics",
-            sites,
             ["_ALL"],
-            missing,
         )
-    # Send to client
+
+    if csv:
+        export.write_csvzip(filename, sheets)
+        pprint("write_csvzip() is done")
+        return
+    # pylint: disable=abstract-class-instantiated
+    writer = pd.ExcelWriter(filename, engine="xlsxwriter")
+    sheetpool.build_sheets(writer, sheets)
+    pprint("build_sheets() is done")
     writer.close()
+
+
+def do_work(form):
+    """do great things"""
+    email = form.get("email")
+    sites = form.getall("sites[]")
+    if not sites:
+        sites.append("XXX")
+    missing = form.get("missing", "M")
+    if missing == "__custom__":
+        missing = form.get("custom_missing", "M")
+    # detectlimit = form.get("detectlimit", "1")
+    req = {
+        "sites": sites,
+        "agronomic": form.getall("agronomic[]"),
+        "water": form.getall("water[]"),
+        "soil": form.getall("soil[]"),
+        "shm": form.getall("shm[]"),
+        "missing": missing,
+        "format": "csv" if form.get("format") == "csv" else "xlsx",
+    }
+
+    # the second alone is not unique once requests run in threads
+    tmpfn = "td_%s_%s.%s" % (
+        datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S"),
+        uuid.uuid4().hex[:8],
+        "zip" if req["format"] == "csv" else "xlsx",
+    )
+    pgconn = dbpool.get_dbconn("td")
+    versions = dlcache.table_versions(pgconn.cursor(), TABLES)
+    # not held, idle in transaction, for the whole build
+    pgconn.close()
+    key = None
+    if versions is not None:
+        key = dlcache.request_key("td", req, versions)
+    if key is None or not dlcache.fetch(key, f"/var/webtmp/{tmpfn}"):
+        write_workbook(
+            dbpool.get_engine("td", downloads=True), f"/tmp/{tmpfn}", req
+        )
+        pprint(f"Created spreadsheet: /tmp/{tmpfn}")
+        try:
+            shutil.copyfile(f"/tmp/{tmpfn}", f"/var/webtmp/{tmpfn}")
+            os.unlink(f"/tmp/{tmpfn}")
+            if key is not None:
+                dlcache.store(key, f"/var/webtmp/{tmpfn}")
+        except PermissionError:
+            pass
+
+    # Send to client
     msg = MIMEMultipart()
     msg["Subject"] = "Transforming Drainage Dataset"
     msg["From"] = "ISU Data Team <isudatateam@iastate.edu>"
     msg["To"] = email
     msg.preamble = "Data"
-    pprint(f"Created spreadsheet: /tmp/{tmpfn}")
-    try:
-        shutil.copyfile(f"/tmp/{tmpfn}", f"/var/webtmp/{tmpfn}")
-        os.unlink(f"/tmp/{tmpfn}")
-    except PermissionError:
-        pass
     uri = f"https://datateam.agron.iastate.edu/tmp/{tmpfn}"
     etext = EMAILTEXT % (
         datetime.datetime.utcnow().strftime("%d %B %Y %H:%M:%S"),
@@ -508,13 +562,14 @@ def do_work(form):
     if email is not None:
         with smtplib.SMTP("localhost") as s:
             s.sendmail(msg["From"], msg["To"], msg.as_string())
-    pgconn = get_dbconn("td")
+    pgconn = dbpool.get_dbconn("td")
     cursor = pgconn.cursor()
     cursor.execute(
         "INSERT into website_downloads(email) values (%s)", (email,)
     )
     cursor.close()
     pgconn.commit()
+    pgconn.close()
     pprint("is done!!!")
     return b"Email Delivered!"
 
@@ -553,9 +608,10 @@ def throttle(environ):
 
 def application(environ, start_response):
     """Do Stuff"""
-    with get_dbconn("mesosite") as pgconn:
-        preventive_log(pgconn, environ)
-        pgconn.commit()
+    pgconn = dbpool.get_dbconn("mesosite")
+    preventive_log(pgconn, environ)
+    pgconn.commit()
+    pgconn.close()
     start_response("200 OK", [("Content-type", "text/plain")])
     if throttle(environ):
         return [b"You did not agree to download terms."]
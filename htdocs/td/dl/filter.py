@@ -12,9 +12,11 @@ import sys
 
 from paste.request import parse_formvars
 import pandas as pd
-from pyiem.util import get_dbconnstr
 from sqlalchemy import text
 
+sys.path.append("/opt/datateam/lib")
+from datateam import dbpool, respcache  # noqa
+
 # NOTE: filter.py is upstream for this table, copy to dl.py
 AGG = {
     "_T1": ["ROT4", "ROT5", "ROT54"],
@@ -80,7 +82,7 @@ def agg(arr):
 
 def do_filter(form):
     """Do the filtering fun."""
-    pgconn = get_dbconnstr("td")
+    pgconn = dbpool.get_engine("td")
     res = {"treatments": [], "agronomic": [], "soil": [], "water": []}
     sites = agg(form.getall("sites[]"))
     # treatments = agg(form.getall("treatments[]"))
@@ -206,6 +208,7 @@ def do_filter(form):
     return res
 
 
+@respcache.wsgi("td/dl/filter")
 def application(environ, start_response):
     """Do Stuff"""
     start_response("200 OK", [("Content-type", "application/json")])
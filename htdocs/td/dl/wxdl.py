@@ -1,13 +1,15 @@
 """Download weather data, please"""
 # pylint: disable=abstract-class-instantiated
-import os
+import sys
 import datetime
 
 import pandas as pd
 from paste.request import parse_formvars
-from pyiem.util import get_dbconnstr
 from sqlalchemy import text
 
+sys.path.append("/opt/datateam/lib")
+from datateam import dbpool, export  # noqa
+
 VARDF = {
     "siteid": "",
     "date": "",
@@ -67,9 +69,22 @@ def get_cgi_dates(form):
     return [sane_date(y1, m1, d1), ets]
 
 
+def bling_rows(cols):
+    """Build the description and units header rows for these columns."""
+    metarows = [{}, {}]
+    for i, colname in enumerate(cols):
+        if i == 0:
+            metarows[0][colname] = "description"
+            metarows[1][colname] = "units"
+            continue
+        metarows[0][colname] = VARDF.get(colname, "")
+        metarows[1][colname] = UVARDF.get(colname, "")
+    return metarows
+
+
 def do_work(form):
     """do great things"""
-    pgconn = get_dbconnstr("td")
+    pgconn = dbpool.get_engine("td")
     stations = form.getall("stations")
     if not stations:
         stations.append("XXX")
@@ -85,29 +100,8 @@ def do_work(form):
         index_col=None,
     )
 
-    metarows = [{}, {}]
-    cols = df.columns
-    for i, colname in enumerate(cols):
-        if i == 0:
-            metarows[0][colname] = "description"
-            metarows[1][colname] = "units"
-            continue
-        metarows[0][colname] = VARDF.get(colname, "")
-        metarows[1][colname] = UVARDF.get(colname, "")
-    df = pd.concat([pd.DataFrame(metarows), df], ignore_index=True)
-    # re-establish the correct column sorting
-    df = df.reindex(cols, axis=1)
-
-    writer = pd.ExcelWriter("/tmp/ss.xlsx", engine="xlsxwriter")
-    df.to_excel(writer, "Daily Weather", index=False)
-    worksheet = writer.sheets["Daily Weather"]
-    worksheet.freeze_panes(3, 0)
-    writer.close()
-
-    fn = ",".join(stations)
-    res = open("/tmp/ss.xlsx", "rb").read()
-    os.unlink("/tmp/ss.xlsx")
-    return res, fn
+    res = export.to_xlsx(df, "Daily Weather", bling_rows, freeze=3)
+    return res, ",".join(stations)
 
 
 def application(environ, start_response):
@@ -5,11 +5,13 @@ import sys
 import pandas as pd
 from paste.request import parse_formvars
 from pandas.io.sql import read_sql
-from pyiem.util import get_dbconn
 
 sys.path.append("/opt/datateam/htdocs/td")
 from common import CODES, getColor, send_error, COPYWRITE
 
+sys.path.append("/opt/datateam/lib")
+from datateam import dbpool, highcharts, respcache  # noqa
+
 LINESTYLE = [
     "-",
     "-",
@@ -40,7 +42,7 @@ LINESTYLE = [
 
 def get_vardesc(varname):
     """Get the heading for the variable."""
-    pgconn = get_dbconn("td")
+    pgconn = dbpool.get_dbconn("td")
     cursor = pgconn.cursor()
     cursor.execute(
         """
@@ -56,7 +58,7 @@ def get_vardesc(varname):
 
 def make_plot(form, start_response):
     """Make the plot"""
-    pgconn = get_dbconn("td")
+    pgconn = dbpool.get_dbconn("td")
     uniqueid = form.get("site", "ISUAG")
     varname = form.get("varname", "AGR17")
     (varlabel, varunits) = get_vardesc(varname)
@@ -109,28 +111,17 @@ def make_plot(form, start_response):
     for i, plotid in enumerate(plot_ids):
         df2 = df[df[linecol] == plotid]
         arr.append(
-            (
-                """{type: 'column',
+            """{type: 'column',
             """
-                + getColor(plotid, i)
-                + """,
+            + getColor(plotid, i)
+            + """,
             name: '"""
-                + CODES.get(plotid, plotid)
-                + """',
+            + CODES.get(plotid, plotid)
+            + """',
             data: """
-                + str(
-                    [
-                        [a, b]
-                        for a, b in zip(
-                            df2["year"].values, df2["value"].values
-                        )
-                    ]
-                )
-                + """
+            + highcharts.series_data(df2["year"].values, df2["value"].values)
+            + """
         }"""
-            )
-            .replace("None", "null")
-            .replace("nan", "null")
         )
     series = ",".join(arr)
     res = (
@@ -170,6 +161,7 @@ $("#hc").highcharts({
     return res.encode("utf-8")
 
 
+@respcache.wsgi("td/plot_agronomic")
 def application(environ, start_response):
     """Do Something"""
     form = parse_formvars(environ)
@@ -3,15 +3,14 @@
 import sys
 import datetime
 
-import numpy as np
-import pandas as pd
 from paste.request import parse_formvars
-from pandas.io.sql import read_sql
-from pyiem.util import get_dbconn
 
 sys.path.append("/opt/datateam/htdocs/td")
 from common import send_error, COPYWRITE
 
+sys.path.append("/opt/datateam/lib")
+from datateam import dbpool, highcharts, respcache, rollups  # noqa
+
 LINESTYLE = [
     "-",
     "-",
@@ -50,24 +49,16 @@ def make_plot(form, start_response):
     )
     days = int(form.get("days", 1))
     ets = sts + datetime.timedelta(days=days)
-    pgconn = get_dbconn("td")
+    pgconn = dbpool.get_dbconn("td")
     by = form.get("ptype", "daily")
 
-    df = read_sql(
-        f"SELECT date_trunc('{BYCOL[by]}', date)::date as v, depth, "
-        "avg(soil_moisture) as soil_moisture, "
-        "avg(soil_temperature) as soil_temperature "
-        "from soil_moisture_data where siteid = %s and "
-        "coalesce(plotid, location, '') = %s and "
-        "date >= %s and date < %s "
-        "GROUP by v, depth ORDER by v ASC",
-        pgconn,
-        params=(uniqueid, plotid, sts.date(), ets.date()),
+    df = rollups.fetch(
+        pgconn, "soil_moisture", BYCOL[by], uniqueid, sts, ets, plotid=plotid
     )
 
     if len(df.index) < 3:
         return send_error(start_response, "js")
-    df["ticks"] = pd.to_datetime(df["v"]).astype(np.int64) // 10**6
+    df["ticks"] = highcharts.ticks(df["v"])
     smdf = df[["ticks", "depth", "soil_moisture"]].pivot(
         "ticks", "depth", "soil_moisture"
     )
@@ -159,7 +150,7 @@ options = {
     for depth in stdf.columns:
         if depth == "ticks" or stdf[depth].isnull().all():
             continue
-        v = stdf[["ticks", depth]].to_json(orient="values")
+        v = highcharts.series_data(stdf["ticks"], stdf[depth])
         lines.append(
             """{
         name: '"""
@@ -176,7 +167,7 @@ options = {
     for depth in smdf.columns:
         if depth == "ticks" or smdf[depth].isnull().all():
             continue
-        v = smdf[["ticks", depth]].to_json(orient="values")
+        v = highcharts.series_data(smdf["ticks"], smdf[depth])
         lines2.append(
             """{
         name: '"""
@@ -226,6 +217,7 @@ charts[1] = new Highcharts.Chart($.extend(true, {}, options, {
     return res.encode("utf-8")
 
 
+@respcache.wsgi("td/plot_decagon")
 def application(environ, start_response):
     """Do Something"""
     form = parse_formvars(environ)
@@ -3,14 +3,15 @@
 import sys
 import datetime
 
-import pandas as pd
-import numpy as np
 from paste.request import parse_formvars
 from pyiem.util import get_sqlalchemy_conn
 
 sys.path.append("/opt/datateam/htdocs/td")
 from common import CODES, getColor, send_error, COPYWRITE
 
+sys.path.append("/opt/datateam/lib")
+from datateam import highcharts, respcache, rollups  # noqa
+
 LINESTYLE = [
     "-",
     "-",
@@ -56,39 +57,36 @@ def make_plot(form, start_response):
     ungroup = int(form.get("ungroup", 0))
     ets = sts + datetime.timedelta(days=days)
     by = form.get("by", "daily")
+    with get_sqlalchemy_conn("td") as conn:
+        # the window includes the last date
+        df = rollups.fetch(
+            conn,
+            "tile_flow",
+            BYCOL[by],
+            siteid,
+            sts,
+            ets + datetime.timedelta(days=1),
+            how="sum",
+        )
+    df = df[df["nitrate_n_load"].notna()]
     if ungroup == 0:
-        with get_sqlalchemy_conn("td") as conn:
-            df = pd.read_sql(
-                """WITH data as (
-                SELECT date_trunc(%s, date)::date as v,
-                coalesce(plotid, location) as agg,
-                dwm_treatment as datum,
-                sum(nitrate_n_load) as nitrate_n_load
-                from tile_flow_and_n_loads_data WHERE
-                siteid = %s and date between %s and %s
-                and nitrate_n_load is not null and
-                dwm_treatment is not null GROUP by v, agg, datum
-                )
-                SELECT v, datum, avg(nitrate_n_load) as nitrate_n_load
-                from data GROUP by v, datum
-                ORDER by v ASC""",
-                conn,
-                params=(BYCOL[by], siteid, sts.date(), ets.date()),
-            )
-
+        # Sum each plot, then average the plots of each treatment
+        df = (
+            df[df["treatment"] != ""]
+            .groupby(["v", "plotid", "treatment"], as_index=False)[
+                "nitrate_n_load"
+            ]
+            .sum()
+            .groupby(["v", "treatment"], as_index=False)["nitrate_n_load"]
+            .mean()
+            .rename(columns={"treatment": "datum"})
+        )
     else:
-        with get_sqlalchemy_conn("td") as conn:
-            df = pd.read_sql(
-                """SELECT date_trunc(%s, date)::date as v,
-                coalesce(plotid, location) as datum,
-                sum(nitrate_n_load) as nitrate_n_load
-                from tile_flow_and_n_loads_data WHERE
-                siteid = %s and date between %s and %s
-                and nitrate_n_load is not null GROUP by v, datum
-                ORDER by v ASC""",
-                conn,
-                params=(BYCOL[by], siteid, sts.date(), ets.date()),
-            )
+        df = (
+            df.groupby(["v", "plotid"], as_index=False)["nitrate_n_load"]
+            .sum()
+            .rename(columns={"plotid": "datum"})
+        )
     if len(df.index) < 3:
         return send_error(
             start_response, 1, "No / Not Enough Data Found, sorry!"
@@ -103,35 +101,26 @@ def make_plot(form, start_response):
     plot_ids.sort()
     if ungroup == 1:
         plot_ids = plot_ids[::-1]
-    df["ticks"] = pd.to_datetime(df["v"]).astype(np.int64) // 10**6
+    df["ticks"] = highcharts.ticks(df["v"])
     seriestype = "line" if by == "daily" else "column"
     for i, plotid in enumerate(plot_ids):
         df2 = df[df[linecol] == plotid]
         s.append(
-            (
-                """{type: '"""
-                + seriestype
-                + """',
+            """{type: '"""
+            + seriestype
+            + """',
             """
-                + getColor(plotid, i)
-                + """,
+            + getColor(plotid, i)
+            + """,
             name: '"""
-                + CODES.get(plotid, plotid)
-                + """',
+            + CODES.get(plotid, plotid)
+            + """',
             data: """
-                + str(
-                    [
-                        [a, b]
-                        for a, b in zip(
-                            df2["ticks"].values, df2["nitrate_n_load"].values
-                        )
-                    ]
-                )
-                + """
-        }"""
+            + highcharts.series_data(
+                df2["ticks"].values, df2["nitrate_n_load"].values
             )
-            .replace("None", "null")
-            .replace("nan", "null")
+            + """
+        }"""
         )
     series = ",".join(s)
     res = (
@@ -168,6 +157,7 @@ $("#hc").highcharts({
     return res.encode("utf-8")
 
 
+@respcache.wsgi("td/plot_nitrateload")
 def application(environ, start_response):
     """Do Something"""
     form = parse_formvars(environ)
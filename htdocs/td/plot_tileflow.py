@@ -4,13 +4,15 @@ import sys
 import datetime
 
 import pandas as pd
-import numpy as np
 from paste.request import parse_formvars
 from pyiem.util import get_sqlalchemy_conn
 
 sys.path.append("/opt/datateam/htdocs/td")
 from common import CODES, getColor, send_error, COPYWRITE  # noqa
 
+sys.path.append("/opt/datateam/lib")
+from datateam import highcharts, respcache, rollups  # noqa
+
 LINESTYLE = [
     "-",
     "-",
@@ -59,9 +61,7 @@ def get_weather(uniqueid, sts, ets, by):
             params=(by, uniqueid, sts.date(), ets.date()),
         )
     df.index = pd.DatetimeIndex(df.index.values)
-    df["ticks"] = (
-        df.index.values.astype("datetime64[ns]").astype(np.int64) // 10**6
-    )
+    df["ticks"] = highcharts.ticks(df.index)
     return df
 
 
@@ -78,15 +78,21 @@ def make_plot(form, start_response):
     by = form.get("by", "daily")
     wxdf = get_weather(uniqueid, sts, ets, BYCOL[by])
     with get_sqlalchemy_conn("td") as conn:
-        df = pd.read_sql(
-            f"SELECT date_trunc('{BYCOL[by]}', date)::date as v, "
-            "coalesce(plotid, location) as datum, "
-            "sum(tile_flow_filled) as tile_flow_filled "
-            "from tile_flow_and_n_loads_data WHERE siteid = %s "
-            "and date between %s and %s GROUP by v, datum ORDER by v ASC",
+        # the window includes the last date
+        df = rollups.fetch(
             conn,
-            params=(uniqueid, sts.date(), ets.date()),
+            "tile_flow",
+            BYCOL[by],
+            uniqueid,
+            sts,
+            ets + datetime.timedelta(days=1),
+            how="sum",
         )
+    df = (
+        df.rename(columns={"plotid": "datum"})
+        .groupby(["v", "datum"], as_index=False)["tile_flow_filled"]
+        .sum(min_count=1)
+    )
     if len(df.index) < 3:
         return send_error(
             start_response,
@@ -123,31 +129,22 @@ def make_plot(form, start_response):
     s = []
     if not wxdf.empty:
         s.append(
-            (
-                """{type: 'column',
+            """{type: 'column',
             name: 'Precip',
             color: '#0000ff',
             yAxis: 1,
             data: """
-                + str(
-                    [
-                        [a, b]
-                        for a, b in zip(
-                            wxdf["ticks"].values, wxdf["precip"].values
-                        )
-                    ]
-                )
-                + """
-        }"""
+            + highcharts.series_data(
+                wxdf["ticks"].values, wxdf["precip"].values
             )
-            .replace("None", "null")
-            .replace("nan", "null")
+            + """
+        }"""
         )
     plot_ids = df[linecol].unique()
     plot_ids.sort()
     if ungroup == "0":
         plot_ids = plot_ids[::-1]
-    df["ticks"] = pd.to_datetime(df["v"]).astype(np.int64) // 10**6
+    df["ticks"] = highcharts.ticks(df["v"])
     seriestype = "line" if by in ["daily"] else "column"
     if len(wxdf.index) >= 100:
         seriestype = "line"
@@ -156,30 +153,21 @@ def make_plot(form, start_response):
         if df2.empty:
             continue
         s.append(
-            (
-                """{type: '"""
-                + seriestype
-                + """',
+            """{type: '"""
+            + seriestype
+            + """',
             """
-                + getColor(plotid, i)
-                + """,
+            + getColor(plotid, i)
+            + """,
             name: '"""
-                + CODES.get(plotid, plotid)
-                + """',
+            + CODES.get(plotid, plotid)
+            + """',
             data: """
-                + str(
-                    [
-                        [a, b]
-                        for a, b in zip(
-                            df2["ticks"].values, df2["tile_flow_filled"].values
-                        )
-                    ]
-                )
-                + """
-        }"""
+            + highcharts.series_data(
+                df2["ticks"].values, df2["tile_flow_filled"].values
             )
-            .replace("None", "null")
-            .replace("nan", "null")
+            + """
+        }"""
         )
     series = ",".join(s)
     res = (
@@ -227,6 +215,7 @@ Highcharts.chart('hc', {
     return res.encode("utf-8")
 
 
+@respcache.wsgi("td/plot_tileflow")
 def application(environ, start_response):
     """Do Something"""
     form = parse_formvars(environ)
@@ -3,15 +3,15 @@
 import sys
 import datetime
 
-import pandas as pd
 from pandas.io.sql import read_sql
-import numpy as np
 from paste.request import parse_formvars
-from pyiem.util import get_dbconn
 
 sys.path.append("/opt/datateam/htdocs/td")
 from common import CODES, getColor, send_error, COPYWRITE
 
+sys.path.append("/opt/datateam/lib")
+from datateam import dbpool, highcharts, respcache, rollups  # noqa
+
 LINESTYLE = [
     "-",
     "-",
@@ -50,18 +50,21 @@ def make_plot(form, start_response):
     )
     days = int(form.get("days", 1))
     ets = sts + datetime.timedelta(days=days)
-    pgconn = get_dbconn("td")
+    pgconn = dbpool.get_dbconn("td")
     by = form.get("by", "daily")
     ungroup = int(form.get("ungroup", 0))
-    df = read_sql(
-        f"SELECT date_trunc('{BYCOL[by]}', date)::date as v, "
-        "coalesce(plotid, location) as datum, "
-        "avg(water_table_depth) as depth from water_table_data "
-        "WHERE siteid = %s and date between %s and %s "
-        "GROUP by v, datum ORDER by v ASC",
+    # the window includes the last date
+    df = rollups.fetch(
         pgconn,
-        params=(uniqueid, sts.date(), ets.date()),
+        "water_table",
+        BYCOL[by],
+        uniqueid,
+        sts,
+        ets + datetime.timedelta(days=1),
     )
+    df = df.rename(columns={"plotid": "datum", "water_table_depth": "depth"})[
+        ["v", "datum", "depth"]
+    ]
     if len(df.index) < 3:
         return send_error(
             start_response, "by", "No / Not Enough Data Found, sorry!"
@@ -101,10 +104,10 @@ def make_plot(form, start_response):
     plot_ids.sort()
     if ungroup == 0:
         plot_ids = plot_ids[::-1]
-    df["ticks"] = pd.to_datetime(df["v"]).astype(np.int64) // 10**6
+    df["ticks"] = highcharts.ticks(df["v"])
     for i, plotid in enumerate(plot_ids):
         df2 = df[df[linecol] == plotid]
-        v = df2[["ticks", "depth"]].to_json(orient="values")
+        v = highcharts.series_data(df2["ticks"], df2["depth"])
         s.append(
             """{
             """
@@ -156,6 +159,7 @@ $("#hc").highcharts({
     return res.encode("utf-8")
 
 
+@respcache.wsgi("td/plot_watertable")
 def application(environ, start_response):
     """Do Something"""
     form = parse_formvars(environ)
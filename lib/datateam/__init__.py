@@ -0,0 +1,4 @@
+"""Shared python code for the ISU Data Team website and processing scripts.
+
+Consumers add ``/opt/datateam/lib`` to ``sys.path`` prior to importing.
+"""
@@ -0,0 +1,238 @@
+"""Index of which variables have data for each site, plot and year.
+
+The CSCAP download filter asks which treatments, variables and years go
+with the sites and treatments picked so far, on every click.  Rather than a
+DISTINCT over agronomic_data and soil_data and reading all of ghg_data and
+ipm_data each time, the ``data_availability`` table holds one row per
+variable, site, plot and year having data and is rebuilt by `rebuild` after
+each harvest or ingest.
+
+`get_index` loads that table with plotids into an `Index`, where each
+variable, site, plot and year is a bitmap (a python int) over the distinct
+site, plot and year cells, so answering the filter is a handful of ANDs and
+ORs whatever the size of the data tables.  The index is kept per process
+and reloaded when either table changes, or every time should either have
+no data version.
+"""
+import threading
+
+from datateam import dlcache
+
+# The data tables indexed, the ghg and ipm tables have a column per variable
+# rather than a varname column.
+CATEGORIES = {
+    "agronomic": {
+        "table": "agronomic_data",
+        "varnames": None,
+    },
+    "soil": {
+        "table": "soil_data",
+        "varnames": None,
+    },
+    "ghg": {
+        "table": "ghg_data",
+        "varnames": [f"ghg{i:02d}" for i in range(1, 17)],
+    },
+    "ipm": {
+        "table": "ipm_data",
+        "varnames": [f"ipm{i:02d}" for i in range(1, 15)],
+    },
+}
+# Values standing in for no data
+MISSING = ["n/a", "did not collect"]
+TREATMENTS = ["tillage", "rotation", "drainage", "nitrogen", "landscape"]
+TABLES = ["data_availability", "plotids"]
+_INDEX = {"versions": None, "index": None}
+_LOCK = threading.Lock()
+
+
+def ensure_table(cursor):
+    """Create the data_availability table, should it not exist."""
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS data_availability(
+            category text, varname text, uniqueid text, plotid text,
+            year int)
+    """
+    )
+    cursor.execute("GRANT SELECT on data_availability to nobody,apache")
+
+
+def _select(category):
+    """The SQL giving the distinct variable, site, plot and years."""
+    spec = CATEGORIES[category]
+    if spec["varnames"] is None:
+        return f"""
+        SELECT distinct '{category}', varname, uniqueid, plotid, year
+        from {spec['table']} WHERE value not in
+        ({", ".join(f"'{v}'" for v in MISSING)})
+        """
+    unpivot = ", ".join(
+        f"('{var.upper()}', {var} is not null)" for var in spec["varnames"]
+    )
+    return f"""
+        SELECT distinct '{category}', u.varname, d.uniqueid, d.plotid, d.year
+        from {spec['table']} d, LATERAL (VALUES {unpivot}) u(varname, has)
+        WHERE u.has
+    """
+
+
+def rebuild(cursor, categories=None):
+    """Rebuild the index of some categories of data.
+
+    Args:
+      cursor: database cursor, the caller commits.
+      categories (list): keys of CATEGORIES, None for all of them.
+
+    Returns:
+      int number of index rows written
+    """
+    ensure_table(cursor)
+    rows = 0
+    for category in categories or CATEGORIES:
+        cursor.execute(
+            "DELETE from data_availability WHERE category = %s", (category,)
+        )
+        cursor.execute(
+            "INSERT into data_availability(category, varname, uniqueid, "
+            f"plotid, year) {_select(category)}"
+        )
+        rows += cursor.rowcount
+    return rows
+
+
+class Index:
+    """The data availability loaded as bitmaps over site, plot, year cells.
+
+    Args:
+      rows: (category, varname, uniqueid, plotid, year) tuples.
+      plots: (uniqueid, plotid, *TREATMENTS) tuples of the plotids table.
+    """
+
+    def __init__(self, rows, plots):
+        self.plots = {(row[0], row[1]): row[2:] for row in plots}
+        self.variables = {}
+        self.sites = {}
+        self.plotcells = {}
+        self.years = {}
+        cells = {}
+        for category, varname, uniqueid, plotid, year in rows:
+            cell = (uniqueid, plotid, year)
+            if cell not in cells:
+                bit = 1 << len(cells)
+                cells[cell] = bit
+                self.sites[uniqueid] = self.sites.get(uniqueid, 0) | bit
+                self.plotcells[(uniqueid, plotid)] = (
+                    self.plotcells.get((uniqueid, plotid), 0) | bit
+                )
+                if year is not None:
+                    self.years[year] = self.years.get(year, 0) | bit
+            key = (category, varname)
+            self.variables[key] = self.variables.get(key, 0) | cells[cell]
+
+    def site_mask(self, sites):
+        """The cells of these sites."""
+        mask = 0
+        for uniqueid in sites:
+            mask |= self.sites.get(uniqueid, 0)
+        return mask
+
+    def site_plots(self, sites):
+        """The plotids entries of these sites."""
+        sites = set(sites)
+        return {key: val for key, val in self.plots.items() if key[0] in sites}
+
+    def plot_mask(self, plots):
+        """The cells of these (uniqueid, plotid) plots."""
+        mask = 0
+        for key in plots:
+            mask |= self.plotcells.get(key, 0)
+        return mask
+
+    def treatments(self, sites):
+        """The treatment codes found on the plots of these sites."""
+        res = []
+        plots = self.site_plots(sites).values()
+        for i in range(len(TREATMENTS)):
+            for val in dict.fromkeys(row[i] for row in plots):
+                if val is not None:
+                    res.append(val)
+        return res
+
+    def varnames(self, category, mask):
+        """The sorted variables of a category with data in these cells."""
+        return sorted(
+            varname
+            for (cat, varname), bits in self.variables.items()
+            if cat == category and bits & mask
+        )
+
+    def variable_mask(self, category, varnames):
+        """The cells where any of these variables have data."""
+        mask = 0
+        for varname in varnames:
+            mask |= self.variables.get((category, varname), 0)
+        return mask
+
+    def year_list(self, mask):
+        """The sorted years of these cells."""
+        return sorted(year for year, bits in self.years.items() if bits & mask)
+
+
+def get_index(pgconn):
+    """Get the index, loading it when the database has changed.
+
+    Args:
+      pgconn: database connection of sustainablecorn.
+
+    Returns:
+      Index
+    """
+    cursor = pgconn.cursor()
+    versions = dlcache.table_versions(cursor, TABLES)
+    # one thread loads, the others wait for it rather than load it too
+    with _LOCK:
+        if (
+            versions is None
+            or _INDEX["index"] is None
+            or _INDEX["versions"] != versions
+        ):
+            cursor.execute(
+                "SELECT category, varname, uniqueid, plotid, year "
+                "from data_availability"
+            )
+            rows = cursor.fetchall()
+            cursor.execute(
+                f"SELECT uniqueid, plotid, {', '.join(TREATMENTS)} "
+                "from plotids"
+            )
+            _INDEX["index"] = Index(rows, cursor.fetchall())
+            _INDEX["versions"] = versions
+        index = _INDEX["index"]
+    cursor.close()
+    return index
+
+
+def test_index():
+    """Answer filter questions from a small index."""
+    rows = [
+        ("agronomic", "AGR1", "A", "1", 2011),
+        ("agronomic", "AGR2", "A", "2", 2012),
+        ("agronomic", "AGR3", "B", "1", 2013),
+        ("ghg", "GHG01", "A", "1", 2011),
+        ("ghg", "GHG02", "A", "9", 2014),
+    ]
+    plots = [
+        ("A", "1", "TIL1", "ROT1", None, "NIT1", None),
+        ("A", "2", "TIL2", "ROT1", None, "NIT1", None),
+        ("B", "1", "TIL1", "ROT2", None, "NIT2", None),
+    ]
+    index = Index(rows, plots)
+    assert index.treatments(["A"]) == ["TIL1", "TIL2", "ROT1", "NIT1"]
+    til1 = [k for k, v in index.site_plots(["A"]).items() if v[0] == "TIL1"]
+    assert index.varnames("agronomic", index.plot_mask(til1)) == ["AGR1"]
+    # GHG02 is on a plot missing from plotids
+    plots = index.plot_mask(index.site_plots(["A", "B"]))
+    assert index.varnames("ghg", plots) == ["GHG01"]
+    mask = index.variable_mask("ghg", ["GHG01", "GHG02"])
+    assert index.year_list(mask & index.site_mask(["A"])) == [2011, 2014]
@@ -0,0 +1,108 @@
+"""Per process cache of the project data dictionaries.
+
+Downloads and plots label their columns with the descriptions and units
+found in the data dictionary.  Rather than query the database for each
+sheet, the whole dictionary is loaded once and split up by spreadsheet tab
+(CSCAP) or file name (TD).  Every ``CHECK_SECONDS`` the table's change stamp
+is checked and the dictionary reloaded should it have changed.
+"""
+import threading
+import time
+
+import pandas as pd
+from pyiem.util import logger
+
+from datateam import dbpool, dlcache
+
+LOG = logger()
+CHECK_SECONDS = 60
+# Reload this often regardless, should the change stamp be unavailable
+TTL = 3600
+DICTIONARIES = {
+    "sustainablecorn": {
+        "table": "data_dictionary_export",
+        "sql": """
+            select spreadsheet_tab as key,
+            element_or_value_display_name as varname,
+            case when number_of_decimal_places_to_round_up ~ '^[0-9.]+$'
+            then number_of_decimal_places_to_round_up::numeric::int
+            else null end as round,
+            short_description, units from data_dictionary_export
+        """,
+    },
+    "td": {
+        "table": "data_dictionary",
+        "sql": """
+            select file_name as key,
+            element_or_value_display_name as varname,
+            brief_description, units from data_dictionary
+        """,
+    },
+}
+_CACHE = {}
+_LOCK = threading.Lock()
+
+
+def _stamp(dbname):
+    """Get the change stamp of this database's data dictionary."""
+    table = DICTIONARIES[dbname]["table"]
+    pgconn = dbpool.get_dbconn(dbname)
+    try:
+        versions = dlcache.table_versions(pgconn.cursor(), [table])
+    finally:
+        pgconn.close()
+    return None if versions is None else versions[table]
+
+
+def _load(dbname):
+    """Load the full data dictionary."""
+    df = pd.read_sql(DICTIONARIES[dbname]["sql"], dbpool.get_engine(dbname))
+    tables = {
+        key: gdf.drop(columns="key").set_index("varname")
+        for key, gdf in df.groupby("key")
+    }
+    empty = df.drop(columns="key").iloc[:0].set_index("varname")
+    LOG.info("Loaded %s %s dictionary entries", len(df.index), dbname)
+    return {"tables": tables, "empty": empty, "loaded": time.time()}
+
+
+def _dictionary(dbname):
+    """Get the current cache entry, loading or refreshing it as needed."""
+    with _LOCK:
+        now = time.time()
+        entry = _CACHE.get(dbname)
+        if entry is not None and now - entry["checked"] < CHECK_SECONDS:
+            return entry
+        stamp = _stamp(dbname)
+        if (
+            entry is None
+            or stamp != entry["stamp"]
+            or (stamp is None and now - entry["loaded"] > TTL)
+        ):
+            entry = _load(dbname)
+            entry["stamp"] = stamp
+            _CACHE[dbname] = entry
+        entry["checked"] = now
+        return entry
+
+
+def get_vardf(dbname, key):
+    """Get a dataframe of descriptors indexed by varname.
+
+    The result is shared, so do not modify it.
+
+    Args:
+      dbname (str): either sustainablecorn or td.
+      key (str): the spreadsheet tab (sustainablecorn) or file name (td).
+    """
+    entry = _dictionary(dbname)
+    return entry["tables"].get(key, entry["empty"])
+
+
+def warm(*dbnames):
+    """Load the dictionaries ahead of the first request."""
+    for dbname in dbnames:
+        try:
+            _dictionary(dbname)
+        except Exception as exp:
+            LOG.warning("Failed to warm %s dictionary: %s", dbname, exp)
@@ -0,0 +1,501 @@
+"""Per process pools of database connections for the web endpoints.
+
+Each mod_wsgi daemon process keeps, per database name, at most ``SIZE``
+open psycopg2 connections.  `get_dbconn` checks one out, waiting up to
+``TIMEOUT`` seconds for a busy one to come back, and the ``close()`` of
+what it returns gives the connection back to the pool instead of closing
+it.  A connection idle for more than ``PING_SECONDS`` is checked with a
+``SELECT 1`` before use, and one being given back has its transaction
+rolled back and session reset, so no request sees another's state.
+
+`get_engine` is the SQLAlchemy engine for ``pd.read_sql``, with its own
+bounded pool of the same size, pinged and rolled back the same way.  The
+download workbooks hold an engine connection per concurrent sheet query,
+see `sheetpool.WORKERS`, for the whole of a build, so they get an engine of
+their own, ``get_engine(dbname, downloads=True)``, sized ``DOWNLOAD_SIZE``
+for ``DOWNLOAD_BUILDS`` builds at once.  A few downloads thus never leave
+the plots and filters waiting on connections, and a build beyond those
+waits for one to finish.
+
+No pool keeps more than ``MAX_IDLE`` connections idle, a connection given
+back to a pool holding that many is closed, and a background thread closes
+those idle for longer than ``IDLE_SECONDS``.  Once a busy spell is over, a
+process thus goes back to holding a couple of connections per database.
+
+The checkouts, waits and timeouts of both kinds of pool are counted per
+process, see `stats`, and logged every ``REPORT_SECONDS``, which is what to
+go by when setting the ``processes`` and ``threads`` of the daemon process
+groups in config/mod_wsgi.conf.  A pool is as big as its process has
+threads, unless ``DATATEAM_POOLSIZE`` says otherwise, so waits on the
+psycopg2 and plain engine pools mean requests are holding more than one
+connection of a pool at a time.  Many ``idle_closes`` mean ``MAX_IDLE`` is
+too small for the steady load.
+"""
+import os
+import threading
+import time
+
+import psycopg2
+from pyiem.util import get_dbconn as _connect
+from pyiem.util import get_dbconnstr, logger
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.util import queue as sqla_queue
+
+from datateam import sheetpool
+
+try:
+    import mod_wsgi
+
+    THREADS = getattr(mod_wsgi, "threads_per_process", 4)
+except ImportError:
+    THREADS = 4
+
+LOG = logger()
+DBERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+# A connection per request thread of the daemon process by default
+SIZE = int(os.environ.get("DATATEAM_POOLSIZE", THREADS))
+# Download builds of a process at once, each running its sheet queries
+DOWNLOAD_BUILDS = int(os.environ.get("DATATEAM_DOWNLOAD_BUILDS", 2))
+DOWNLOAD_SIZE = int(
+    os.environ.get(
+        "DATATEAM_DOWNLOAD_POOLSIZE", DOWNLOAD_BUILDS * sheetpool.WORKERS
+    )
+)
+TIMEOUT = float(os.environ.get("DATATEAM_POOLTIMEOUT", 30))
+# Connections a pool keeps idle, and for how long
+MAX_IDLE = int(os.environ.get("DATATEAM_POOL_MAXIDLE", 2))
+IDLE_SECONDS = float(os.environ.get("DATATEAM_POOL_IDLESECONDS", 300))
+REAP_SECONDS = 60
+PING_SECONDS = 30
+REPORT_SECONDS = 600
+# Waits shorter than this are not counted as waits
+WAIT_SECONDS = 0.001
+_POOLS = {}
+_ENGINES = {}
+_STATS = {}
+# Reentrant, as a PooledConnection collected by the garbage collector goes
+# back from whatever this thread was doing, perhaps counting under the lock
+_LOCK = threading.RLock()
+_REPORTED = {"time": time.time()}
+_REAPER = {}
+
+
+class PoolTimeout(Exception):
+    """No connection came free in time."""
+
+
+def _stats(dbname, kind):
+    """Get the counters of a pool, the caller holds _LOCK."""
+    key = f"{kind}:{dbname}"
+    if key not in _STATS:
+        _STATS[key] = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "timeouts": 0,
+            "connects": 0,
+            "discards": 0,
+            "idle_closes": 0,
+            "in_use": 0,
+            "max_in_use": 0,
+        }
+    return _STATS[key]
+
+
+def _record(dbname, kind, waited, timedout=False):
+    """Count a checkout, or a timeout, and the time spent waiting."""
+    with _LOCK:
+        entry = _stats(dbname, kind)
+        if waited >= WAIT_SECONDS:
+            entry["waits"] += 1
+            entry["wait_seconds"] += waited
+            entry["max_wait_seconds"] = max(entry["max_wait_seconds"], waited)
+        if timedout:
+            entry["timeouts"] += 1
+            return
+        entry["checkouts"] += 1
+        entry["in_use"] += 1
+        entry["max_in_use"] = max(entry["max_in_use"], entry["in_use"])
+
+
+def _count(dbname, kind, what, value=1):
+    """Bump one counter of a pool."""
+    with _LOCK:
+        _stats(dbname, kind)[what] += value
+
+
+def stats():
+    """Get the counters of this process's pools.
+
+    Returns:
+      dict of ``<psycopg2|engine|download>:<dbname>`` to dict of counters
+    """
+    with _LOCK:
+        return {key: dict(val) for key, val in _STATS.items()}
+
+
+def log_stats():
+    """Log the counters of this process's pools."""
+    for key, entry in sorted(stats().items()):
+        LOG.info(
+            "dbpool pid %s %s checkouts %s waits %s (%.3fs total, %.3fs max) "
+            "timeouts %s in use %s (max %s of %s) connects %s discards %s "
+            "idle closes %s",
+            os.getpid(),
+            key,
+            entry["checkouts"],
+            entry["waits"],
+            entry["wait_seconds"],
+            entry["max_wait_seconds"],
+            entry["timeouts"],
+            entry["in_use"],
+            entry["max_in_use"],
+            DOWNLOAD_SIZE if key.startswith("download:") else SIZE,
+            entry["connects"],
+            entry["discards"],
+            entry["idle_closes"],
+        )
+
+
+def _maybe_report():
+    """Log the counters when it has been a while."""
+    now = time.time()
+    with _LOCK:
+        if now - _REPORTED["time"] < REPORT_SECONDS:
+            return
+        _REPORTED["time"] = now
+    log_stats()
+
+
+class PooledConnection:
+    """A checked out psycopg2 connection, ``close()`` gives it back.
+
+    Everything else is the wrapped connection's, so this goes wherever a
+    connection from ``pyiem.util.get_dbconn`` did.  One dropped without a
+    ``close()``, as the plots do, goes back when it is garbage collected.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError(
+                "connection already given back to the pool"
+            )
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        """Commit or roll back as a psycopg2 connection would."""
+        if self._conn is None:
+            return
+        if exc_type is None:
+            self._conn.commit()
+        else:
+            self._conn.rollback()
+
+    @property
+    def closed(self):
+        """Given back counts as closed."""
+        return 1 if self._conn is None else self._conn.closed
+
+    def close(self):
+        """Give the connection back to the pool, only the first call counts."""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.putconn(conn)
+
+    def __del__(self):
+        if self.__dict__.get("_conn") is not None:
+            self.close()
+
+
+def close_idle():
+    """Close the pooled connections idle for longer than IDLE_SECONDS."""
+    with _LOCK:
+        pools = list(_POOLS.values())
+        pools.extend(engine.pool for engine in _ENGINES.values())
+    now = time.monotonic()
+    for pool in pools:
+        pool.prune(now)
+
+
+def _reap():
+    """Close idle connections every REAP_SECONDS, forever."""
+    while True:
+        time.sleep(REAP_SECONDS)
+        try:
+            close_idle()
+        except Exception as exp:
+            LOG.info("dbpool pid %s closing idle failed: %s", os.getpid(), exp)
+
+
+def _start_reaper():
+    """Start this process's idle connection closer, the caller holds _LOCK."""
+    if "thread" in _REAPER:
+        return
+    _REAPER["thread"] = threading.Thread(
+        target=_reap, name="dbpool-reaper", daemon=True
+    )
+    _REAPER["thread"].start()
+
+
+class Pool:
+    """A bounded pool of connections to one database.
+
+    Args:
+      dbname (str): the database name given to ``pyiem.util.get_dbconn``.
+      size (int): the most connections open at once.
+      timeout (float): seconds to wait for a connection before giving up.
+      max_idle (int): the most connections kept open while not in use.
+    """
+
+    def __init__(self, dbname, size=SIZE, timeout=TIMEOUT, max_idle=MAX_IDLE):
+        self.dbname = dbname
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle = []
+        self.opened = 0
+        self.cond = threading.Condition()
+
+    def _healthy(self, conn, idled):
+        """Is this idle connection still usable."""
+        if conn.closed:
+            return False
+        if idled < PING_SECONDS:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except DBERRORS as exp:
+            LOG.info(
+                "dbpool %s dropping dead connection: %s", self.dbname, exp
+            )
+            return False
+
+    def _discard(self, conn):
+        """Close a connection and free its slot."""
+        try:
+            conn.close()
+        except DBERRORS:
+            pass
+        with self.cond:
+            self.opened -= 1
+            self.cond.notify()
+        _count(self.dbname, "psycopg2", "discards")
+
+    def getconn(self):
+        """Check out a raw connection, see `get_dbconn`."""
+        sts = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self.cond:
+                while not self.idle and self.opened >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        waited = time.perf_counter() - sts
+                        _record(self.dbname, "psycopg2", waited, True)
+                        raise PoolTimeout(
+                            f"no {self.dbname} connection in {self.timeout}s"
+                        )
+                    self.cond.wait(remaining)
+                if self.idle:
+                    conn, since = self.idle.pop()
+                else:
+                    conn, since = None, None
+                    self.opened += 1
+            if conn is None:
+                try:
+                    conn = _connect(self.dbname)
+                except Exception:
+                    with self.cond:
+                        self.opened -= 1
+                        self.cond.notify()
+                    raise
+                _count(self.dbname, "psycopg2", "connects")
+                break
+            if self._healthy(conn, time.monotonic() - since):
+                break
+            self._discard(conn)
+        _record(self.dbname, "psycopg2", time.perf_counter() - sts)
+        return conn
+
+    def putconn(self, conn):
+        """Reset a connection and give it back."""
+        _count(self.dbname, "psycopg2", "in_use", -1)
+        try:
+            if conn.closed:
+                raise psycopg2.InterfaceError(
+                    "connection closed while checked out"
+                )
+            # rolls back and reverts any SET done by the request
+            conn.reset()
+            if conn.autocommit:
+                conn.autocommit = False
+        except DBERRORS:
+            self._discard(conn)
+            return
+        with self.cond:
+            self.idle.append((conn, time.monotonic()))
+            self.cond.notify()
+        self.prune(time.monotonic())
+        _maybe_report()
+
+    def prune(self, now):
+        """Close the idle connections beyond max_idle or idle too long."""
+        with self.cond:
+            # the oldest are first, getconn takes from the end
+            keep = [
+                (conn, since)
+                for conn, since in self.idle
+                if now - since <= IDLE_SECONDS
+            ]
+            keep = keep[max(0, len(keep) - self.max_idle) :]
+            closing = [entry for entry in self.idle if entry not in keep]
+            if not closing:
+                return
+            self.idle = keep
+            self.opened -= len(closing)
+            self.cond.notify(len(closing))
+        for conn, _since in closing:
+            try:
+                conn.close()
+            except DBERRORS:
+                pass
+        _count(self.dbname, "psycopg2", "idle_closes", len(closing))
+
+    def closeall(self):
+        """Close the idle connections."""
+        with self.cond:
+            idle, self.idle = self.idle, []
+            self.opened -= len(idle)
+        for conn, _since in idle:
+            conn.close()
+
+
+def _pool(dbname):
+    """Get the pool of this database."""
+    with _LOCK:
+        if dbname not in _POOLS:
+            _POOLS[dbname] = Pool(dbname)
+            _start_reaper()
+        return _POOLS[dbname]
+
+
+def get_dbconn(dbname):
+    """Check out a pooled connection to this database.
+
+    Args:
+      dbname (str): database name.
+
+    Returns:
+      PooledConnection, whose close() returns it to the pool
+    """
+    pool = _pool(dbname)
+    return PooledConnection(pool, pool.getconn())
+
+
+class _TimedQueuePool(QueuePool):
+    """SQLAlchemy's queue pool, counting checkouts and waits."""
+
+    _dbname = None
+    _kind = "engine"
+
+    def recreate(self):
+        """Keep our database name when SQLAlchemy rebuilds the pool."""
+        pool = super().recreate()
+        pool._dbname = self._dbname
+        pool._kind = self._kind
+        return pool
+
+    def _do_get(self):
+        sts = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            _record(self._dbname, self._kind, time.perf_counter() - sts, True)
+            raise
+        _record(self._dbname, self._kind, time.perf_counter() - sts)
+        return conn
+
+    def _do_return_conn(self, record):
+        _count(self._dbname, self._kind, "in_use", -1)
+        record.info["returned"] = time.monotonic()
+        try:
+            self._pool.put(record, False)
+        except sqla_queue.Full:
+            # already keeping as many idle as we should
+            self._close_record(record)
+        _maybe_report()
+
+    def _close_record(self, record):
+        """Close an idle connection and free its slot."""
+        try:
+            record.close()
+        finally:
+            self._dec_overflow()
+        _count(self._dbname, self._kind, "idle_closes")
+
+    def prune(self, now):
+        """Close the idle connections idle for longer than IDLE_SECONDS."""
+        # the queue is first in first out, so this goes round it once
+        for _ in range(self._pool.qsize()):
+            try:
+                record = self._pool.get(False)
+            except sqla_queue.Empty:
+                return
+            if now - record.info.get("returned", now) > IDLE_SECONDS:
+                self._close_record(record)
+                continue
+            try:
+                self._pool.put(record, False)
+            except sqla_queue.Full:
+                self._close_record(record)
+
+
+def get_engine(dbname, downloads=False):
+    """Get this process's SQLAlchemy engine of this database.
+
+    Args:
+      dbname (str): database name.
+      downloads (bool): the engine of the download workbook builds.
+
+    Returns:
+      sqlalchemy.engine.Engine
+    """
+    kind = "download" if downloads else "engine"
+    size = DOWNLOAD_SIZE if downloads else SIZE
+    # SQLAlchemy keeps pool_size connections idle and closes the overflow
+    idle = max(1, min(MAX_IDLE, size))
+    with _LOCK:
+        if (kind, dbname) not in _ENGINES:
+            engine = create_engine(
+                get_dbconnstr(dbname),
+                poolclass=_TimedQueuePool,
+                pool_size=idle,
+                max_overflow=size - idle,
+                pool_timeout=TIMEOUT,
+                pool_pre_ping=True,
+                pool_recycle=3600,
+                pool_reset_on_return="rollback",
+            )
+            engine.pool._dbname = dbname
+            engine.pool._kind = kind
+            event.listen(
+                engine,
+                "connect",
+                lambda *_args, db=dbname: _count(db, kind, "connects"),
+            )
+            _ENGINES[(kind, dbname)] = engine
+            _start_reaper()
+        return _ENGINES[(kind, dbname)]
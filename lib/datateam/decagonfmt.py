@@ -0,0 +1,393 @@
+"""Declarative registry of the TD decagon logger dump formats.
+
+Each site's dump is described by an entry in ``FORMATS`` and turned into
+per plot DataFrames by the single parser ``read_format``.  Only the columns
+the registry names are read from the file and timestamps are parsed with an
+explicit format, so adding a site is a matter of adding an entry here.
+
+The keys of an entry are:
+
+  desc: the sites using this format.
+  reader: ``csv`` or ``excel``.
+  read: extra keyword arguments for pandas.read_csv or pandas.read_excel,
+    for example the ``skiprows`` and ``sheet_name``.
+  sheets: when every sheet is read (``sheet_name`` None), either
+    ``concat`` (default) to stack them or ``plots`` to make each sheet a
+    plot, skipping the ``skip_sheets``.
+  columns: {source column: name} shared by all plots, the source column is
+    either a position or a column name and one of the names is ``valid``.
+  plots: {plotid: {source column: name}} for files with plots side by side,
+    without it the file is the one plot given on the command line.
+  header_rows: number of rows after the header that complete the column
+    names, which are then translated from their ``Port N`` descriptions.
+  long: for files with a row per depth, a dict of the ``plot``, ``time`` and
+    ``depth`` columns, the ``values`` {source column: variable} and the
+    ``depths`` {depth: port}, where no ``depths`` numbers the sorted depths.
+  join: an entry for a companion file (relative to the dump) whose columns
+    are joined on valid, with ``how`` as in DataFrame.join.
+  timefmt: strptime format of the timestamps, when not given it is guessed
+    once from the first timestamp, False lets pandas work it out.
+  errors: passed to pandas.to_datetime, ``coerce`` makes bad timestamps
+    null so that they get culled.
+  usecols: False to read every column.
+
+Excel files are read with python-calamine when it is installed.
+"""
+import os
+
+import pandas as pd
+
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:
+    from pandas._libs.tslibs.parsing import guess_datetime_format
+try:
+    # The Rust calamine reader is many times faster than openpyxl
+    import python_calamine  # noqa
+
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None
+
+# Port variables of the 5TE sensors, in logger column order
+TME = ["temp", "moisture", "ec"]
+
+
+def ports(first, fields, count=7, stride=None, port=1):
+    """Build the {position: name} mapping of consecutive logger ports.
+
+    Args:
+      first (int): position of the first port's first column.
+      fields (list): variable of each column of a port, None to skip it.
+      count (int): number of ports.
+      stride (int): columns from one port to the next, default len(fields).
+      port (int): number of the first port.
+    """
+    stride = stride or len(fields)
+    res = {}
+    for i in range(count):
+        for j, field in enumerate(fields):
+            if field is not None:
+                res[first + i * stride + j] = f"d{port + i}{field}"
+    return res
+
+
+def depths(prefix, inches):
+    """Build the {column name: name} mapping of a probe's depths."""
+    return {
+        f'{prefix} {depth}"': f"d{i}moisture"
+        for i, depth in enumerate(inches, 1)
+    }
+
+
+FORMATS = {
+    "0": {
+        "desc": "DPAC",
+        "reader": "csv",
+        "read": {"sep": "\t"},
+        "columns": {
+            0: "valid",
+            **ports(1, ["moisture", "temp", "ec"], count=1),
+            **ports(4, ["moisture", "temp"], count=4, port=2),
+        },
+    },
+    "1": {
+        "reader": "csv",
+        "read": {"skiprows": [0, 1, 2, 3, 5, 6]},
+        "columns": {0: "valid"},
+        "plots": {"CD1": ports(2, TME), "CD2": ports(23, TME)},
+    },
+    "2": {
+        "reader": "excel",
+        "read": {"sheet_name": None},
+        "columns": {"Date": "valid"},
+        "plots": {
+            "trees": depths("trees", [3, 6, 12, 24, 36]),
+            "grass": depths("grass", [3, 6, 12, 24, 36]),
+        },
+        "errors": "coerce",
+    },
+    "3": {
+        "desc": "SERF_IA",
+        "reader": "excel",
+        "read": {"sheet_name": None},
+        "sheets": "plots",
+        "skip_sheets": ["metadata"],
+        "header_rows": 2,
+        "usecols": False,
+        "errors": "coerce",
+    },
+    "4": {
+        "reader": "excel",
+        "read": {"skiprows": range(4), "sheet_name": "Data"},
+        "columns": {0: "valid"},
+        "plots": {
+            "1": ports(2, TME + [None]),
+            "2": ports(30, TME + [None]),
+        },
+    },
+    "5": {
+        "reader": "excel",
+        "read": {"skiprows": range(6), "sheet_name": "Data"},
+        "columns": {0: "valid"},
+        "plots": {
+            "1": ports(2, TME + [None], stride=8),
+            "2": ports(58, TME + [None], stride=8),
+        },
+        "errors": "coerce",
+    },
+    "6": {
+        "desc": "MAASS",
+        "reader": "excel",
+        "read": {"sheet_name": None},
+        "columns": {0: "valid", **ports(1, ["moisture"], count=5)},
+        "plots": {"1": {}},
+        "errors": "coerce",
+        "join": {
+            "filename": "Maass soil temperature.xlsx",
+            "how": "right",
+            "reader": "excel",
+            "read": {"skiprows": [1], "sheet_name": None},
+            "columns": {0: "valid", **ports(1, ["temp"], count=5)},
+            "errors": "coerce",
+        },
+    },
+    "7": {
+        "reader": "csv",
+        "long": {
+            "plot": "plotID",
+            "time": "date",
+            "depth": "depth",
+            "values": {"SM": "moisture"},
+        },
+        "plots": {7: "7", 8: "8"},
+    },
+    "8": {
+        "desc": "CLAY_R, FAIRM",
+        "reader": "csv",
+        "long": {
+            "plot": "plotid",
+            "time": "timestamp",
+            "depth": "depth",
+            "values": {
+                "soil_moisture": "moisture",
+                "soil_temp": "temp",
+                "soil_ec": "ec",
+            },
+            "depths": {
+                "5 cm": 1,
+                "15 cm": 2,
+                "30 cm": 3,
+                "45 cm": 4,
+                "60 cm": 5,
+                "75 cm": 6,
+                "90 cm": 7,
+            },
+        },
+    },
+}
+
+
+def translate(df):
+    """Translate the Port N column descriptions into our column names."""
+    x = {}
+    for colname in df.columns:
+        tokens = colname.split()
+        name = None
+        if colname.find("Measurement Time") > 0:
+            name = "valid"
+        elif colname.startswith("Port "):
+            name = "d%s" % (tokens[1].split(".")[0],)
+            if colname.find("Bulk") > 0:
+                name += "ec"
+            elif colname.find("VWC") > 0:
+                name += "moisture"
+            else:
+                name += "temp"
+
+        if name is not None:
+            x[colname] = name
+
+    df.rename(columns=x, inplace=True)
+
+
+def parse_times(series, timefmt=None, errors="raise"):
+    """Convert the timestamps with an explicit format.
+
+    Values not matching the format are given another go with pandas'
+    own parsing, so a bad guess costs time but not rows.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    if timefmt is None:
+        first = series.dropna()
+        if not first.empty and isinstance(first.iloc[0], str):
+            timefmt = guess_datetime_format(first.iloc[0].strip())
+    if not timefmt:
+        return pd.to_datetime(series, errors=errors)
+    res = pd.to_datetime(series, format=timefmt, errors="coerce")
+    bad = res.isna() & series.notna()
+    if bad.any():
+        print(
+            "%s timestamps did not match %s, e.g. %s"
+            % (bad.sum(), timefmt, series[bad].iloc[0])
+        )
+        res = res.astype(object)
+        res[bad] = pd.to_datetime(series[bad], errors=errors)
+        res = pd.to_datetime(res)
+    return res
+
+
+def wanted_columns(spec):
+    """Get the {source column: name} of every column read from the file."""
+    if "long" in spec:
+        long = spec["long"]
+        cols = [long["plot"], long["time"], long["depth"], *long["values"]]
+        return {c: c for c in cols}
+    res = dict(spec.get("columns", {}))
+    for cols in spec.get("plots", {}).values():
+        res.update(cols)
+    return res
+
+
+def read_frames(filename, spec):
+    """Read the file, returning {sheet name: DataFrame} or a DataFrame.
+
+    Positional columns are labelled by their position.
+    """
+    wanted = wanted_columns(spec)
+    positional = bool(wanted) and all(isinstance(c, int) for c in wanted)
+    usecols = spec.get("usecols", True) and bool(wanted)
+    kwargs = dict(spec.get("read", {}))
+    if usecols:
+        if positional:
+            kwargs["usecols"] = sorted(wanted)
+        else:
+            kwargs["usecols"] = lambda c: c in wanted
+    if spec["reader"] == "csv":
+        res = pd.read_csv(filename, index_col=False, **kwargs)
+    else:
+        kwargs.setdefault("engine", EXCEL_ENGINE)
+        res = pd.read_excel(filename, **kwargs)
+    frames = res if isinstance(res, dict) else {None: res}
+    if positional:
+        for df in frames.values():
+            df.columns = sorted(wanted) if usecols else range(df.shape[1])
+    if not isinstance(res, dict):
+        return res
+    frames = {
+        name: df
+        for name, df in frames.items()
+        if name not in spec.get("skip_sheets", [])
+    }
+    if spec.get("sheets", "concat") == "plots":
+        return frames
+    return pd.concat(frames.values(), ignore_index=True)
+
+
+def from_header_rows(df, rows):
+    """Complete the column names with the rows that follow the header."""
+    names = [
+        " ".join(str(x) for x in parts)
+        for parts in zip(df.columns, *[df.iloc[i] for i in range(rows)])
+    ]
+    df = df.iloc[rows:].copy()
+    df.columns = names
+    translate(df)
+    return df
+
+
+def valid_source(spec):
+    """Get the source column of the timestamps."""
+    if "long" in spec:
+        return spec["long"]["time"]
+    for col, name in spec.get("columns", {}).items():
+        if name == "valid":
+            return col
+    return "valid"
+
+
+def select(df, cols):
+    """Get the valid and these {source column: name} columns of df."""
+    res = df[["valid", *cols]].copy()
+    res.columns = ["valid", *cols.values()]
+    return res
+
+
+def pivot_long(df, long, plots):
+    """Turn rows per depth into DataFrames of columns per depth."""
+    if plots is not None:
+        df = df[df[long["plot"]].isin(list(plots))]
+    piv = pd.pivot_table(
+        df,
+        values=list(long["values"]),
+        index=[long["plot"], "valid"],
+        columns=[long["depth"]],
+    )
+    portmap = long.get("depths") or {
+        depth: i for i, depth in enumerate(sorted(piv.columns.unique(1)), 1)
+    }
+    piv = piv.loc[:, [c for c in piv.columns if c[1] in portmap]]
+    piv.columns = [
+        "d%s%s" % (portmap[depth], long["values"][value])
+        for value, depth in piv.columns
+    ]
+    res = {}
+    for plotid, gdf in piv.groupby(level=0):
+        key = plotid if plots is None else plots[plotid]
+        res[key] = gdf.reset_index(level=0, drop=True).reset_index()
+    return res
+
+
+def parse_frame(df, spec):
+    """Get {plotid: DataFrame} out of a DataFrame read from the file."""
+    if spec.get("header_rows"):
+        df = from_header_rows(df, spec["header_rows"])
+    else:
+        df = df.rename(columns={valid_source(spec): "valid"})
+    df["valid"] = parse_times(
+        df["valid"], spec.get("timefmt"), spec.get("errors", "raise")
+    )
+    if "long" in spec:
+        return pivot_long(df, spec["long"], spec.get("plots"))
+    common = {k: v for k, v in spec.get("columns", {}).items() if v != "valid"}
+    if "plots" not in spec:
+        if spec.get("header_rows"):
+            return {None: df}
+        return {None: select(df, common)}
+    return {
+        plotid: select(df, {**common, **cols})
+        for plotid, cols in spec["plots"].items()
+    }
+
+
+def read_format(filename, fmt, spec=None):
+    """Parse a logger dump into {plotid: DataFrame}.
+
+    Each DataFrame has a valid column of timestamps and dNvariable columns,
+    a plotid of None stands for the plot given on the command line.
+
+    Args:
+      filename (str): the dump to read.
+      fmt (str): key of its entry in FORMATS.
+      spec (dict): optional, use this entry instead of the FORMATS one.
+    """
+    spec = spec or FORMATS[fmt]
+    frames = read_frames(filename, spec)
+    if isinstance(frames, dict):
+        return {
+            plotid: parse_frame(df, spec)[None]
+            for plotid, df in frames.items()
+        }
+    res = parse_frame(frames, spec)
+    if "join" in spec:
+        join = spec["join"]
+        other = os.path.join(os.path.dirname(filename), join["filename"])
+        odf = parse_frame(read_frames(other, join), join)[None]
+        for plotid, df in res.items():
+            res[plotid] = (
+                df.set_index("valid")
+                .join(odf.set_index("valid"), how=join.get("how", "left"))
+                .reset_index()
+            )
+    return res
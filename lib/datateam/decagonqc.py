@@ -0,0 +1,75 @@
+"""Incremental quality control of the decagon data.
+
+The ingest scripts record the time ranges they load in the decagon_qc_queue
+table, which `claim` hands out to be checked by the datateam.qcrules rules,
+so nightly QC only looks at the newly ingested data.
+"""
+from datateam import qcrules
+
+
+def ensure_queue(cursor):
+    """Create the queue of time ranges awaiting QC, should it not exist."""
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS decagon_qc_queue(
+            uniqueid text, plotid text, sts timestamptz, ets timestamptz,
+            queued timestamptz DEFAULT now())
+    """
+    )
+
+
+def enqueue(cursor, uniqueid, plotid, sts, ets):
+    """Record a newly loaded time range as needing QC."""
+    cursor.execute(
+        """
+        INSERT into decagon_qc_queue(uniqueid, plotid, sts, ets)
+        VALUES (%s, %s, %s, %s)
+    """,
+        (uniqueid, plotid, sts, ets),
+    )
+
+
+def queued_plots(cursor, uniqueid=None):
+    """Get the (uniqueid, plotid) with time ranges awaiting QC."""
+    cursor.execute(
+        """
+        SELECT distinct uniqueid, plotid from decagon_qc_queue
+        WHERE %s is null or uniqueid = %s ORDER by uniqueid, plotid
+    """,
+        (uniqueid, uniqueid),
+    )
+    return cursor.fetchall()
+
+
+def claim(cursor, uniqueid, plotid):
+    """Take the plot's queued time ranges, merging those that overlap.
+
+    The queue entries are deleted within the cursor's transaction, so they
+    come back should the QC not get committed.
+
+    Returns:
+      list of (sts, ets) tuples
+    """
+    cursor.execute(
+        """
+        DELETE from decagon_qc_queue WHERE uniqueid = %s and plotid = %s
+        RETURNING sts, ets
+    """,
+        (uniqueid, plotid),
+    )
+    res = []
+    back = qcrules.lookback("decagon", uniqueid)
+    for sts, ets in sorted(cursor.fetchall()):
+        # Ranges sharing their lookback are cheaper done together
+        if res and sts <= res[-1][1] + back:
+            res[-1] = (res[-1][0], max(ets, res[-1][1]))
+        else:
+            res.append((sts, ets))
+    return res
+
+
+def qc_plot(cursor, uniqueid, plotid, sts=None, ets=None, runid=None):
+    """Run the decagon rules of one site and plot, see qcrules.run_plot."""
+    return qcrules.run_plot(
+        cursor, "decagon", uniqueid, plotid, sts, ets, runid
+    )
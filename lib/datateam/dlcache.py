@@ -0,0 +1,179 @@
+"""Cache of built download spreadsheets.
+
+A workbook is stored under a hash of the normalized request and of the
+current data version of every table it may read from, so any harvest or
+ingest script writing to a table invalidates the cached workbooks built
+from it without needing to know about this cache.
+
+The data version of a table is the value of its ``dataversion_<table>``
+sequence, which a statement trigger, see `ensure_versioning`, bumps on every
+INSERT, UPDATE, DELETE, COPY and TRUNCATE, along with the table's oid and the
+row change counters PostgreSQL keeps for it.  The sequence never goes back,
+unlike the counters, which a stats reset or crash recovery zeroes.  It is
+bumped before the writer commits, so a reader could build from the old rows
+under the new value; the counters only move once the writer is done, and
+so keep such a response from being found again.  A table without a sequence
+has no data version and anything reading it is not cached.
+
+Entries are hard links into ``CACHEDIR``, which lives on the same filesystem
+as the public ``/var/webtmp`` download area.  A hit links the cached file to
+a new public name, so evicting an entry never breaks a link already emailed
+to somebody.  Eviction is least recently used once ``MAXBYTES`` is reached.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from pyiem.util import logger
+
+LOG = logger()
+CACHEDIR = "/var/webtmp/dlcache"
+# Prefix of the data version sequence of each table
+VERSION_PREFIX = "dataversion_"
+MAXBYTES = 2 * 1024**3
+# These request attributes do not change the generated workbook
+IGNORED = ["email"]
+
+
+def ensure_versioning(cursor, table):
+    """Have every write to this table bump its data version.
+
+    Args:
+      cursor: database cursor, the caller commits.
+      table (str): the table.
+    """
+    seqname = f"{VERSION_PREFIX}{table}"
+    cursor.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION dataversion_bump() RETURNS trigger
+        LANGUAGE plpgsql SECURITY DEFINER SET search_path = public AS $$
+        BEGIN
+            PERFORM nextval(quote_ident('{VERSION_PREFIX}' || TG_TABLE_NAME));
+            RETURN NULL;
+        END
+        $$
+        """
+    )
+    cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {seqname}")
+    cursor.execute(f"GRANT SELECT on {seqname} to nobody,apache")
+    cursor.execute(f"DROP TRIGGER IF EXISTS dataversion ON {table}")
+    cursor.execute(
+        f"CREATE TRIGGER dataversion AFTER INSERT OR UPDATE OR DELETE OR "
+        f"TRUNCATE ON {table} FOR EACH STATEMENT "
+        "EXECUTE PROCEDURE dataversion_bump()"
+    )
+    cursor.execute("SELECT nextval(%s)", (seqname,))
+
+
+def table_versions(cursor, tables):
+    """Return a dictionary of data version stamps for the given tables.
+
+    The table oid is included so that a dropped and reloaded table never
+    reuses the stamp of its predecessor, and the stats reset and server
+    start times so that counters starting over never do either.
+
+    Returns:
+      dict of table to stamp, None should any table have no data version
+    """
+    cursor.execute(
+        "SELECT relname, relid, pg_sequence_last_value(to_regclass(%s || "
+        "relname)), n_tup_ins, n_tup_upd, n_tup_del, (SELECT stats_reset "
+        "from pg_stat_database WHERE datname = current_database()), "
+        "pg_postmaster_start_time() "
+        "from pg_stat_user_tables WHERE relname = ANY(%s)",
+        (VERSION_PREFIX, list(tables)),
+    )
+    versions = {}
+    for row in cursor:
+        if row[2] is not None:
+            versions[row[0]] = ":".join(str(x) for x in row[1:])
+    missing = set(tables) - set(versions)
+    if missing:
+        LOG.info("no data version for %s, not caching", sorted(missing))
+        return None
+    return versions
+
+
+def request_key(project, request, versions):
+    """Compute the cache key for this request.
+
+    Args:
+      project (str): the download website making the request.
+      request (dict): the normalized request, lists are order independent.
+      versions (dict): as returned by `table_versions`.
+
+    Returns:
+      str hex digest
+    """
+    norm = {}
+    for key, val in request.items():
+        if key in IGNORED:
+            continue
+        norm[key] = sorted(set(val)) if isinstance(val, list) else val
+    payload = json.dumps(
+        {"project": project, "request": norm, "versions": versions},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cachefn(key):
+    """Where this key is stored."""
+    return os.path.join(CACHEDIR, f"{key}.xlsx")
+
+
+def _link(src, dest):
+    """Hard link when we can, copy when we can not."""
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+def fetch(key, dest):
+    """Place the cached workbook at dest, returns True on a cache hit."""
+    cachefn = _cachefn(key)
+    try:
+        # bump the mtime, which is our LRU clock
+        os.utime(cachefn)
+        _link(cachefn, dest)
+    except OSError:
+        LOG.info("dlcache miss %s", key)
+        return False
+    LOG.info("dlcache hit %s", key)
+    return True
+
+
+def store(key, src):
+    """Add the built workbook at src to the cache."""
+    try:
+        os.makedirs(CACHEDIR, exist_ok=True)
+        # unique to this thread, another may be storing the same key
+        tmpfn = f"{_cachefn(key)}.{os.getpid()}.{threading.get_ident()}"
+        _link(src, tmpfn)
+        os.rename(tmpfn, _cachefn(key))
+        prune()
+    except OSError as exp:
+        LOG.warning("dlcache store of %s failed: %s", key, exp)
+
+
+def prune(maxbytes=MAXBYTES):
+    """Evict least recently used entries until we are under maxbytes."""
+    entries = []
+    for fn in os.listdir(CACHEDIR):
+        try:
+            stat = os.stat(os.path.join(CACHEDIR, fn))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, fn))
+    total = sum(e[1] for e in entries)
+    for _mtime, size, fn in sorted(entries):
+        if total <= maxbytes:
+            break
+        try:
+            os.unlink(os.path.join(CACHEDIR, fn))
+        except FileNotFoundError:
+            pass
+        total -= size
@@ -0,0 +1,249 @@
+"""Write download sheets and table responses as csv or Excel.
+
+Large download tables are read with a server side cursor and written a
+chunk at a time as csv files within a zip file, nothing needing the whole
+sheet in memory.
+
+Table responses are built straight into memory, `to_xlsx` through the
+xlsxwriter worksheet API and `iter_csv` a chunk of rows at a time.  The
+description and units rows under the column names (the "bling") are
+written as rows of their own, rather than concatenated onto the frame,
+which would make every column of it object.
+"""
+import datetime
+import io
+import os
+import time
+import zipfile
+
+import pandas as pd
+import xlsxwriter
+from pyiem.util import logger
+from sqlalchemy import create_engine
+
+LOG = logger()
+# Rows fetched from the server side cursor at a time, which bounds memory
+CHUNKSIZE = int(os.environ.get("DATATEAM_CHUNKSIZE", 50000))
+# Workbooks of more rows than this are written in xlsxwriter's constant
+# memory mode, flushing each row to a temporary file, smaller ones in memory
+CONSTANT_ROWS = int(os.environ.get("DATATEAM_CONSTANT_ROWS", 5000))
+WORKBOOK_OPTIONS = {
+    "strings_to_formulas": False,
+    "strings_to_urls": False,
+    "remove_timezone": True,
+    "default_date_format": "yyyy-mm-dd hh:mm:ss",
+}
+
+
+def read_sql_chunks(dbconnstr, sql, params=None, chunksize=None):
+    """Yield DataFrames of at most chunksize rows using a server side cursor.
+
+    The time spent fetching each chunk and the time the caller spent with
+    it are logged.
+
+    Args:
+      dbconnstr (str): database connection string, or an Engine such as
+        `dbpool.get_engine` gives, which is left open.
+      sql (str or sqlalchemy.text): the query.
+      params (dict): query parameters.
+      chunksize (int): number of rows per DataFrame, defaults to CHUNKSIZE.
+    """
+    chunksize = chunksize or CHUNKSIZE
+    engine = dbconnstr
+    if isinstance(dbconnstr, str):
+        engine = create_engine(dbconnstr)
+    try:
+        # psycopg2 makes this a named cursor
+        with engine.connect().execution_options(
+            stream_results=True, max_row_buffer=chunksize
+        ) as conn:
+            sts = time.time()
+            for i, df in enumerate(
+                pd.read_sql(sql, conn, params=params, chunksize=chunksize)
+            ):
+                fetched = time.time()
+                yield df
+                LOG.info(
+                    "chunk %s rows: %s fetch: %.3fs process: %.3fs",
+                    i,
+                    len(df.index),
+                    fetched - sts,
+                    time.time() - fetched,
+                )
+                sts = time.time()
+    finally:
+        if engine is not dbconnstr:
+            engine.dispose()
+
+
+def open_csvzip(filename):
+    """Create a zip file to write csv files into."""
+    return zipfile.ZipFile(filename, "w", compression=zipfile.ZIP_DEFLATED)
+
+
+def write_csv(zfh, name, chunks, bling=None):
+    """Write one csv file into the zip file.
+
+    Args:
+      zfh (zipfile.ZipFile): as returned by `open_csvzip`.
+      name (str): name of the csv file.
+      chunks (DataFrame or iterator of DataFrames): the rows to write.
+      bling (callable): optional, takes the columns and returns the list of
+        header rows (as dicts) that follow the column names.
+    """
+    if isinstance(chunks, pd.DataFrame):
+        chunks = [chunks]
+    with zfh.open(name, "w", force_zip64=True) as bfh:
+        fh = io.TextIOWrapper(bfh, encoding="utf-8", newline="")
+        cols = None
+        for df in chunks:
+            if cols is None:
+                cols = df.columns
+                pd.DataFrame(columns=cols).to_csv(fh, index=False)
+                if bling is not None:
+                    metadf = pd.DataFrame(bling(cols)).reindex(columns=cols)
+                    metadf.to_csv(fh, index=False, header=False)
+            # Keep the columns in the order of the header
+            df.reindex(columns=cols).to_csv(fh, index=False, header=False)
+        fh.flush()
+        fh.detach()
+
+
+def write_csvzip(filename, sheets):
+    """Write the sheets as csv files within a zip file.
+
+    Args:
+      filename (str): the zip file to create.
+      sheets (list): of (csvname, getter, bling) tuples, the getter takes no
+        arguments and returns the chunks given to `write_csv`.
+    """
+    with open_csvzip(filename) as zfh:
+        for csvname, getter, bling in sheets:
+            write_csv(zfh, csvname, getter(), bling)
+
+
+def header_rows(cols, bling=None):
+    """The column names and bling rows of a sheet, as lists of cells.
+
+    Args:
+      cols (list): the column names.
+      bling (callable): optional, as given to `write_csv`.
+
+    Returns:
+      list of lists, missing cells are None
+    """
+    rows = [list(cols)]
+    for row in bling(cols) if bling is not None else []:
+        cells = [row.get(col) for col in cols]
+        rows.append([None if pd.isna(c) else c for c in cells])
+    return rows
+
+
+def _is_date(ser):
+    """Does this column hold dates without a time."""
+    if ser.dtype != object:
+        return False
+    val = ser.first_valid_index()
+    if val is None:
+        return False
+    val = ser[val]
+    return isinstance(val, datetime.date) and not isinstance(
+        val, datetime.datetime
+    )
+
+
+def _cells(ser):
+    """The values of a column as xlsxwriter takes them, None when missing."""
+    if isinstance(ser.dtype, pd.DatetimeTZDtype):
+        ser = ser.dt.tz_localize(None)
+    values = ser.to_numpy(dtype=object, copy=True)
+    values[pd.isna(values)] = None
+    return values
+
+
+def write_sheet(workbook, sheetname, df, bling=None, freeze=0):
+    """Write a frame as a worksheet, a row at a time.
+
+    Args:
+      workbook (xlsxwriter.Workbook): the workbook.
+      sheetname (str): the worksheet name.
+      df (DataFrame): the rows.
+      bling (callable): optional, as given to `write_csv`.
+      freeze (int): rows to freeze at the top of the sheet.
+
+    Returns:
+      the xlsxwriter worksheet
+    """
+    worksheet = workbook.add_worksheet(sheetname)
+    bold = workbook.add_format({"bold": True})
+    datefmt = workbook.add_format({"num_format": "yyyy-mm-dd"})
+    rows = header_rows(df.columns, bling)
+    for rownum, row in enumerate(rows):
+        worksheet.write_row(rownum, 0, row, bold if rownum == 0 else None)
+    formats = [datefmt if _is_date(ser) else None for _, ser in df.items()]
+    columns = [_cells(ser) for _, ser in df.items()]
+    for rownum, row in enumerate(zip(*columns), start=len(rows)):
+        for colnum, val in enumerate(row):
+            if val is not None:
+                worksheet.write(rownum, colnum, val, formats[colnum])
+    if freeze:
+        worksheet.freeze_panes(freeze, 0)
+    return worksheet
+
+
+def to_xlsx(df, sheetname="Data", bling=None, freeze=0, constant_memory=None):
+    """Build a single sheet Excel workbook in memory.
+
+    Args:
+      df (DataFrame): the rows.
+      sheetname (str): the worksheet name.
+      bling (callable): optional, as given to `write_csv`.
+      freeze (int): rows to freeze at the top of the sheet.
+      constant_memory (bool): write the rows through a temporary file, by
+        default when there are more than CONSTANT_ROWS of them.
+
+    Returns:
+      bytes
+    """
+    if constant_memory is None:
+        constant_memory = len(df.index) > CONSTANT_ROWS
+    bio = io.BytesIO()
+    options = dict(
+        WORKBOOK_OPTIONS,
+        constant_memory=constant_memory,
+        in_memory=not constant_memory,
+    )
+    workbook = xlsxwriter.Workbook(bio, options)
+    write_sheet(workbook, sheetname, df, bling, freeze)
+    workbook.close()
+    return bio.getvalue()
+
+
+def iter_csv(df, bling=None, chunksize=None):
+    """Yield the utf-8 encoded csv of a frame, a chunk of rows at a time.
+
+    Args:
+      df (DataFrame): the rows.
+      bling (callable): optional, as given to `write_csv`.
+      chunksize (int): rows per chunk, defaults to CHUNKSIZE.
+    """
+    chunksize = chunksize or CHUNKSIZE
+    cols = df.columns
+    fh = io.StringIO()
+    pd.DataFrame(columns=cols).to_csv(fh, index=False)
+    if bling is not None:
+        metadf = pd.DataFrame(bling(cols)).reindex(columns=cols)
+        metadf.to_csv(fh, index=False, header=False)
+    yield fh.getvalue().encode("utf-8")
+    # pandas formats time zone aware columns much slower than the same
+    # values as objects, which come out the same
+    tzcols = [
+        col
+        for col, dtype in df.dtypes.items()
+        if isinstance(dtype, pd.DatetimeTZDtype)
+    ]
+    for i in range(0, len(df.index), chunksize):
+        chunk = df.iloc[i : i + chunksize]
+        if tzcols:
+            chunk = chunk.astype({col: object for col in tzcols})
+        yield chunk.to_csv(index=False, header=False).encode("utf-8")
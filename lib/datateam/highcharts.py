@@ -0,0 +1,101 @@
+"""Serialize plot series for Highcharts.
+
+The ``data`` of a Highcharts series is a JSON array of ``[x, y]`` pairs.
+`series_data` hands the arrays to the C JSON encoder of pandas, so no
+Python objects are made per point and missing values come out as null.
+Long raw series are first cut down to what the chart can show with
+`downsample`.
+"""
+import numpy as np
+import pandas as pd
+
+# The pixel width of the charts, a bucket of points is kept per pixel
+WIDTH = 1200
+
+
+def ticks(values):
+    """Get the Highcharts x values, milliseconds since 1970 UTC.
+
+    Args:
+      values: the datetimes, naive ones are taken as UTC.
+
+    Returns:
+      numpy int64 array
+    """
+    idx = pd.DatetimeIndex(pd.to_datetime(values))
+    if idx.tz is not None:
+        idx = idx.tz_convert("UTC").tz_localize(None)
+    return idx.values.astype("datetime64[ms]").astype(np.int64)
+
+
+def series_data(x, y, decimals=10):
+    """Get the JSON ``[[x, y], ...]`` array of a series.
+
+    Args:
+      x: the x values, integers such as `ticks` or years.
+      y: the y values, None, NaN and infinite values become null.
+      decimals (int): the most decimal places written for y.
+
+    Returns:
+      str
+    """
+    y = pd.Series(y).to_numpy(dtype=float, na_value=np.nan)
+    df = pd.DataFrame({"x": np.asarray(x, dtype=np.int64), "y": y})
+    return df.to_json(orient="values", double_precision=decimals)
+
+
+def downsample(y, buckets):
+    """Pick the points of a long series that keep its shape when drawn.
+
+    The series is cut into buckets of consecutive points, one per pixel
+    column of the chart, and the first, smallest, largest and last values of
+    each are kept (the M4 algorithm), so peaks and the lines joining the
+    buckets look as they would with every point.  Buckets without any values
+    keep their first point, leaving the gap.
+
+    Args:
+      y: the values, in time order and roughly evenly spaced.
+      buckets (int): the number of buckets, zero or less keeps every point.
+
+    Returns:
+      numpy array of the sorted positions of the points to keep
+    """
+    y = pd.Series(y).to_numpy(dtype=float, na_value=np.nan)
+    size = len(y)
+    if buckets <= 0 or size <= 4 * buckets:
+        return np.arange(size)
+    width = -(-size // buckets)
+    rows = -(-size // width)
+    grid = np.full(rows * width, np.nan)
+    grid[:size] = y
+    grid = grid.reshape(rows, width)
+    valid = ~np.isnan(grid)
+    picks = np.column_stack(
+        [
+            valid.argmax(axis=1),
+            np.where(valid, grid, np.inf).argmin(axis=1),
+            np.where(valid, grid, -np.inf).argmax(axis=1),
+            width - 1 - valid[:, ::-1].argmax(axis=1),
+        ]
+    )
+    res = (np.arange(rows)[:, None] * width + picks).ravel()
+    return np.unique(res[res < size])
+
+
+def downsample_frame(df, columns, buckets):
+    """Downsample the rows of a frame, keeping the points of every column.
+
+    Args:
+      df (DataFrame): the rows, in time order.
+      columns (list): the columns to keep the shape of.
+      buckets (int): see `downsample`.
+
+    Returns:
+      DataFrame
+    """
+    if buckets <= 0 or len(df.index) <= 4 * buckets:
+        return df
+    keep = np.unique(
+        np.concatenate([downsample(df[col], buckets) for col in columns])
+    )
+    return df.iloc[keep]
@@ -0,0 +1,139 @@
+"""A spool directory backed job queue.
+
+Each job is a json file that moves between the ``queued``, ``running``,
+``done`` and ``failed`` subdirectories of its queue.  A rename is atomic on
+a single filesystem, so a worker claims a job by moving it into ``running``
+and no two workers can ever build the same job.
+"""
+import datetime
+import json
+import os
+import re
+import uuid
+
+SPOOLDIR = "/var/spool/datateam"
+STATES = ["queued", "running", "done", "failed"]
+JOBID_RE = re.compile(r"^[0-9]{14}_[0-9a-f]{8}$")
+ISOFMT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+def _utcnow():
+    """Our timestamp helper."""
+    return datetime.datetime.utcnow()
+
+
+def _path(queue, state, jobid):
+    """Location of this job's json file."""
+    return os.path.join(SPOOLDIR, queue, state, f"{jobid}.json")
+
+
+def _write(fn, job):
+    """Atomically write the job file."""
+    tmpfn = f"{fn}.tmp"
+    with open(tmpfn, "w", encoding="utf-8") as fh:
+        json.dump(job, fh)
+    os.rename(tmpfn, fn)
+
+
+def _read(fn):
+    """Load a job file."""
+    with open(fn, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _seconds(job, key1, key2):
+    """Compute the elapsed seconds between two job timestamps."""
+    sts = datetime.datetime.strptime(job[key1], ISOFMT)
+    ets = datetime.datetime.strptime(job[key2], ISOFMT)
+    return round((ets - sts).total_seconds(), 3)
+
+
+def ensure_queue(queue):
+    """Make sure the spool directories exist for this queue."""
+    for state in STATES:
+        os.makedirs(os.path.join(SPOOLDIR, queue, state), exist_ok=True)
+
+
+def enqueue(queue, payload):
+    """Add a job to the queue and return its identifier.
+
+    Args:
+      queue (str): name of the queue.
+      payload (dict): json serializable job arguments.
+
+    Returns:
+      str job identifier
+    """
+    ensure_queue(queue)
+    utcnow = _utcnow()
+    jobid = f"{utcnow:%Y%m%d%H%M%S}_{uuid.uuid4().hex[:8]}"
+    job = {
+        "jobid": jobid,
+        "state": "queued",
+        "queued_at": utcnow.strftime(ISOFMT),
+        "payload": payload,
+    }
+    _write(_path(queue, "queued", jobid), job)
+    return jobid
+
+
+def get_job(queue, jobid):
+    """Find a job, returns None when it is unknown."""
+    if jobid is None or not JOBID_RE.match(jobid):
+        return None
+    for state in STATES:
+        try:
+            return _read(_path(queue, state, jobid))
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def claim(queue):
+    """Claim the oldest queued job, returns None when the queue is empty."""
+    queued = os.path.join(SPOOLDIR, queue, "queued")
+    for fn in sorted(f for f in os.listdir(queued) if f.endswith(".json")):
+        jobid = fn[:-5]
+        running = _path(queue, "running", jobid)
+        try:
+            os.rename(os.path.join(queued, fn), running)
+        except FileNotFoundError:
+            # Some other worker beat us to it
+            continue
+        job = _read(running)
+        job["state"] = "running"
+        job["started_at"] = _utcnow().strftime(ISOFMT)
+        job["wait_seconds"] = _seconds(job, "queued_at", "started_at")
+        _write(running, job)
+        return job
+    return None
+
+
+def finish(queue, job, error=None):
+    """Mark a claimed job as done, or failed when an error is provided."""
+    state = "done" if error is None else "failed"
+    job["state"] = state
+    job["finished_at"] = _utcnow().strftime(ISOFMT)
+    job["run_seconds"] = _seconds(job, "started_at", "finished_at")
+    if error is not None:
+        job["error"] = str(error)
+    _write(_path(queue, state, job["jobid"]), job)
+    os.unlink(_path(queue, "running", job["jobid"]))
+    return job
+
+
+def requeue(queue, job):
+    """Put a claimed job back in the queue."""
+    job["state"] = "queued"
+    _write(_path(queue, "queued", job["jobid"]), job)
+    os.unlink(_path(queue, "running", job["jobid"]))
+
+
+def requeue_stale(queue):
+    """Return any jobs left running by a dead worker back to the queue."""
+    ensure_queue(queue)
+    running = os.path.join(SPOOLDIR, queue, "running")
+    for fn in os.listdir(running):
+        if not fn.endswith(".json"):
+            continue
+        requeue(queue, _read(os.path.join(running, fn)))
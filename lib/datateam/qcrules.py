@@ -0,0 +1,574 @@
+"""Declarative quality control rules for the logger time series.
+
+The rules are declared in ``RULES``, each naming a rule type, the dataset
+it applies to, optionally the variables and sites it is limited to, and the
+parameters of the rule type.  A site specific declaration replaces the
+general one of the same rule type and variables for that site.
+
+A site and plot's series is loaded once, the rules are evaluated on the
+numpy arrays in the order they are declared and the changed ``_qc`` values
+(and ``_qcflag`` codes, where the table has them) are written back with a
+single UPDATE from a COPY loaded temporary table.  The hits, values checked
+and time spent by each rule are saved to the qc_rule_stats table.
+
+New rule types are added with the `rule` decorator, for example:
+
+    @rule("stuck", flag="S")
+    def stuck(raw, vals, valid, count):
+        ...return a boolean array of the values to null
+"""
+import datetime
+import io
+import time
+
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+
+# The tables holding each dataset, {column: variable} of the observations
+# they have _qc columns for and whether they also have _qcflag columns.
+DATASETS = {
+    "decagon": {
+        "table": "decagon_data",
+        "flags": True,
+        "variables": {
+            f"d{d}{v}": v
+            for d in range(1, 6)
+            for v in (
+                ["moisture", "temp", "ec"] if d == 1 else ["moisture", "temp"]
+            )
+        },
+    },
+    "watertable": {
+        "table": "watertable_data",
+        "flags": False,
+        "variables": {"depth_mm": "depth"},
+    },
+    "tileflow": {
+        "table": "tileflow_data",
+        "flags": False,
+        "variables": {"discharge_mm": "discharge"},
+    },
+}
+RULES = [
+    {"rule": "gapfill", "dataset": "decagon", "params": {"minutes": 5}},
+    {
+        "rule": "gapfill",
+        "dataset": "decagon",
+        "sites": ["BEAR"],
+        "params": {"minutes": 60},
+    },
+    {
+        "rule": "gapfill",
+        "dataset": "decagon",
+        "sites": ["CLAY_U", "CLAY_R", "FAIRM", "KELLOGG", "NAEW"],
+        "params": {"minutes": 30},
+    },
+    {
+        "rule": "gapfill",
+        "dataset": "decagon",
+        "sites": ["WATERMAN"],
+        "params": {"minutes": 2},
+    },
+    {"rule": "sentinel", "dataset": "decagon", "params": {"value": -999}},
+    {
+        "rule": "ticker",
+        "dataset": "decagon",
+        "variables": ["temp"],
+        "params": {"threshold": 10, "hours": 2},
+    },
+    {
+        "rule": "bounds",
+        "dataset": "decagon",
+        "variables": ["moisture"],
+        "params": {"lower": 0, "upper": 1},
+    },
+    {
+        "rule": "bounds",
+        "dataset": "decagon",
+        "variables": ["temp"],
+        "params": {"lower": -50, "upper": 50},
+    },
+    {
+        "rule": "bounds",
+        "dataset": "decagon",
+        "variables": ["ec"],
+        "params": {"lower": -0.01, "upper": 28},
+    },
+    {"rule": "sentinel", "dataset": "watertable", "params": {"value": -999}},
+    {"rule": "sentinel", "dataset": "tileflow", "params": {"value": -999}},
+    {
+        "rule": "bounds",
+        "dataset": "tileflow",
+        "params": {"lower": 0, "inclusive": True},
+    },
+]
+# The rule types, filled in by the rule decorator
+RULE_TYPES = {}
+
+
+def rule(name, flag="M", nullraw=False, lookback=None):
+    """Register a rule type.
+
+    The decorated function is given the observation array, the qc value
+    array (with the nulls from earlier rules), the valid timestamps and the
+    declared parameters, and returns a boolean array of the values to null.
+
+    Args:
+      name (str): name used in the RULES declarations.
+      flag (str): the _qcflag code of the values it nulls.
+      nullraw (bool): null the observations too.
+      lookback (callable): takes the parameters and returns the Timedelta
+        of data before a value needed to check it.
+    """
+
+    def decorator(func):
+        RULE_TYPES[name] = {
+            "func": func,
+            "flag": flag,
+            "nullraw": nullraw,
+            "lookback": lookback,
+        }
+        return func
+
+    return decorator
+
+
+@rule("sentinel", nullraw=True)
+def sentinel(raw, vals, valid, value):
+    """Observations of the missing value code."""
+    return raw == value
+
+
+@rule("ticker", flag="T", lookback=lambda p: pd.Timedelta(hours=p["hours"]))
+def ticker(raw, vals, valid, threshold, hours):
+    """Values changing by more than threshold since the previous value."""
+    hit = np.zeros(len(vals), dtype=bool)
+    # compare each value with the previous non-null one
+    idx = np.flatnonzero(~np.isnan(vals))
+    jump = np.abs(np.diff(vals[idx])) > threshold
+    close = np.diff(valid[idx]) < pd.Timedelta(hours=hours).to_timedelta64()
+    hit[idx[1:][jump & close]] = True
+    return hit
+
+
+@rule("bounds")
+def bounds(raw, vals, valid, lower=None, upper=None, inclusive=False):
+    """Values outside the bounds, which are exclusive unless inclusive."""
+    hit = np.zeros(len(vals), dtype=bool)
+    with np.errstate(invalid="ignore"):
+        if lower is not None:
+            hit |= (vals < lower) if inclusive else (vals <= lower)
+        if upper is not None:
+            hit |= (vals > upper) if inclusive else (vals >= upper)
+    return hit
+
+
+def rules_for(dataset, uniqueid):
+    """Get the rule declarations that apply to this dataset and site."""
+    res = []
+    for decl in RULES:
+        if decl["dataset"] != dataset:
+            continue
+        sites = decl.get("sites")
+        if sites is not None and uniqueid not in sites:
+            continue
+        key = (decl["rule"], tuple(decl.get("variables", [])))
+        for i, other in enumerate(res):
+            if (other["rule"], tuple(other.get("variables", []))) == key:
+                # later (site specific) declarations win
+                res[i] = decl
+                break
+        else:
+            res.append(decl)
+    return res
+
+
+def lookback(dataset, uniqueid):
+    """Get the Timedelta of data needed before the values being checked."""
+    res = pd.Timedelta(0)
+    for decl in rules_for(dataset, uniqueid):
+        func = RULE_TYPES.get(decl["rule"], {}).get("lookback")
+        if func is not None:
+            res = max(res, func(decl["params"]))
+    return res
+
+
+def columns(dataset, obs):
+    """Get the observation, qc value and qc flag (or None) column names."""
+    flag = f"{obs}_qcflag" if DATASETS[dataset]["flags"] else None
+    return obs, f"{obs}_qc", flag
+
+
+def all_columns(dataset):
+    """Get every column the QC reads and writes."""
+    return [
+        c
+        for obs in DATASETS[dataset]["variables"]
+        for c in columns(dataset, obs)
+        if c is not None
+    ]
+
+
+def load_series(cursor, dataset, uniqueid, plotid, sts=None, ets=None):
+    """Get the time series as a DataFrame, ordered by valid."""
+    cols = all_columns(dataset)
+    cursor.execute(
+        f"""
+        SELECT valid, {", ".join(cols)} from {DATASETS[dataset]["table"]}
+        WHERE uniqueid = %s and plotid = %s
+        and valid >= coalesce(%s, '-infinity'::timestamptz)
+        and valid <= coalesce(%s, 'infinity'::timestamptz)
+        ORDER by valid ASC
+        """,
+        (uniqueid, plotid, sts, ets),
+    )
+    df = pd.DataFrame(cursor.fetchall(), columns=["valid"] + cols)
+    df["valid"] = pd.to_datetime(df["valid"], utc=True)
+    for obs in DATASETS[dataset]["variables"]:
+        _, qc, flag = columns(dataset, obs)
+        df[obs] = pd.to_numeric(df[obs]).astype(float)
+        df[qc] = pd.to_numeric(df[qc]).astype(float)
+        if flag is not None:
+            df[flag] = df[flag].astype(object)
+    return df
+
+
+def missing_timestamps(
+    cursor, dataset, uniqueid, plotid, minutes, sts=None, ets=None
+):
+    """Get the timestamps missing from the series.
+
+    The series runs every so many minutes from the plot's first timestamp
+    to its last, only the part from sts to ets is considered.  That part
+    starts at the plot's last timestamp before sts, so the gap between the
+    rows already there and those loaded from sts on is filled too.
+    """
+    table = DATASETS[dataset]["table"]
+    cursor.execute(
+        f"""
+        SELECT min(valid), max(valid) from {table}
+        WHERE uniqueid = %s and plotid = %s
+        """,
+        (uniqueid, plotid),
+    )
+    first, last = cursor.fetchone()
+    if first is None:
+        return pd.DatetimeIndex([], tz="UTC")
+    freq = pd.Timedelta(minutes=minutes)
+    first = pd.Timestamp(first).tz_convert("UTC")
+    last = pd.Timestamp(last).tz_convert("UTC")
+    if sts is not None and pd.Timestamp(sts) > first:
+        cursor.execute(
+            f"""
+            SELECT max(valid) from {table}
+            WHERE uniqueid = %s and plotid = %s and valid < %s
+            """,
+            (uniqueid, plotid, sts),
+        )
+        before = pd.Timestamp(cursor.fetchone()[0]).tz_convert("UTC")
+        # Stay on the grid of the whole series
+        steps = (before - first) // freq
+        first = first + steps * freq
+    if ets is not None and pd.Timestamp(ets) < last:
+        last = pd.Timestamp(ets).tz_convert("UTC")
+    grid = pd.date_range(first, last, freq=freq)
+    cursor.execute(
+        f"""
+        SELECT valid from {table} WHERE uniqueid = %s and plotid = %s
+        and valid >= %s and valid <= %s
+        """,
+        (uniqueid, plotid, first, last),
+    )
+    have = pd.to_datetime([row[0] for row in cursor], utc=True)
+    return grid.difference(have)
+
+
+def fill_gaps(cursor, dataset, uniqueid, plotid, missing):
+    """Insert the null rows of the missing timestamps."""
+    if missing.empty:
+        return 0
+    buf = io.StringIO()
+    rows = pd.DataFrame(
+        {"uniqueid": uniqueid, "plotid": plotid, "valid": missing}
+    )
+    rows.to_csv(buf, sep="\t", header=False, index=False)
+    buf.seek(0)
+    cursor.copy_expert(
+        f"COPY {DATASETS[dataset]['table']}(uniqueid, plotid, valid) "
+        "FROM STDIN",
+        buf,
+    )
+    return cursor.rowcount
+
+
+def apply_rules(df, dataset, decls, check=None):
+    """Evaluate the rules, updating df in place.
+
+    Args:
+      df (DataFrame): as returned by `load_series`.
+      dataset (str): the DATASETS entry.
+      decls (list): the RULES declarations to apply, in order.
+      check (array): optional boolean mask of the rows being checked, the
+        others only provide the values that come before.
+
+    Returns:
+      list of dicts with the rule, variable, hits, checked and seconds
+    """
+    stats = []
+    if check is None:
+        check = np.ones(len(df.index), dtype=bool)
+    valid = df["valid"].dt.tz_convert("UTC").dt.tz_localize(None).to_numpy()
+    arrays = {}
+    for obs in DATASETS[dataset]["variables"]:
+        _, qc, flag = columns(dataset, obs)
+        arrays[obs] = (
+            df[obs].to_numpy(copy=True),
+            df[qc].to_numpy(copy=True),
+            None if flag is None else df[flag].to_numpy(copy=True),
+        )
+    for decl in decls:
+        if decl["rule"] not in RULE_TYPES:
+            continue
+        ruletype = RULE_TYPES[decl["rule"]]
+        for obs, varname in DATASETS[dataset]["variables"].items():
+            if varname not in decl.get("variables", [varname]):
+                continue
+            raw, vals, flags = arrays[obs]
+            sts = time.time()
+            hit = ruletype["func"](raw, vals, valid, **decl["params"])
+            vals[hit] = np.nan
+            if ruletype["nullraw"]:
+                raw[hit] = np.nan
+            if flags is not None:
+                flags[hit] = ruletype["flag"]
+            stats.append(
+                {
+                    "rule": decl["rule"],
+                    "variable": obs,
+                    "hits": int((hit & check).sum()),
+                    "checked": int(check.sum()),
+                    "seconds": time.time() - sts,
+                }
+            )
+    for obs, (raw, vals, flags) in arrays.items():
+        _, qc, flag = columns(dataset, obs)
+        df[obs] = raw
+        df[qc] = vals
+        if flag is not None:
+            df[flag] = pd.Series(flags, index=df.index, dtype=object)
+    return stats
+
+
+def changed_rows(before, after, cols):
+    """Get the boolean mask of rows with any changed column."""
+    res = np.zeros(len(before.index), dtype=bool)
+    for col in cols:
+        old = before[col]
+        new = after[col]
+        res |= ~((old == new) | (old.isna() & new.isna())).to_numpy()
+    return res
+
+
+def write_back(cursor, dataset, uniqueid, plotid, df):
+    """Update the database rows of df with one UPDATE, returns rows."""
+    if df.empty:
+        return 0
+    table = DATASETS[dataset]["table"]
+    cols = all_columns(dataset)
+    cursor.execute(
+        f"""
+        CREATE TEMP TABLE qc_update AS
+        SELECT valid, {", ".join(cols)} from {table} LIMIT 0
+        """
+    )
+    buf = io.StringIO()
+    df[["valid"] + cols].to_csv(
+        buf, sep="\t", header=False, index=False, na_rep="\\N"
+    )
+    buf.seek(0)
+    cursor.copy_expert(
+        f"COPY qc_update(valid, {', '.join(cols)}) FROM STDIN", buf
+    )
+    cursor.execute(
+        f"""
+        UPDATE {table} d SET
+        {", ".join(f"{c} = q.{c}" for c in cols)}
+        FROM qc_update q WHERE d.uniqueid = %s and d.plotid = %s
+        and d.valid = q.valid
+        """,
+        (uniqueid, plotid),
+    )
+    rows = cursor.rowcount
+    cursor.execute("DROP TABLE qc_update")
+    return rows
+
+
+def ensure_stats(cursor):
+    """Create the table of rule statistics, should it not exist."""
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS qc_rule_stats(
+            runid timestamptz, dataset text, uniqueid text, plotid text,
+            sts timestamptz, ets timestamptz, rule text, variable text,
+            hits int, checked int, seconds real)
+    """
+    )
+
+
+def save_stats(cursor, runid, dataset, uniqueid, plotid, sts, ets, stats):
+    """Persist the statistics of a run of the rules."""
+    execute_values(
+        cursor,
+        """
+        INSERT into qc_rule_stats(runid, dataset, uniqueid, plotid, sts,
+        ets, rule, variable, hits, checked, seconds) VALUES %s
+        """,
+        [
+            (
+                runid,
+                dataset,
+                uniqueid,
+                plotid,
+                sts,
+                ets,
+                s["rule"],
+                s["variable"],
+                s["hits"],
+                s["checked"],
+                s["seconds"],
+            )
+            for s in stats
+        ],
+    )
+
+
+def run_plot(
+    cursor, dataset, uniqueid, plotid, sts=None, ets=None, runid=None
+):
+    """Run the rules over one site and plot within the cursor's transaction.
+
+    Args:
+      cursor: database cursor.
+      dataset (str): the DATASETS entry.
+      uniqueid (str): the site.
+      plotid (str): the plot.
+      sts (datetime): optional, only check data from this time on.
+      ets (datetime): optional, only check data until this time.
+      runid (datetime): optional, identifies this run in qc_rule_stats,
+        defaults to now.
+
+    Returns:
+      list of dicts with the rule, variable, hits, checked and seconds
+    """
+    timing = time.time()
+    runid = runid or datetime.datetime.now(datetime.timezone.utc)
+    decls = rules_for(dataset, uniqueid)
+    stats = []
+    for decl in decls:
+        if decl["rule"] != "gapfill":
+            continue
+        began = time.time()
+        missing = missing_timestamps(
+            cursor,
+            dataset,
+            uniqueid,
+            plotid,
+            decl["params"]["minutes"],
+            sts,
+            ets,
+        )
+        hits = fill_gaps(cursor, dataset, uniqueid, plotid, missing)
+        stats.append(
+            {
+                "rule": "gapfill",
+                "variable": "valid",
+                "hits": hits,
+                "checked": None,
+                "seconds": time.time() - began,
+            }
+        )
+    began = time.time()
+    back = lookback(dataset, uniqueid)
+    df = load_series(
+        cursor,
+        dataset,
+        uniqueid,
+        plotid,
+        None if sts is None else pd.Timestamp(sts) - back,
+        ets,
+    )
+    check = np.ones(len(df.index), dtype=bool)
+    if sts is not None:
+        # The lookback rows were checked the last time around
+        check = (df["valid"] >= pd.Timestamp(sts)).to_numpy()
+    before = df.copy()
+    stats.append(
+        {
+            "rule": "load",
+            "variable": None,
+            "hits": None,
+            "checked": int(check.sum()),
+            "seconds": time.time() - began,
+        }
+    )
+    stats.extend(apply_rules(df, dataset, decls, check))
+    began = time.time()
+    cols = all_columns(dataset)
+    mask = changed_rows(before, df, cols) & check
+    rows = write_back(cursor, dataset, uniqueid, plotid, df[mask])
+    stats.append(
+        {
+            "rule": "write",
+            "variable": None,
+            "hits": rows,
+            "checked": None,
+            "seconds": time.time() - began,
+        }
+    )
+    save_stats(cursor, runid, dataset, uniqueid, plotid, sts, ets, stats)
+    for s in stats:
+        if s["variable"] and s["hits"]:
+            print(
+                "Site: %s Plotid: %s Var: %-13s %s hits: %s"
+                % (uniqueid, plotid, s["variable"], s["rule"], s["hits"])
+            )
+    print(
+        "Site: %s Plotid: %s checked %s rows, updated %s in %.2fs"
+        % (uniqueid, plotid, len(df.index), rows, time.time() - timing)
+    )
+    return stats
+
+
+def test_apply_rules():
+    """The rules null and flag what the per variable UPDATEs did."""
+    df = pd.DataFrame(
+        {
+            "valid": pd.date_range(
+                "2015-05-01", periods=5, freq="5min", tz="UTC"
+            )
+        }
+    )
+    for obs in DATASETS["decagon"]["variables"]:
+        _, qc, flag = columns("decagon", obs)
+        df[obs] = [0.3, 0.3, 0.3, 0.3, 0.3]
+        df[qc] = df[obs]
+        df[flag] = None
+    df["d1temp"] = [10.0, -999, 25.0, 26.0, 60.0]
+    df["d1temp_qc"] = [10.0, np.nan, 25.0, 26.0, 60.0]
+    df["d1moisture_qc"] = [0.3, 1.2, 0.3, 0.3, 0.0]
+    check = np.array([False, True, True, True, True])
+    decls = rules_for("decagon", "SERF_IA")
+    stats = {
+        (s["rule"], s["variable"]): s["hits"]
+        for s in apply_rules(df, "decagon", decls, check)
+    }
+    assert df["d1temp"].isna().tolist() == [False, True, False, False, False]
+    assert df["d1temp_qcflag"].tolist() == [None, "M", "T", None, "T"]
+    assert df["d1moisture_qcflag"].tolist() == [None, "M", None, None, "M"]
+    assert stats[("ticker", "d1temp")] == 2
+    assert stats[("bounds", "d1moisture")] == 2
+    assert lookback("decagon", "SERF_IA") == pd.Timedelta(hours=2)
+    assert rules_for("decagon", "BEAR")[0]["params"]["minutes"] == 60
+    tileflow = rules_for("tileflow", "SERF")
+    assert [d["rule"] for d in tileflow] == ["sentinel", "bounds"]
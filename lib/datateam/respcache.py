@@ -0,0 +1,389 @@
+"""Cache of plot and download filter responses.
+
+A response is stored under a hash of the endpoint, its normalized query
+string (and form body) and the data version of the tables it reads, see
+`dlcache.table_versions`, so an ingest or harvest writing to one of those
+tables makes the next request build a fresh response.  Responses reading a
+table without a data version are not cached.  The hash is also the
+ETag of the response, letting a browser revalidating its copy get a 304
+without the response being rebuilt or even fetched from the cache.
+
+Bodies are kept in memcached, or in a small per process stand-in when
+memcached can not be reached.  The hits, misses and 304s of each endpoint
+are counted in the same place, see `counters`.
+"""
+import functools
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import parse_qsl
+
+from pyiem.util import logger
+
+from datateam import dbpool, dlcache
+
+try:
+    from pymemcache import Client
+    from pymemcache.exceptions import MemcacheError
+except ImportError:
+    Client = None
+    MemcacheError = OSError
+
+LOG = logger()
+MEMCACHE = "iem-memcached"
+# Entries expire anyway, the data versions keep them from going stale
+EXPIRE = 86400
+# memcached refuses items over a megabyte
+MAXBYTES = 1000 * 1000
+# The per process stand-in keeps this many bytes of bodies
+LOCALBYTES = 64 * 1000 * 1000
+# Request parameters that do not change the response
+IGNORED = ["_"]
+# The database and tables each endpoint reads from
+ENDPOINTS = {
+    "td/plot_agronomic": (
+        "td",
+        ["td_data_dictionary", "agronomic_data", "plotids"],
+    ),
+    "td/plot_decagon": ("td", ["rollups"]),
+    "td/plot_nitrateload": ("td", ["rollups"]),
+    "td/plot_tileflow": (
+        "td",
+        ["rollups", "weather_data", "meta_plot_identifier"],
+    ),
+    "td/plot_watertable": ("td", ["rollups", "wellids"]),
+    "td/dl/filter": (
+        "td",
+        [
+            "meta_treatment_identifier",
+            "agronomic_data",
+            "soil_properties_data",
+            "water_table_data",
+            "water_stage_data",
+            "soil_moisture_data",
+            "tile_flow_and_n_loads_data",
+            "water_quality_data",
+        ],
+    ),
+    "cscap/plot_decagon": ("sustainablecorn", ["decagon_data", "rollups"]),
+    "cscap/plot_tileflow": ("sustainablecorn", ["tileflow_data"]),
+    "cscap/plot_waterquality": ("sustainablecorn", ["waterquality_data"]),
+    "cscap/plot_watertable": ("sustainablecorn", ["watertable_data"]),
+    "cscap/dl/filter": ("sustainablecorn", ["plotids", "data_availability"]),
+}
+COUNTERS = ["hit", "miss", "notmodified"]
+
+
+class LocalCache:
+    """Stand-in for memcached, least recently used entries go first.
+
+    The request threads of a process share it, so each operation holds a
+    lock as memcached would make it atomic.
+    """
+
+    def __init__(self, maxbytes=LOCALBYTES):
+        self.maxbytes = maxbytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        """Get the entry, or None."""
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def set(self, key, value, expire=0):
+        """Store the entry."""
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.maxbytes:
+                self.size -= len(self.entries.popitem(last=False)[1])
+            return True
+
+    def incr(self, key, value):
+        """Increment a counter, or None when it does not exist."""
+        with self.lock:
+            if key not in self.entries:
+                return None
+            res = int(self.entries[key]) + value
+            self.set(key, str(res).encode("ascii"))
+            return res
+
+    def add(self, key, value, expire=0, noreply=True):
+        """Store the entry, unless there is one."""
+        with self.lock:
+            if key in self.entries:
+                return False
+            return self.set(key, str(value).encode("ascii"))
+
+    def close(self):
+        """Nothing to close."""
+
+
+LOCAL = LocalCache()
+
+
+def _cache_op(func, *args):
+    """Run func on memcached, falling back to the local stand-in."""
+    if Client is not None:
+        mc = Client(MEMCACHE, connect_timeout=1, timeout=1)
+        try:
+            return func(mc, *args)
+        except (MemcacheError, OSError) as exp:
+            LOG.info("memcached failed, using local cache: %s", exp)
+        finally:
+            mc.close()
+    return func(LOCAL, *args)
+
+
+def _incr(mc, key):
+    """Count one, creating the counter when need be."""
+    if mc.incr(key, 1) is None and not mc.add(key, 1, noreply=False):
+        mc.incr(key, 1)
+
+
+def _counter_key(endpoint, what):
+    """The cache key of a counter."""
+    return f"datateam_respcache_{endpoint}_{what}"
+
+
+def count(endpoint, what):
+    """Count a hit, miss or notmodified of an endpoint."""
+    _cache_op(_incr, _counter_key(endpoint, what))
+
+
+def counters(endpoints=None):
+    """Get the counts of the endpoints.
+
+    Returns:
+      dict of endpoint to dict of hit, miss and notmodified counts
+    """
+    res = {}
+    for endpoint in endpoints or ENDPOINTS:
+        res[endpoint] = {}
+        for what in COUNTERS:
+            val = _cache_op(
+                lambda mc, key: mc.get(key), _counter_key(endpoint, what)
+            )
+            res[endpoint][what] = int(val) if val else 0
+    return res
+
+
+def normalize(query, body=b"", content_type=""):
+    """Get the request's parameters in a stable order.
+
+    Args:
+      query (str): the query string.
+      body (bytes): the request body.
+      content_type (str): the body's content type, bodies that are not form
+        encoded are taken verbatim.
+
+    Returns:
+      bytes
+    """
+    params = parse_qsl(query, keep_blank_values=True)
+    raw = b""
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        params.extend(
+            parse_qsl(body.decode("utf-8", "replace"), keep_blank_values=True)
+        )
+    else:
+        raw = body
+    params = sorted(p for p in params if p[0] not in IGNORED)
+    return repr(params).encode("utf-8") + b"\0" + raw
+
+
+def request_key(endpoint, request):
+    """Compute the cache key of this normalized request.
+
+    Args:
+      endpoint (str): key of ENDPOINTS.
+      request (bytes): as returned by `normalize`.
+
+    Returns:
+      str hex digest, None when the response must not be cached
+    """
+    dbname, tables = ENDPOINTS[endpoint]
+    pgconn = dbpool.get_dbconn(dbname)
+    cursor = pgconn.cursor()
+    versions = dlcache.table_versions(cursor, tables)
+    pgconn.close()
+    if versions is None:
+        return None
+    digest = hashlib.sha256(endpoint.encode("utf-8") + b"\0" + request)
+    for table in sorted(versions):
+        digest.update(f"\0{table}={versions[table]}".encode("utf-8"))
+    return f"datateam_resp_{digest.hexdigest()[:40]}"
+
+
+def _etag(key):
+    """The ETag header value of a key."""
+    return '"%s"' % (key.rsplit("_", 1)[1],)
+
+
+def _matches(etag, if_none_match):
+    """Does the If-None-Match header list this etag."""
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def _not_modified_since(created, if_modified_since):
+    """Was the entry created before the If-Modified-Since time.
+
+    Last-Modified is sent in whole seconds, so compare those.
+    """
+    try:
+        since = parsedate_to_datetime(if_modified_since).timestamp()
+        return int(created) <= since
+    except (TypeError, ValueError):
+        return False
+
+
+def get(key):
+    """Get the cached response.
+
+    Returns:
+      (created, content_type, body) or None
+    """
+    entry = _cache_op(lambda mc, k: mc.get(k), key)
+    if entry is None:
+        return None
+    created, content_type, body = entry.split(b"\n", 2)
+    return float(created), content_type.decode("utf-8"), body
+
+
+def store(key, content_type, body):
+    """Cache a response, returns the time it was created."""
+    created = time.time()
+    if len(body) > MAXBYTES:
+        return created
+    entry = b"%.3f\n%s\n%s" % (created, content_type.encode("utf-8"), body)
+    _cache_op(lambda mc, k, v: mc.set(k, v, expire=EXPIRE), key, entry)
+    return created
+
+
+def _validators(key, created):
+    """The headers letting the browser revalidate the response."""
+    return [
+        ("ETag", _etag(key)),
+        ("Last-Modified", formatdate(created, usegmt=True)),
+        ("Cache-Control", "no-cache"),
+    ]
+
+
+def lookup(endpoint, key, if_none_match=None, if_modified_since=None):
+    """Decide how to answer a request.
+
+    Returns:
+      ("notmodified", None), ("hit", (created, content_type, body)) or
+      ("miss", None)
+    """
+    if if_none_match is not None and _matches(_etag(key), if_none_match):
+        count(endpoint, "notmodified")
+        return "notmodified", None
+    entry = get(key)
+    if entry is None:
+        count(endpoint, "miss")
+        return "miss", None
+    if if_none_match is None and if_modified_since is not None:
+        if _not_modified_since(entry[0], if_modified_since):
+            count(endpoint, "notmodified")
+            return "notmodified", None
+    count(endpoint, "hit")
+    return "hit", entry
+
+
+def wsgi(endpoint):
+    """Decorate a WSGI application to cache its 200 OK responses."""
+
+    def decorator(app):
+        """Wrap the application."""
+
+        @functools.wraps(app)
+        def application(environ, start_response):
+            """Serve from the cache, or run the application."""
+            body = b""
+            if environ.get("CONTENT_LENGTH"):
+                body = environ["wsgi.input"].read(
+                    int(environ["CONTENT_LENGTH"])
+                )
+                environ["wsgi.input"] = io.BytesIO(body)
+            request = normalize(
+                environ.get("QUERY_STRING", ""),
+                body,
+                environ.get("CONTENT_TYPE", ""),
+            )
+            key = request_key(endpoint, request)
+            if key is None:
+                return app(environ, start_response)
+            status, entry = lookup(
+                endpoint,
+                key,
+                environ.get("HTTP_IF_NONE_MATCH"),
+                environ.get("HTTP_IF_MODIFIED_SINCE"),
+            )
+            if status == "notmodified":
+                start_response("304 Not Modified", [("ETag", _etag(key))])
+                return [b""]
+            if status == "hit":
+                created, content_type, data = entry
+                start_response(
+                    "200 OK",
+                    [("Content-type", content_type)]
+                    + _validators(key, created),
+                )
+                return [data]
+            response = {}
+
+            def capture(status, headers, exc_info=None):
+                """Hold on to the status and headers."""
+                response["status"] = status
+                response["headers"] = list(headers)
+                return lambda data: None
+
+            data = b"".join(app(environ, capture))
+            headers = response["headers"]
+            if response["status"].startswith("200"):
+                content_type = dict((k.lower(), v) for k, v in headers).get(
+                    "content-type", "text/plain"
+                )
+                created = store(key, content_type, data)
+                headers += _validators(key, created)
+            start_response(response["status"], headers)
+            return [data]
+
+        return application
+
+    return decorator
+
+
+def test_localcache_threads():
+    """Counters kept by the stand-in add up with threads racing."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = LocalCache(maxbytes=100)
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda _: _incr(cache, "n"), range(4000)))
+        assert cache.get("n") == b"4000"
+        # then racing sets evicting each other, and the counter
+        list(executor.map(lambda i: cache.set(str(i), b"x" * 7), range(400)))
+    assert cache.size == sum(len(v) for v in cache.entries.values()) <= 100
+
+
+def test_not_modified_since():
+    """The Last-Modified we sent counts as not modified."""
+    created = 1700000000.75
+    assert _not_modified_since(created, formatdate(created, usegmt=True))
+    assert not _not_modified_since(
+        created, formatdate(created - 1, usegmt=True)
+    )
+    assert not _not_modified_since(created, "garbage")
@@ -0,0 +1,308 @@
+"""Precomputed aggregates of the time series behind the plot endpoints.
+
+The plots sum or average a site's observations by hour, day, week, month or
+year.  Rather than scanning the raw tables on every page view, the totals
+and counts of each variable per period, site, plot, depth and treatment are
+kept in the ``rollups`` table of the same database, keyed on the period
+start so that a plot request is an index range lookup.
+
+Periods only partly covered by the plot's window are summed from the finest
+period of the dataset, so `fetch` gives the same numbers a GROUP BY over
+the raw rows of the window would.  `refresh` rebuilds the periods touching
+a range of newly loaded or quality controlled data.
+
+The table is created and filled once per database by
+``scripts/refresh_rollups.py <database> init``, before the plots can read
+from it.
+"""
+import pandas as pd
+
+# The source table of each dataset, the SQL giving the site, plot, depth and
+# treatment of a row (empty when the dataset has none), the variables kept
+# and the periods, finest first, with the time zone their start is in.
+DATASETS = {
+    "soil_moisture": {
+        "table": "soil_moisture_data",
+        "time": "date",
+        "naive": True,
+        "keys": {
+            "siteid": "siteid",
+            "plotid": "coalesce(plotid, location, '')",
+            "depth": "coalesce(depth::text, '')",
+        },
+        "variables": ["soil_moisture", "soil_temperature"],
+        "periods": {"day": None, "week": None, "month": None, "year": None},
+    },
+    "water_table": {
+        "table": "water_table_data",
+        "time": "date",
+        "naive": True,
+        "keys": {
+            "siteid": "siteid",
+            "plotid": "coalesce(plotid, location, '')",
+        },
+        "variables": ["water_table_depth"],
+        "periods": {"day": None, "week": None, "month": None, "year": None},
+    },
+    "tile_flow": {
+        "table": "tile_flow_and_n_loads_data",
+        "time": "date",
+        "naive": True,
+        "keys": {
+            "siteid": "siteid",
+            "plotid": "coalesce(plotid, location, '')",
+            "treatment": "coalesce(dwm_treatment, '')",
+        },
+        "variables": ["tile_flow_filled", "nitrate_n_load"],
+        "periods": {"day": None, "week": None, "month": None, "year": None},
+    },
+    "decagon": {
+        "table": "decagon_data",
+        "time": "valid",
+        "naive": False,
+        "keys": {"siteid": "uniqueid", "plotid": "plotid"},
+        "variables": [
+            f"d{d}{v}_qc" for v in ["temp", "moisture"] for d in range(1, 6)
+        ],
+        # None is the site's local time zone
+        "periods": {"hour": "UTC", "day": None, "week": "UTC"},
+        "timezones": {
+            "ISUAG": "America/Chicago",
+            "SERF": "America/Chicago",
+            "GILMORE": "America/Chicago",
+        },
+        "timezone": "America/New_York",
+    },
+}
+# The tables feeding the datasets, for the scripts reloading whole tables
+TABLES = {spec["table"]: name for name, spec in DATASETS.items()}
+KEYS = ["siteid", "plotid", "depth", "treatment"]
+
+
+def ensure_table(cursor):
+    """Create the rollups table, should it not exist.
+
+    Args:
+      cursor: database cursor, the caller commits.
+    """
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS rollups(
+            dataset text, period text, siteid text, plotid text,
+            depth text, treatment text, variable text,
+            sts timestamptz, ets timestamptz, v timestamp,
+            total double precision, count int,
+            PRIMARY KEY(dataset, period, siteid, sts, plotid, depth,
+            treatment, variable))
+    """
+    )
+    cursor.execute("GRANT SELECT on rollups to nobody,apache")
+
+
+def timezone(dataset, siteid):
+    """The time zone the plot windows of this site are given in."""
+    spec = DATASETS[dataset]
+    if "timezones" not in spec:
+        return "UTC"
+    return spec["timezones"].get(siteid, spec["timezone"])
+
+
+def period_timezone(dataset, period, siteid):
+    """The time zone the periods of this kind start at midnight in."""
+    return DATASETS[dataset]["periods"][period] or timezone(dataset, siteid)
+
+
+def _wall(ts, fromtz, totz):
+    """Convert to a naive wall clock time in totz, naive ts are in fromtz."""
+    ts = pd.Timestamp(ts)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize(fromtz)
+    return ts.tz_convert(totz).tz_localize(None).to_pydatetime()
+
+
+def _sites(cursor, dataset):
+    """Get the sites found in the dataset's table."""
+    spec = DATASETS[dataset]
+    cursor.execute(
+        f"SELECT distinct {spec['keys']['siteid']} from {spec['table']}"
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _refresh_period(cursor, dataset, period, siteid, sts, ets, plotid):
+    """Rebuild the site's rollups of one period, returns rows inserted."""
+    spec = DATASETS[dataset]
+    tz = period_timezone(dataset, period, siteid)
+    keys = spec["keys"]
+    wall = (
+        f"{spec['time']}::timestamp"
+        if spec["naive"]
+        else f"({spec['time']} at time zone '{tz}')"
+    )
+    params = {
+        "dataset": dataset,
+        "period": period,
+        "siteid": siteid,
+        "plotid": plotid,
+        "lo": None,
+        "hi": None,
+    }
+    # The periods containing the range's ends are rebuilt whole
+    if sts is not None:
+        cursor.execute(
+            f"SELECT date_trunc('{period}', %s::timestamp)",
+            (_wall(sts, timezone(dataset, siteid), tz),),
+        )
+        params["lo"] = cursor.fetchone()[0]
+    if ets is not None:
+        cursor.execute(
+            f"SELECT date_trunc('{period}', %s::timestamp) + "
+            f"interval '1 {period}'",
+            (_wall(ets, timezone(dataset, siteid), tz),),
+        )
+        params["hi"] = cursor.fetchone()[0]
+    timelimit = ""
+    for param, op in [("lo", ">="), ("hi", "<")]:
+        if params[param] is None:
+            continue
+        timelimit += (
+            f" and {spec['time']} {op} %({param})s"
+            if spec["naive"]
+            else f" and {spec['time']} {op} %({param})s::timestamp at time "
+            f"zone '{tz}'"
+        )
+    cursor.execute(
+        f"""
+        DELETE from rollups WHERE dataset = %(dataset)s and
+        period = %(period)s and siteid = %(siteid)s and
+        (%(plotid)s is null or plotid = %(plotid)s) and
+        (%(lo)s is null or sts >= %(lo)s::timestamp at time zone '{tz}')
+        and (%(hi)s is null or sts < %(hi)s::timestamp at time zone '{tz}')
+    """,
+        params,
+    )
+    aggs = ", ".join(
+        f"sum({var}) as total{i}, count({var}) as count{i}"
+        for i, var in enumerate(spec["variables"])
+    )
+    unpivot = ", ".join(
+        f"('{var}', a.total{i}, a.count{i})"
+        for i, var in enumerate(spec["variables"])
+    )
+    cursor.execute(
+        f"""
+        INSERT into rollups(dataset, period, siteid, plotid, depth,
+        treatment, variable, sts, ets, v, total, count)
+        SELECT %(dataset)s, %(period)s, a.siteid, a.plotid, a.depth,
+        a.treatment, u.variable, a.v at time zone '{tz}',
+        (a.v + interval '1 {period}') at time zone '{tz}', a.v,
+        u.total, u.count from (
+            SELECT {keys['siteid']} as siteid,
+            {keys.get('plotid', "''")} as plotid,
+            {keys.get('depth', "''")} as depth,
+            {keys.get('treatment', "''")} as treatment,
+            date_trunc('{period}', {wall}) as v, {aggs}
+            from {spec['table']} WHERE {keys['siteid']} = %(siteid)s
+            and (%(plotid)s is null or
+                 {keys.get('plotid', "''")} = %(plotid)s){timelimit}
+            GROUP by 1, 2, 3, 4, 5
+        ) a, LATERAL (VALUES {unpivot}) u(variable, total, count)
+    """,
+        params,
+    )
+    return cursor.rowcount
+
+
+def refresh(cursor, dataset, siteid=None, sts=None, ets=None, plotid=None):
+    """Rebuild the rollups of every period touching a range of data.
+
+    Args:
+      cursor: database cursor, the caller commits.
+      dataset (str): key of DATASETS.
+      siteid (str): limit to this site, None for every site.
+      sts, ets (datetime): the range of data that changed, naive times are
+        in the site's `timezone`, None for an open ended range.
+      plotid (str): limit to this plot.
+
+    Returns:
+      int number of rollup rows written
+    """
+    sites = [siteid] if siteid is not None else _sites(cursor, dataset)
+    rows = 0
+    for site in sites:
+        for period in DATASETS[dataset]["periods"]:
+            rows += _refresh_period(
+                cursor, dataset, period, site, sts, ets, plotid
+            )
+    return rows
+
+
+def fetch(pgconn, dataset, period, siteid, sts, ets, how="avg", plotid=None):
+    """Aggregate the site's variables by period over a window.
+
+    Args:
+      pgconn: database connection, as pandas.read_sql takes.
+      dataset (str): key of DATASETS.
+      period (str): one of the dataset's periods.
+      siteid (str): the site.
+      sts, ets (datetime): the window, start inclusive and end exclusive,
+        naive times are in the site's `timezone`.
+      how (str): avg or sum.
+      plotid (str): limit to this plot.
+
+    Returns:
+      DataFrame with columns v (naive period start), siteid, plotid, depth,
+      treatment and one column per variable, sorted by v.
+    """
+    spec = DATASETS[dataset]
+    tz = timezone(dataset, siteid)
+    params = {
+        "dataset": dataset,
+        "period": period,
+        "base": list(spec["periods"])[0],
+        "siteid": siteid,
+        "plotid": plotid,
+        "sts": _wall(sts, tz, "UTC"),
+        "ets": _wall(ets, tz, "UTC"),
+    }
+    df = pd.read_sql(
+        """
+        WITH win as (
+            SELECT %(sts)s::timestamp at time zone 'UTC' as sts,
+            %(ets)s::timestamp at time zone 'UTC' as ets),
+        coarse as (
+            SELECT r.* from rollups r, win WHERE r.dataset = %(dataset)s
+            and r.period = %(period)s and r.siteid = %(siteid)s
+            and r.sts < win.ets and r.ets > win.sts
+            and (%(plotid)s is null or r.plotid = %(plotid)s)),
+        part as (
+            SELECT c.v, c.siteid, c.plotid, c.depth, c.treatment,
+            c.variable, b.total, b.count from coarse c, win, rollups b
+            WHERE (c.sts < win.sts or c.ets > win.ets)
+            and b.dataset = c.dataset and b.period = %(base)s
+            and b.siteid = c.siteid and b.sts >= c.sts and b.ets <= c.ets
+            and b.sts >= win.sts and b.ets <= win.ets
+            and b.plotid = c.plotid and b.depth = c.depth
+            and b.treatment = c.treatment and b.variable = c.variable)
+        SELECT v, siteid, plotid, depth, treatment, variable,
+        sum(total) as total, sum(count) as count from (
+            SELECT c.v, c.siteid, c.plotid, c.depth, c.treatment,
+            c.variable, c.total, c.count from coarse c, win
+            WHERE c.sts >= win.sts and c.ets <= win.ets
+            UNION ALL SELECT * from part) foo
+        GROUP by v, siteid, plotid, depth, treatment, variable
+        ORDER by v ASC
+    """,
+        pgconn,
+        params=params,
+    )
+    df["value"] = df["total"]
+    if how == "avg":
+        df["value"] = df["total"] / df["count"].where(df["count"] > 0)
+    df = (
+        df.set_index(["v", *KEYS, "variable"])["value"]
+        .unstack("variable")
+        .reindex(columns=spec["variables"])
+    )
+    df.columns.name = None
+    return df.reset_index()
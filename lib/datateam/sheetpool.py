@@ -0,0 +1,44 @@
+"""Build a download spreadsheet with its sheet queries run concurrently.
+
+The database queries behind each sheet are independent, so they are run on
+a small thread pool while the workbook itself is only ever written to from
+the calling thread, in the order the sheets were requested.  Each query
+opens its own database connection, since connections are not shared between
+threads.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pyiem.util import logger
+
+LOG = logger()
+# Concurrent sheet queries per workbook, kept small to go easy on postgres
+WORKERS = 4
+
+
+def _timed(getter):
+    """Run the getter and return its result along with the elapsed time."""
+    sts = time.time()
+    result = getter()
+    return result, time.time() - sts
+
+
+def build_sheets(writer, sheets, workers=WORKERS):
+    """Fetch the sheets concurrently and write them out in order.
+
+    Args:
+      writer (pd.ExcelWriter or zipfile.ZipFile): what is being built.
+      sheets (list): of (name, getter, sheetwriter) tuples, the getter takes
+        no arguments and returns a DataFrame, the sheetwriter is then called
+        with the writer and that DataFrame.
+      workers (int): maximum number of concurrent queries.
+    """
+    if not sheets:
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_timed, s[1]) for s in sheets]
+        for (name, _getter, sheetwriter), future in zip(sheets, futures):
+            # Raises here should the query have failed
+            df, elapsed = future.result()
+            LOG.info("sheet %s query took %.2fs", name, elapsed)
+            sheetwriter(writer, df)
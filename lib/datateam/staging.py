@@ -0,0 +1,217 @@
+"""Reload a table in full without readers seeing it empty or half loaded.
+
+The full refresh loaders used to empty the live table and insert into it
+row by row, so the plots and downloads saw a partial table for as long as
+the load took.  Instead `reload` builds the new contents in a
+``<table>_staging`` table, COPYs the rows in, builds the indexes and then
+`swap` renames it into place in a transaction of its own that only holds
+the table's lock for the renames.  Readers keep reading the old table until
+that commit and the new one after it.
+
+A staging table either has the columns given by the loader or is made
+``LIKE`` the live table, in which case the live table's indexes, primary key
+and unique constraints are rebuilt on it once the rows are in, and any
+sequence owned by the live table is handed over at the swap.  Should a view
+depend on the live table, dropping the old table fails and the whole swap
+is rolled back, leaving the live table as it was.
+
+The new table is granted to the web users like any other.  The swap gives
+it the live table's data version trigger, see `dlcache.ensure_versioning`,
+and bumps the version.
+"""
+import io
+import re
+import time
+
+import psycopg2
+from pyiem.util import logger
+
+from datateam import dlcache
+
+LOG = logger()
+# How long the swap waits on readers for the table's lock, and how often
+LOCK_TIMEOUT = "5s"
+SWAP_ATTEMPTS = 6
+# Not the live table's indexes, which we build ourselves once loaded
+LIKE = "INCLUDING ALL EXCLUDING INDEXES"
+INDEXDEF_RE = re.compile(r"^(CREATE (?:UNIQUE )?INDEX) \S+ ON (?:ONLY )?\S+ ")
+
+
+def staging_name(table):
+    """The name of a table's staging table."""
+    return f"{table}_staging"
+
+
+def quote(name):
+    """Quote an identifier."""
+    return '"%s"' % (name.replace('"', '""'),)
+
+
+def _exists(cursor, table):
+    """Is there such a table."""
+    cursor.execute("SELECT to_regclass(%s) is not null", (table,))
+    return cursor.fetchone()[0]
+
+
+def create(cursor, table, columns=None):
+    """Create the empty staging table of a table.
+
+    Args:
+      cursor: database cursor.
+      table (str): the live table.
+      columns (list): (name, type) pairs of the new table, None to make it
+        like the live table.
+
+    Returns:
+      str name of the staging table
+    """
+    stage = staging_name(table)
+    cursor.execute(f"DROP TABLE IF EXISTS {stage}")
+    if columns is None:
+        cursor.execute(f"CREATE TABLE {stage} (LIKE {table} {LIKE})")
+    else:
+        cols = ", ".join(f"{quote(name)} {typ}" for name, typ in columns)
+        cursor.execute(f"CREATE TABLE {stage} ({cols})")
+    cursor.execute(f"GRANT SELECT on {stage} to nobody,apache")
+    return stage
+
+
+def copy_frame(cursor, table, df):
+    """COPY the rows of a DataFrame into a table, returns rows loaded."""
+    if len(df.columns) == 0:
+        return 0
+    buf = io.StringIO()
+    df.to_csv(buf, header=False, index=False, na_rep="\\N")
+    buf.seek(0)
+    cols = ", ".join(quote(col) for col in df.columns)
+    cursor.copy_expert(
+        f"COPY {table}({cols}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+        buf,
+    )
+    return cursor.rowcount
+
+
+def copy_indexes(cursor, table):
+    """Build the live table's indexes and key constraints on its staging."""
+    stage = staging_name(table)
+    cursor.execute(
+        """
+        SELECT pg_get_indexdef(i.indexrelid), pg_get_constraintdef(c.oid)
+        from pg_index i LEFT JOIN pg_constraint c
+        ON (c.conindid = i.indexrelid and c.conrelid = i.indrelid)
+        WHERE i.indrelid = %s::regclass
+        """,
+        (table,),
+    )
+    for indexdef, constraintdef in cursor.fetchall():
+        if constraintdef is not None:
+            cursor.execute(f"ALTER TABLE {stage} ADD {constraintdef}")
+            continue
+        cursor.execute(INDEXDEF_RE.sub(rf"\1 ON {stage} ", indexdef))
+
+
+def _owned_sequences(cursor, table):
+    """The (sequence, column) pairs of the sequences the table owns."""
+    cursor.execute(
+        """
+        SELECT s.relname, a.attname from pg_depend d
+        JOIN pg_class s ON (d.objid = s.oid and s.relkind = 'S')
+        JOIN pg_attribute a
+        ON (a.attrelid = d.refobjid and a.attnum = d.refobjsubid)
+        WHERE d.refobjid = %s::regclass and d.deptype = 'a'
+        """,
+        (table,),
+    )
+    return cursor.fetchall()
+
+
+def _swap(cursor, table):
+    """The renames, within the caller's transaction."""
+    stage = staging_name(table)
+    old = f"{table}_old"
+    cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+    cursor.execute(f"DROP TABLE IF EXISTS {old}")
+    exists = _exists(cursor, table)
+    versioned = _exists(cursor, f"{dlcache.VERSION_PREFIX}{table}")
+    if exists:
+        owned = _owned_sequences(cursor, table)
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    cursor.execute(f"ALTER TABLE {stage} RENAME TO {table}")
+    if exists:
+        for seqname, colname in owned:
+            cursor.execute(
+                f"ALTER SEQUENCE {seqname} OWNED BY {table}.{colname}"
+            )
+        cursor.execute(f"DROP TABLE {old}")
+    # the indexes were named after the staging table
+    cursor.execute(
+        "SELECT indexname from pg_indexes WHERE tablename = %s", (table,)
+    )
+    for (indexname,) in cursor.fetchall():
+        if indexname.startswith(stage):
+            newname = table + indexname[len(stage) :]
+            cursor.execute(f"ALTER INDEX {indexname} RENAME TO {newname}")
+    if versioned:
+        dlcache.ensure_versioning(cursor, table)
+
+
+def swap(pgconn, table, attempts=SWAP_ATTEMPTS):
+    """Put the staging table in place of the live table, and commit.
+
+    Waiting on a long running reader for the lock would queue every later
+    reader behind the swap, so a swap not getting the lock in LOCK_TIMEOUT
+    is rolled back and tried again a little later.
+
+    Args:
+      pgconn: database connection, whose staging table is committed.
+      table (str): the live table.
+      attempts (int): how many times to try.
+    """
+    for attempt in range(1, attempts + 1):
+        cursor = pgconn.cursor()
+        try:
+            _swap(cursor, table)
+            cursor.close()
+            pgconn.commit()
+            return
+        except psycopg2.OperationalError as exp:
+            pgconn.rollback()
+            # 55P03 is lock_not_available
+            if exp.pgcode != "55P03" or attempt == attempts:
+                raise
+            LOG.info("swap of %s waiting on readers, try %s", table, attempt)
+            time.sleep(attempt)
+
+
+def reload(pgconn, table, df, columns=None, indexes=None):
+    """Replace the contents of a table with the rows of a DataFrame.
+
+    Anything in the connection's open transaction is committed along with
+    the staging table, before the swap.
+
+    Args:
+      pgconn: database connection.
+      table (str): the live table, created should it not exist.
+      df (DataFrame): the rows, its columns named as the table's.
+      columns (list): (name, type) pairs of a new schema for the table, None
+        keeps the live table's schema and indexes.
+      indexes (list): column lists to index, such as ``"siteid, plotid"``.
+
+    Returns:
+      int rows loaded
+    """
+    sts = time.time()
+    cursor = pgconn.cursor()
+    stage = create(cursor, table, columns)
+    rows = copy_frame(cursor, stage, df)
+    if columns is None:
+        copy_indexes(cursor, table)
+    for cols in indexes or []:
+        cursor.execute(f"CREATE INDEX on {stage}({cols})")
+    cursor.close()
+    pgconn.commit()
+    swap(pgconn, table)
+    LOG.info(
+        "reloaded %s with %s rows in %.2fs", table, rows, time.time() - sts
+    )
+    return rows
@@ -1,5 +1,8 @@
 cd /opt/datateam/scripts/cscap
 
+# Tables added since yesterday get a data version, see ensure_data_versions
+python ../ensure_data_versions.py sustainablecorn td
+
 #python harvest_management.py
 #python harvest_agronomic.py 2011
 #python harvest_agronomic.py 2012
@@ -27,6 +30,9 @@ cd /opt/datateam/scripts/cscap
 
 #python harvest_soil_fertility.py
 
+# The download filter's index of which variables have data
+python build_availability.py
+
 python email_daily_changes.py td
 python email_daily_changes.py inrc
 python email_daily_changes.py nutrinet
@@ -40,3 +46,9 @@ python email_daily_changes.py cig
 
 cd ../auth
 python drive2webaccess.py
+
+# QC the decagon data loaded since yesterday
+cd ../cscap/decagon
+python qc_decagon.py queue
+cd ../../td/decagon
+python qc_decagon.py queue
@@ -0,0 +1,107 @@
+"""Benchmark building table responses, see datateam.export.
+
+A year of 15 minute values for some plots, with the description and units
+rows, is written the way the endpoints used to (the rows concatenated onto
+the frame, which is then written with pandas to /tmp and read back) and
+with export.to_xlsx and export.iter_csv.  Peak memory is what tracemalloc
+sees Python allocate while building, the frame itself not included.
+
+Usage: python bench_export.py [days] [plots]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.append("/opt/datateam/lib")
+from datateam import export  # noqa
+
+TMPFN = "/tmp/bench_export.xlsx"
+
+
+def bling(cols):
+    """Some description and units rows."""
+    rows = [{cols[0]: "description"}, {cols[0]: "units"}]
+    for col in cols[2:]:
+        rows[0][col] = f"The {col} of the plot"
+        rows[1][col] = "mm"
+    return rows
+
+
+def concat_bling(df):
+    """The old way of adding the header rows."""
+    cols = df.columns
+    df = pd.concat([pd.DataFrame(bling(cols)), df], ignore_index=True)
+    return df.reindex(cols, axis=1)
+
+
+def legacy_xlsx(df):
+    """Concatenate the rows, write the workbook to a file, read it back."""
+    # the plots made the times text, pandas refusing time zones
+    df = concat_bling(
+        df.assign(timestamp=df["timestamp"].dt.strftime("%Y-%m-%d %H:%M"))
+    )
+    with pd.ExcelWriter(TMPFN, engine="xlsxwriter") as writer:
+        df.to_excel(writer, sheet_name="Data", index=False)
+        writer.sheets["Data"].freeze_panes(3, 0)
+    with open(TMPFN, "rb") as fh:
+        res = fh.read()
+    os.unlink(TMPFN)
+    return res
+
+
+def legacy_csv(df):
+    """Concatenate the rows and write the csv."""
+    return concat_bling(df).to_csv(index=False).encode("utf-8")
+
+
+def measure(func, *args):
+    """Run func, returning its result size, seconds and peak MB.
+
+    Tracing slows everything down, so the time is of a second, untraced run.
+    """
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    sts = time.perf_counter()
+    res = func(*args)
+    return len(res), time.perf_counter() - sts, peak / 1e6
+
+
+def main(argv):
+    """Go Main Go."""
+    days = int(argv[1]) if len(argv) > 1 else 365
+    plots = int(argv[2]) if len(argv) > 2 else 4
+    valid = pd.date_range(
+        "2016-01-01", periods=days * 96, freq="15min", tz="America/Chicago"
+    )
+    rng = np.random.default_rng(0)
+    data = {"timestamp": valid, "plotid": "SERF1"}
+    for i in range(plots):
+        vals = np.round(rng.random(len(valid)) * 2, 3)
+        vals[rng.random(len(valid)) < 0.05] = np.nan
+        data[f"flow{i + 1}"] = vals
+    df = pd.DataFrame(data)
+    print(f"{len(df.index)} rows x {len(df.columns)} columns")
+    print(f"{'builder':28s} {'bytes':>10s} {'seconds':>8s} {'peak MB':>8s}")
+    for label, func, args in [
+        ("pandas via /tmp xlsx", legacy_xlsx, (df,)),
+        ("to_xlsx in memory", export.to_xlsx, (df, "Data", bling, 3, False)),
+        (
+            "to_xlsx constant memory",
+            export.to_xlsx,
+            (df, "Data", bling, 3, True),
+        ),
+        ("pandas csv", legacy_csv, (df,)),
+        ("iter_csv", lambda d: b"".join(export.iter_csv(d, bling)), (df,)),
+    ]:
+        size, secs, peak = measure(func, *args)
+        print(f"{label:28s} {size:10d} {secs:8.2f} {peak:8.1f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,97 @@
+"""Benchmark serializing Highcharts series, see datateam.highcharts.
+
+A multi-year series of 15 minute tile flow values per plot, with some
+missing, is serialized the way the plot endpoints used to (a str() of a
+list of pairs, then replacing None and nan) and with series_data, then
+downsampled to the default chart width as the raw plots are.
+
+Usage: python bench_highcharts.py [years] [plots] [width]
+"""
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append("/opt/datateam/lib")
+from datateam import highcharts  # noqa
+
+
+def legacy(x, y):
+    """The old list of pairs serialization, of lists of Python values."""
+    return (
+        str([[a, b] for a, b in zip(x, y)])
+        .replace("None", "null")
+        .replace("nan", "null")
+    )
+
+
+def json_equal(old, new):
+    """Both serializations give the same values."""
+    return np.allclose(
+        np.array(json.loads(old), dtype=float),
+        np.array(json.loads(new), dtype=float),
+        equal_nan=True,
+    )
+
+
+def downsampled(x, y, width):
+    """Serialize the points kept for a chart of this width."""
+    keep = highcharts.downsample(y, width)
+    return highcharts.series_data(x[keep], y[keep])
+
+
+def timeit(func, *args):
+    """Run func, returning its result and the seconds it took."""
+    sts = time.time()
+    res = func(*args)
+    return res, time.time() - sts
+
+
+def main(argv):
+    """Go Main Go."""
+    years = int(argv[1]) if len(argv) > 1 else 5
+    plots = int(argv[2]) if len(argv) > 2 else 4
+    width = int(argv[3]) if len(argv) > 3 else highcharts.WIDTH
+    valid = pd.date_range(
+        "2012-01-01", periods=years * 365 * 96, freq="15min", tz="UTC"
+    )
+    rng = np.random.default_rng(0)
+    oldtime = 0
+    newtime = 0
+    size = 0
+    smalltime = 0
+    smallsize = 0
+    sts = time.time()
+    ticks = highcharts.ticks(valid)
+    tickstime = time.time() - sts
+    for _ in range(plots):
+        flow = np.round(rng.random(len(valid)) * 2, 3)
+        flow[rng.random(len(valid)) < 0.05] = np.nan
+        # the endpoints built the pairs from Python values, not numpy scalars
+        old, secs = timeit(legacy, ticks.tolist(), flow.tolist())
+        oldtime += secs
+        new, secs = timeit(highcharts.series_data, ticks, flow)
+        newtime += secs
+        assert json_equal(old, new)
+        size += len(new)
+        small, secs = timeit(downsampled, ticks, flow, width)
+        smalltime += secs
+        smallsize += len(small)
+    print(
+        f"{plots} plots of {len(valid)} points ({years} years), "
+        f"{size / 1e6:.1f} MB of JSON, ticks: {tickstime:.3f}s"
+    )
+    print(
+        f"list of pairs: {oldtime:.3f}s series_data: {newtime:.3f}s "
+        f"speedup: {oldtime / newtime:.1f}x"
+    )
+    print(
+        f"downsampled to {width} pixels: {smalltime:.3f}s "
+        f"{smallsize / 1e6:.2f} MB, {size / smallsize:.0f}x smaller"
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,131 @@
+"""Compare serving the web endpoints as CGI scripts and as WSGI apps.
+
+A CGI request pays for a new interpreter, importing pandas, pyiem and the
+rest, and the request itself.  This runs each endpoint's application once
+in a fresh interpreter, as a CGI request would, and then repeatedly in this
+already warm process, as the WSGI daemon does.  The response cache is
+bypassed, so both times are of building the response.
+
+The downloads are left out.  cscap/dl/dl.py only queues a job for
+dl_worker.py, and td/dl/dl.py builds the whole workbook and sends mail
+within the request, writing website_downloads and the download cache.
+
+Usage: python bench_wsgi.py [repeats] [htdocs]
+"""
+import importlib.util
+import os
+import statistics
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+sys.path.append("/opt/datateam/lib")
+
+# endpoint and a representative query string, none of them write anything
+ENDPOINTS = [
+    (
+        "cscap/plot_decagon.py",
+        "site=ISUAG::302E&date=2014-06-10&days=7&ptype=1&view=js",
+    ),
+    (
+        "cscap/plot_tileflow.py",
+        "site=SERF&date=2014-01-01&days=30&ptype=1&view=js",
+    ),
+    (
+        "cscap/plot_watertable.py",
+        "site=SERF&date=2014-01-01&days=30&ptype=1&view=js",
+    ),
+    ("cscap/plot_waterquality.py", "site=SERF&varname=WAT2&view=js"),
+    ("cscap/dl/filter.py", "sites[]=ISUAG&sites[]=SERF&sites[]=MASON"),
+    ("cscap/dl/status.py", "jobid=0"),
+    (
+        "cscap/dl/wxdl.py",
+        "stations=ISUAG&year1=2014&month1=1&day1=1&year2=2014&month2=12"
+        "&day2=31",
+    ),
+    ("cscap/yearly_avg_wx.py", ""),
+    ("cscap/mantable.py", ""),
+    ("admin/calc.py", "equation=AGR33+/+AGR4"),
+    ("admin/siteprogress.py", ""),
+    ("admin/varprogress.py", "year=2013&varname=AGR1"),
+]
+
+
+def load(htdocs, path):
+    """Import the endpoint's module, as mod_wsgi does."""
+    fn = os.path.join(htdocs, path)
+    # the endpoints find their common.py next to them
+    sys.path.insert(0, os.path.dirname(fn))
+    name = "_bench_" + path.replace("/", "_").replace(".", "_")
+    spec = importlib.util.spec_from_file_location(name, fn)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return getattr(mod.application, "__wrapped__", mod.application)
+
+
+def call(app, query):
+    """Make a GET request of the application, returns the body size."""
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "QUERY_STRING": query,
+        "CONTENT_TYPE": "",
+        "CONTENT_LENGTH": "",
+        "REMOTE_ADDR": "127.0.0.1",
+        "wsgi.input": BytesIO(),
+    }
+    status = {}
+
+    def start_response(code, headers, exc_info=None):
+        """Hold on to the status."""
+        status["code"] = code
+
+    size = sum(len(chunk) for chunk in app(environ, start_response))
+    if not status.get("code", "").startswith("200"):
+        raise ValueError(f"got {status.get('code')}")
+    return size
+
+
+def cold(htdocs, path, query):
+    """Seconds taken by a fresh interpreter serving one request."""
+    sts = time.perf_counter()
+    subprocess.run(
+        [sys.executable, __file__, "--once", htdocs, path, query],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - sts
+
+
+def main(argv):
+    """Go Main Go."""
+    if len(argv) > 1 and argv[1] == "--once":
+        call(load(argv[2], argv[3]), argv[4])
+        return
+    repeats = int(argv[1]) if len(argv) > 1 else 5
+    htdocs = argv[2] if len(argv) > 2 else "/opt/datateam/htdocs"
+    print(f"{'endpoint':28s} {'cgi ms':>9s} {'wsgi ms':>9s} {'speedup':>8s}")
+    for path, query in ENDPOINTS:
+        try:
+            cgi = statistics.median(
+                cold(htdocs, path, query) for _ in range(repeats)
+            )
+            app = load(htdocs, path)
+            call(app, query)
+            times = []
+            for _ in range(repeats):
+                sts = time.perf_counter()
+                call(app, query)
+                times.append(time.perf_counter() - sts)
+            wsgi = statistics.median(times)
+        except Exception as exp:
+            print(f"{path:28s} failed: {exp}")
+            continue
+        print(
+            f"{path:28s} {cgi * 1000.0:9.1f} {wsgi * 1000.0:9.2f} "
+            f"{cgi / wsgi:7.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv)
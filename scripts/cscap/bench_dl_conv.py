@@ -0,0 +1,66 @@
+"""Benchmark the download website's detect limit conversion.
+
+Compares the row-wise conv() with the vectorized conv_series() on a
+synthetic soil_data value column, checking that both produce the same
+result for each of the detectlimit options.
+Usage: python bench_dl_conv.py <number of rows>
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append("/opt/datateam/htdocs/cscap/dl")
+import dl  # noqa
+
+# Share of the rows that are not plain numbers, the rest are numbers
+OTHERS = {
+    None: 0.12,
+    "": 0.02,
+    "n/a": 0.02,
+    "did not collect": 0.02,
+    "trace": 0.01,
+    "see notes": 0.01,
+}
+# Share of the rows that are below detection limit
+BELOW = 0.07
+
+
+def synthetic(rows):
+    """Generate a fake soil_data frame, a mostly numeric text column."""
+    rng = np.random.default_rng(0)
+    numbers = np.round(rng.gamma(2.0, 10.0, rows), 2).astype(str)
+    values = numbers.astype(object)
+    draw = rng.random(rows)
+    edge = 0
+    for value, share in OTHERS.items():
+        values[(draw >= edge) & (draw < edge + share)] = value
+        edge += share
+    below = (draw >= edge) & (draw < edge + BELOW)
+    values[below] = np.char.add("<", numbers[below]).astype(object)
+    # read_sql gives us an object column with None for nulls
+    return pd.DataFrame({"value": pd.Series(values, dtype=object)})
+
+
+def main(argv):
+    """Go Main Go."""
+    rows = int(argv[1]) if len(argv) > 1 else 1_000_000
+    df = synthetic(rows)
+    for detectlimit in ["1", "2", "3", "4"]:
+        sts = time.time()
+        old = df["value"].apply(lambda x: dl.conv(x, detectlimit))
+        oldtime = time.time() - sts
+        sts = time.time()
+        new = dl.conv_series(df["value"], detectlimit)
+        newtime = time.time() - sts
+        pd.testing.assert_series_equal(old, new)
+        print(
+            f"detectlimit: {detectlimit} rows: {rows} "
+            f"apply: {oldtime:.3f}s vectorized: {newtime:.3f}s "
+            f"speedup: {oldtime / newtime:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv)
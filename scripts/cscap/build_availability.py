@@ -0,0 +1,27 @@
+"""Rebuild the data availability index used by the download filter.
+
+The harvest and ingest scripts rebuild the categories they write to, this
+rebuilds everything, see datateam.availability.
+
+Usage: python build_availability.py [category ...]
+"""
+import sys
+
+from pyiem.util import get_dbconn
+
+sys.path.append("/opt/datateam/lib")
+from datateam import availability  # noqa
+
+
+def main(argv):
+    """Go Main Go."""
+    pgconn = get_dbconn("sustainablecorn")
+    cursor = pgconn.cursor()
+    rows = availability.rebuild(cursor, argv[1:] or None)
+    cursor.close()
+    pgconn.commit()
+    print(f"Wrote {rows} data availability rows")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
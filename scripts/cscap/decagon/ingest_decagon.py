@@ -1,5 +1,4 @@
 """Process the decagon data"""
-from __future__ import print_function
 import sys
 import os
 import glob
@@ -8,6 +7,9 @@ import datetime
 import pandas as pd
 import psycopg2
 
+sys.path.append("/opt/datateam/lib")
+from datateam import decagon, decagonqc  # noqa
+
 CENTRAL_TIME = ["ISUAG", "ISUAG.USB", "GILMORE", "SERF", "HICKS.B", "HICKS.G"]
 
 
@@ -213,12 +215,10 @@ def process7(uniqueid, fn):
 
 
 def database_save(uniqueid, plot, df):
+    """Replace the database rows for the timespan of this DataFrame."""
     pgconn = psycopg2.connect(database="sustainablecorn", host="iemdb")
     cursor = pgconn.cursor()
-    for i, row in df.iterrows():
-        if not isinstance(row["valid"], datetime.datetime):
-            print("Row df.index=%s, valid=%s, culling" % (i, row["valid"]))
-            df.drop(i, inplace=True)
+    df = decagon.cull_invalid(df)
     minvalid = df["valid"].min()
     maxvalid = df["valid"].max()
     print("Time Domain: %s - %s" % (minvalid, maxvalid))
@@ -242,73 +242,17 @@ def database_save(uniqueid, plot, df):
             print("Aborting, due to valid bounds outside of domain")
             sys.exit()
 
-    def v(row, name):
-        val = row.get(name)
-        if val is None:
-            return "null"
-        if isinstance(val, (str, unicode)):
-            if val.strip().lower() in ["nan", "-999"]:
-                return "null"
-            return val
-        # elif isinstance(val, pd.core.series.Series):
-        #    print val
-        #    print row
-        #    sys.exit()
-        try:
-            if pd.isnull(val):
-                return "null"
-        except Exception, exp:
-            print(exp)
-            print(
-                ("Plot: %s Val: %s[%s] Name: %s Valid: %s")
-                % (plot, val, type(val), name, row["valid"])
-            )
-            sys.exit()
-            return "null"
-        return val
-
-    for _, row in df.iterrows():
-        cursor.execute(
-            """
-        INSERT into decagon_data(uniqueid, plotid, valid, d1moisture, d1temp,
-        d1ec, d2moisture, d2temp, d3moisture, d3temp, d4moisture, d4temp,
-        d5moisture, d5temp, d1moisture_qc, d1temp_qc,
-        d1ec_qc, d2moisture_qc, d2temp_qc, d3moisture_qc, d3temp_qc,
-        d4moisture_qc, d4temp_qc,
-        d5moisture_qc, d5temp_qc) VALUES ('%s', '%s', '%s', %s, %s,
-        %s, %s, %s, %s, %s, %s, %s,
-        %s, %s, %s, %s,
-        %s, %s, %s, %s, %s, %s, %s,
-        %s, %s)
-        """
-            % (
-                uniqueid,
-                plot,
-                row["valid"].strftime("%Y-%m-%d %H:%M-" + tzoff),
-                v(row, "d1moisture"),
-                v(row, "d1temp"),
-                v(row, "d1ec"),
-                v(row, "d2moisture"),
-                v(row, "d2temp"),
-                v(row, "d3moisture"),
-                v(row, "d3temp"),
-                v(row, "d4moisture"),
-                v(row, "d4temp"),
-                v(row, "d5moisture"),
-                v(row, "d5temp"),
-                v(row, "d1moisture"),
-                v(row, "d1temp"),
-                v(row, "d1ec"),
-                v(row, "d2moisture"),
-                v(row, "d2temp"),
-                v(row, "d3moisture"),
-                v(row, "d3temp"),
-                v(row, "d4moisture"),
-                v(row, "d4temp"),
-                v(row, "d5moisture"),
-                v(row, "d5temp"),
-            )
-        )
+    decagon.copy_frame(
+        cursor, df, uniqueid, plot, decagon.CSCAP_COLUMNS, tzoff
+    )
+    decagonqc.ensure_queue(cursor)
+    decagonqc.enqueue(
+        cursor,
+        uniqueid,
+        plot,
+        minvalid.strftime("%Y-%m-%d %H:%M-" + tzoff),
+        maxvalid.strftime("%Y-%m-%d %H:%M-" + tzoff),
+    )
 
     cursor.close()
     pgconn.commit()
@@ -0,0 +1,98 @@
+"""Build the spreadsheets queued by the CSCAP download website.
+
+Runs forever, keeping up to the given number of workbook builds going at
+once.  Should a worker process die, say killed for running out of memory,
+the jobs it took down with it are failed and a new pool is started.  cron
+starts us every minute under flock, which is a no-op while we are running
+and restarts us should we ever exit.
+
+Usage: python dl_worker.py <number of worker processes>
+"""
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from pyiem.util import logger
+
+sys.path.append("/opt/datateam/lib")
+sys.path.append("/opt/datateam/htdocs/cscap/dl")
+from datateam import datadict, jobqueue  # noqa
+import dl  # noqa
+
+LOG = logger()
+QUEUE = "cscap_dl"
+# seconds to sleep when there is nothing to do
+IDLE = 5
+
+
+def start_pool(workers):
+    """Start the worker processes."""
+    # Each worker process keeps its own copy of the data dictionary
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=datadict.warm,
+        initargs=("sustainablecorn",),
+    )
+
+
+def finish(future, job):
+    """Record how the job went, returns its error."""
+    error = future.exception()
+    job = jobqueue.finish(QUEUE, job, error)
+    LOG.info(
+        "Job %s %s in %.1fs", job["jobid"], job["state"], job["run_seconds"]
+    )
+    return error
+
+
+def main(argv):
+    """Go Main Go."""
+    workers = int(argv[1]) if len(argv) > 1 else 2
+    # Anything left running was orphaned by a previous instance of us
+    jobqueue.requeue_stale(QUEUE)
+    LOG.info("Starting %s workers for queue %s", workers, QUEUE)
+    running = {}
+    executor = start_pool(workers)
+    while True:
+        try:
+            while len(running) < workers:
+                job = jobqueue.claim(QUEUE)
+                if job is None:
+                    break
+                LOG.info(
+                    "Starting job %s after %.1fs wait",
+                    job["jobid"],
+                    job["wait_seconds"],
+                )
+                try:
+                    future = executor.submit(dl.build_workbook, job)
+                except BrokenProcessPool:
+                    # this one never ran
+                    jobqueue.requeue(QUEUE, job)
+                    raise
+                running[future] = job
+            if not running:
+                time.sleep(IDLE)
+                continue
+            done, _ = wait(running, timeout=IDLE, return_when=FIRST_COMPLETED)
+            broken = None
+            for future in done:
+                error = finish(future, running.pop(future))
+                if isinstance(error, BrokenProcessPool):
+                    broken = error
+            if broken is not None:
+                raise broken
+        except BrokenProcessPool as exp:
+            LOG.warning("A worker process died, restarting the pool: %s", exp)
+            # the rest of the running jobs went down with the pool
+            wait(running)
+            for future, job in running.items():
+                finish(future, job)
+            running.clear()
+            executor.shutdown(wait=False, cancel_futures=True)
+            executor = start_pool(workers)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
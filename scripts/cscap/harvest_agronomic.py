@@ -1,62 +1,71 @@
 """
 Harvest the Agronomic Data into the ISU Database
+
+Spreadsheets not modified since their last harvest, as recorded in the
+harvest_watermarks table, are skipped.  The cells of the others are compared
+with what is in the database and only the differences are written.
+
+Usage: python harvest_agronomic.py <year> [full]
+  full: ignore the watermarks and check every spreadsheet
 """
-import pyiem.cscap_utils as util
+import datetime
 import sys
-import psycopg2
 
-YEAR = sys.argv[1]
+import psycopg2
+from psycopg2.extras import execute_values
+import pyiem.cscap_utils as util
 
-config = util.get_config()
+sys.path.append("/opt/datateam/lib")
+from datateam import availability  # noqa
 
-pgconn = psycopg2.connect(
-    database="sustainablecorn", host=config["database"]["host"]
-)
-pcursor = pgconn.cursor()
+JOB = "harvest_agronomic"
+SSMIME = "application/vnd.google-apps.spreadsheet"
 
-# Get me a client, stat
-spr_client = util.get_spreadsheet_client(config)
-drive_client = util.get_driveclient(config)
 
+def ensure_watermarks(cursor):
+    """Create our watermark storage, should it not exist."""
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS harvest_watermarks(
+            job text, fileid text, modified timestamptz,
+            PRIMARY KEY (job, fileid))
+    """
+    )
 
-def delete_entries(current, siteid):
-    for key in current:
-        (plotid, varname) = key.split("|")
-        print("harvest_agronomic REMOVE %s %s %s" % (siteid, plotid, varname))
-        pcursor.execute(
-            """DELETE from agronomic_data where uniqueid = %s and
-            plotid = %s and varname = %s and year = %s
-        """,
-            (siteid, plotid, varname, YEAR),
-        )
 
+def get_watermarks(cursor, job):
+    """Get the modification times of the files at their last harvest."""
+    cursor.execute(
+        "SELECT fileid, modified from harvest_watermarks WHERE job = %s",
+        (job,),
+    )
+    return dict(cursor.fetchall())
 
-res = drive_client.files().list(q="title contains 'Agronomic Data'").execute()
 
-for item in res["items"]:
-    if item["mimeType"] != "application/vnd.google-apps.spreadsheet":
-        continue
-    siteid = item["title"].split()[0]
-    # Load up current data, incase we need to do some deleting
-    current = {}
-    pcursor.execute(
-        """SELECT plotid, varname
-    from agronomic_data WHERE uniqueid = %s and year = %s""",
-        (siteid, YEAR),
+def set_watermark(cursor, job, fileid, modified):
+    """Record the modification time of the file we harvested."""
+    cursor.execute(
+        """
+        INSERT into harvest_watermarks(job, fileid, modified)
+        VALUES (%s, %s, %s) ON CONFLICT (job, fileid)
+        DO UPDATE SET modified = EXCLUDED.modified
+    """,
+        (job, fileid, modified),
     )
-    for row in pcursor:
-        key = "%s|%s" % row
-        current[key] = True
 
-    spreadsheet = util.Spreadsheet(spr_client, item["id"])
-    spreadsheet.get_worksheets()
-    worksheet = spreadsheet.worksheets.get(YEAR)
-    if worksheet is None:
-        delete_entries(current, siteid)
-        continue
-    worksheet.get_cell_feed()
-    newvals = 0
 
+def parse_modified(item):
+    """Get the modification time of a drive file listing item."""
+    return datetime.datetime.strptime(
+        item["modifiedDate"][:19], "%Y-%m-%dT%H:%M:%S"
+    ).replace(tzinfo=datetime.timezone.utc)
+
+
+def read_worksheet(worksheet, siteid, year):
+    """Get a dictionary of (plotid, varname) to value from the worksheet."""
+    worksheet.get_cell_feed()
+    desired = {}
+    plotidcol = None
     for col in range(1, worksheet.cols + 1):
         val = worksheet.get_cell_value(1, col)
         if val is None:
@@ -66,6 +75,12 @@ for item in res["items"]:
         if val.find("AGR") != 0:
             continue
         varname = val
+        if plotidcol is None:
+            print(
+                "harvest_agronomic site: %s year: %s %s before PlotID"
+                % (siteid, year, varname)
+            )
+            continue
         for row in range(4, worksheet.rows + 1):
             plotid = worksheet.get_cell_value(row, plotidcol)
             if plotid is None:
@@ -78,38 +93,325 @@ for item in res["items"]:
                         "harvest_agronomic found None. site: %s year: %s "
                         " row: %s col: %s varname: %s"
                     )
-                    % (siteid, YEAR, row, col, varname)
-                )
-            # print row, col, plotid, varname, YEAR, val
-            try:
-                pcursor.execute(
-                    """
-                    INSERT into agronomic_data
-                    (uniqueid, plotid, varname, year, value)
-                    values (%s, %s, %s, %s, %s) RETURNING value
-                    """,
-                    (siteid, plotid, varname, YEAR, val),
+                    % (siteid, year, row, col, varname)
                 )
-                if pcursor.rowcount == 1:
-                    newvals += 1
-            except Exception as exp:
-                print("HARVEST_AGRONOMIC TRACEBACK")
-                print(exp)
-                print(
-                    "%s %s %s %s %s"
-                    % (YEAR, siteid, plotid, repr(varname), repr(val))
-                )
-                sys.exit()
-            key = "%s|%s" % (plotid, varname)
-            if key in current:
-                del current[key]
-    delete_entries(current, siteid)
-    if newvals > 0:
-        print(
-            ("harvest_agronomic year: %s site: %s had %s new values" "")
-            % (YEAR, siteid, newvals)
+            # the database stores the values as text
+            desired[(plotid, varname)] = None if val is None else str(val)
+    return desired
+
+
+def read_spreadsheet(spreadsheet, siteid, year):
+    """Get the desired values, None when there is no sheet for this year."""
+    spreadsheet.get_worksheets()
+    worksheet = spreadsheet.worksheets.get(str(year))
+    if worksheet is None:
+        return None
+    return read_worksheet(worksheet, siteid, year)
+
+
+def get_current(cursor, siteid, year):
+    """Get a dictionary of (plotid, varname) to value from the database."""
+    cursor.execute(
+        """SELECT plotid, varname, value
+    from agronomic_data WHERE uniqueid = %s and year = %s""",
+        (siteid, year),
+    )
+    return {(row[0], row[1]): row[2] for row in cursor}
+
+
+def compute_diff(current, desired):
+    """Figure out the inserts, updates and deletes to get to desired."""
+    inserts = []
+    updates = []
+    for key, value in desired.items():
+        if key not in current:
+            inserts.append((*key, value))
+        elif current[key] != value:
+            updates.append((*key, value))
+    deletes = [key for key in current if key not in desired]
+    return inserts, updates, deletes
+
+
+def apply_diff(cursor, siteid, year, inserts, updates, deletes):
+    """Write the differences to the database in batches."""
+    if inserts:
+        execute_values(
+            cursor,
+            "INSERT into agronomic_data "
+            "(uniqueid, plotid, varname, year, value) VALUES %s",
+            [(siteid, p, v, year, val) for (p, v, val) in inserts],
         )
+    if updates:
+        execute_values(
+            cursor,
+            """
+            UPDATE agronomic_data d SET value = u.value
+            FROM (VALUES %s) AS u(uniqueid, year, plotid, varname, value)
+            WHERE d.uniqueid = u.uniqueid and d.year = u.year and
+            d.plotid = u.plotid and d.varname = u.varname
+            """,
+            [(siteid, year, p, v, val) for (p, v, val) in updates],
+        )
+    if deletes:
+        for plotid, varname in deletes:
+            print(
+                "harvest_agronomic REMOVE %s %s %s" % (siteid, plotid, varname)
+            )
+        execute_values(
+            cursor,
+            """
+            DELETE from agronomic_data d
+            USING (VALUES %s) AS r(uniqueid, year, plotid, varname)
+            WHERE d.uniqueid = r.uniqueid and d.year = r.year and
+            d.plotid = r.plotid and d.varname = r.varname
+            """,
+            [(siteid, year, p, v) for (p, v) in deletes],
+        )
+
+
+def harvest(pgconn, spr_client, drive_client, year, full=False, ss=None):
+    """Harvest the given year from the Agronomic Data spreadsheets.
+
+    Args:
+      pgconn: database connection, committed once at the end.
+      spr_client: the spreadsheet client.
+      drive_client: the google drive client.
+      year (int): the year (worksheet) to harvest.
+      full (bool): harvest spreadsheets even if unchanged.
+      ss (class): stands in for pyiem.cscap_utils.Spreadsheet when testing.
+    """
+    ss = ss or util.Spreadsheet
+    job = f"{JOB}_{year}"
+    cursor = pgconn.cursor()
+    ensure_watermarks(cursor)
+    watermarks = {} if full else get_watermarks(cursor, job)
+    res = (
+        drive_client.files()
+        .list(q="title contains 'Agronomic Data'")
+        .execute()
+    )
+    for item in res["items"]:
+        if item["mimeType"] != SSMIME:
+            continue
+        modified = parse_modified(item)
+        if item["id"] in watermarks and watermarks[item["id"]] >= modified:
+            continue
+        siteid = item["title"].split()[0]
+        desired = read_spreadsheet(ss(spr_client, item["id"]), siteid, year)
+        current = get_current(cursor, siteid, year)
+        inserts, updates, deletes = compute_diff(current, desired or {})
+        apply_diff(cursor, siteid, year, inserts, updates, deletes)
+        set_watermark(cursor, job, item["id"], modified)
+        if inserts or updates:
+            print(
+                (
+                    "harvest_agronomic year: %s site: %s had %s new values "
+                    "%s updated values"
+                )
+                % (year, siteid, len(inserts), len(updates))
+            )
+    availability.rebuild(cursor, ["agronomic"])
+    cursor.close()
+    pgconn.commit()
+
+
+def main(argv):
+    """Go Main Go"""
+    year = int(argv[1])
+    full = len(argv) > 2 and argv[2] == "full"
+    config = util.get_config()
+    pgconn = psycopg2.connect(
+        database="sustainablecorn", host=config["database"]["host"]
+    )
+    # Get me a client, stat
+    spr_client = util.get_spreadsheet_client(config)
+    drive_client = util.get_driveclient(config)
+    harvest(pgconn, spr_client, drive_client, year, full)
+    pgconn.close()
+
+
+def test_read_spreadsheet():
+    """Read values out of a fake spreadsheet."""
+
+    class FakeWorksheet:
+        """Stands in for pyiem.cscap_utils.Worksheet."""
+
+        def __init__(self, cells):
+            self.cells = cells
+            self.rows = max(r for r, _ in cells)
+            self.cols = max(c for _, c in cells)
+
+        def get_cell_feed(self):
+            """Nothing to fetch."""
+
+        def get_cell_value(self, row, col):
+            """Get the value."""
+            return self.cells.get((row, col))
+
+    class FakeSpreadsheet:
+        """Stands in for pyiem.cscap_utils.Spreadsheet."""
+
+        def __init__(self, _client, _spreadsheetid):
+            self.worksheets = {}
+
+        def get_worksheets(self):
+            """Load up our worksheets."""
+            self.worksheets["2015"] = FakeWorksheet(
+                {
+                    (1, 1): "PlotID",
+                    (1, 2): "AGR1",
+                    (4, 1): "101",
+                    (4, 2): "12.5",
+                    (5, 1): "102",
+                }
+            )
+
+    spreadsheet = FakeSpreadsheet(None, "123")
+    desired = read_spreadsheet(spreadsheet, "ISUAG", 2015)
+    assert desired == {("101", "AGR1"): "12.5", ("102", "AGR1"): None}
+    assert read_spreadsheet(spreadsheet, "ISUAG", 2014) is None
+    current = {("101", "AGR1"): "12.0", ("103", "AGR1"): "1"}
+    inserts, updates, deletes = compute_diff(current, desired)
+    assert inserts == [("102", "AGR1", None)]
+    assert updates == [("101", "AGR1", "12.5")]
+    assert deletes == [("103", "AGR1")]
+
+
+def test_harvest_watermarks(monkeypatch):
+    """Unchanged spreadsheets are skipped, watermarks move on commit."""
+
+    class FakeConn:
+        """Keeps the watermarks, those written are kept on commit."""
+
+        def __init__(self):
+            self.committed = {}
+            self.pending = {}
+
+        def cursor(self):
+            """Get a cursor."""
+            return FakeCursor(self)
+
+        def commit(self):
+            """Keep what was written."""
+            self.committed.update(self.pending)
+            self.pending = {}
+
+        def rollback(self):
+            """Forget what was written."""
+            self.pending = {}
+
+    class FakeCursor:
+        """Answers the watermark queries, no agronomic_data rows."""
+
+        def __init__(self, conn):
+            self.conn = conn
+            self.rows = []
+
+        def execute(self, sql, args=None):
+            """Run the query."""
+            self.rows = []
+            if "SELECT fileid, modified" in sql:
+                self.rows = [
+                    (fileid, modified)
+                    for (job, fileid), modified in self.conn.committed.items()
+                    if job == args[0]
+                ]
+            elif "INSERT into harvest_watermarks" in sql:
+                self.conn.pending[(args[0], args[1])] = args[2]
+
+        def fetchall(self):
+            """Get the rows."""
+            return self.rows
+
+        def __iter__(self):
+            return iter(self.rows)
+
+        def close(self):
+            """Nothing to close."""
+
+    class FakeDrive:
+        """Stands in for the google drive client."""
+
+        def __init__(self):
+            self.items = []
+
+        def files(self):
+            """The files resource."""
+            return self
+
+        def list(self, q):
+            """The listing request."""
+            return self
+
+        def execute(self):
+            """The listing."""
+            return {"items": self.items}
+
+    class FakeSpreadsheet:
+        """A spreadsheet without a worksheet for the year."""
+
+        def __init__(self, _client, _spreadsheetid):
+            self.worksheets = {}
+
+        def get_worksheets(self):
+            """Nothing to load."""
+
+    def item(fileid, modified, mime=SSMIME):
+        """A drive listing item."""
+        return {
+            "id": fileid,
+            "title": f"{fileid} Agronomic Data",
+            "mimeType": mime,
+            "modifiedDate": f"2015-06-0{modified}T12:00:00.000Z",
+        }
+
+    applied = []
+
+    def fake_apply(cursor, siteid, *_args):
+        """Record the site, failing for FAIL."""
+        if siteid == "FAIL":
+            raise ValueError("apply failed")
+        applied.append(siteid)
+
+    module = sys.modules[__name__]
+    monkeypatch.setattr(module, "apply_diff", fake_apply)
+    monkeypatch.setattr(availability, "rebuild", lambda *_args: None)
+    pgconn = FakeConn()
+    drive = FakeDrive()
+    drive.items = [item("A", 1), item("B", 1), item("C", 1, "text/csv")]
+
+    def run(full=False):
+        """Harvest, returning the sites applied."""
+        applied.clear()
+        harvest(pgconn, None, drive, 2015, full, ss=FakeSpreadsheet)
+        return sorted(applied)
+
+    def marks():
+        """The committed watermarks, as days of the month."""
+        return {k[1]: v.day for k, v in pgconn.committed.items()}
+
+    assert run() == ["A", "B"]
+    assert marks() == {"A": 1, "B": 1}
+    # nothing changed
+    assert run() == []
+    drive.items[1] = item("B", 2)
+    assert run() == ["B"]
+    assert marks() == {"A": 1, "B": 2}
+    assert run(full=True) == ["A", "B"]
+    # a failed apply leaves the watermarks as they were
+    drive.items[0] = item("A", 3)
+    drive.items.append(item("FAIL", 3))
+    try:
+        run()
+        raise AssertionError("harvest should have failed")
+    except ValueError:
+        pgconn.rollback()
+    assert marks() == {"A": 1, "B": 2}
+    # so the changed sheet is harvested next time
+    drive.items.pop()
+    assert run() == ["A"]
+    assert marks() == {"A": 3, "B": 2}
+
 
-pcursor.close()
-pgconn.commit()
-pgconn.close()
+if __name__ == "__main__":
+    main(sys.argv)
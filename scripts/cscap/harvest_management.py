@@ -1,7 +1,13 @@
 """Harvest the data in the data management store!"""
+import sys
+
+import pandas as pd
 import pyiem.cscap_utils as util
 import psycopg2
 
+sys.path.append("/opt/datateam/lib")
+from datateam import staging  # noqa
+
 
 def main():
     """Go Main"""
@@ -12,7 +18,6 @@ def main():
         user="mesonet",
         host=config["database"]["host"],
     )
-    pcursor = pgconn.cursor()
 
     # Get me a client, stat
     spr_client = util.get_spreadsheet_client(config)
@@ -24,18 +29,15 @@ def main():
     tabs = ["Field Operations", "Management", "Pesticides", "DWM", "Notes"]
     tablenames = ["operations", "management", "pesticides", "dwm", "notes"]
     for sheetkey, table in zip(tabs, tablenames):
-        pcursor.execute("""DELETE from """ + table)
-        deleted = pcursor.rowcount
         sheet = spread.worksheets[sheetkey]
 
-        added = 0
+        rows = []
         for rownum, entry in enumerate(sheet.get_list_feed().entry):
             # Skip the first row of units
             if rownum == 0:
                 continue
             d = entry.to_dict()
-            cols = []
-            vals = []
+            row = {}
             for key in d.keys():
                 if key.startswith("gio"):
                     continue
@@ -47,33 +49,20 @@ def main():
                     "outletdate",
                 ]:
                     val = val if val not in ["unknown", "N/A", "n/a"] else None
-                vals.append(val)
-                cols.append(translate.get(key, key))
+                row[translate.get(key, key)] = val
+            rows.append(row)
 
-            sql = """
-                INSERT into %s(%s) VALUES (%s)
-                """ % (
-                table,
-                ",".join(cols),
-                ",".join(["%s"] * len(cols)),
-            )
-            try:
-                pcursor.execute(sql, vals)
-            except Exception as exp:
-                print("CSCAP harvest_management traceback")
-                print(exp)
-                for a, b in zip(cols, vals):
-                    print("   |%s| -> |%s|" % (a, b))
-                return
-            added += 1
+        try:
+            added = staging.reload(pgconn, table, pd.DataFrame(rows))
+        except Exception as exp:
+            # COPY's error names the offending line and column
+            print("CSCAP harvest_management traceback")
+            print(exp)
+            pgconn.rollback()
+            return
 
-        print(
-            ("harvest_management %16s added:%4s deleted:%4s")
-            % (sheetkey, added, deleted)
-        )
+        print(("harvest_management %16s rows:%4s") % (sheetkey, added))
 
-    pcursor.close()
-    pgconn.commit()
     pgconn.close()
 
 
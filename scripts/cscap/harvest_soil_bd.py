@@ -5,6 +5,9 @@ import sys
 import psycopg2
 import pyiem.cscap_utils as util
 
+sys.path.append("/opt/datateam/lib")
+from datateam import availability  # noqa
+
 YEAR = sys.argv[1]
 
 config = util.get_config()
@@ -183,6 +186,7 @@ for key in current:
         )
 
 
+availability.rebuild(pcursor, ["soil"])
 pcursor.close()
 pgconn.commit()
 pgconn.close()
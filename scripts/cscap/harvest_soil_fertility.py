@@ -4,6 +4,9 @@ import sys
 import psycopg2
 import pyiem.cscap_utils as util
 
+sys.path.append("/opt/datateam/lib")
+from datateam import availability  # noqa
+
 config = util.get_config()
 
 pgconn = psycopg2.connect(
@@ -167,6 +170,7 @@ if newvals > 0 or deletedvals > 0:
     print(
         "harvest_soil_fert, newvals: %s, deleted: %s" % (newvals, deletedvals)
     )
+availability.rebuild(pcursor, ["soil"])
 pcursor.close()
 pgconn.commit()
 pgconn.close()
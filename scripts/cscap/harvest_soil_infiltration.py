@@ -3,6 +3,9 @@ import pyiem.cscap_utils as util
 import sys
 import psycopg2
 
+sys.path.append("/opt/datateam/lib")
+from datateam import availability  # noqa
+
 YEAR = sys.argv[1]
 
 config = util.get_config()
@@ -154,6 +157,7 @@ for key in current:
         )
 
 
+availability.rebuild(pcursor, ["soil"])
 pcursor.close()
 pgconn.commit()
 pgconn.close()
@@ -6,6 +6,9 @@ import sys
 import pyiem.cscap_utils as util
 import psycopg2
 
+sys.path.append("/opt/datateam/lib")
+from datateam import availability  # noqa
+
 YEAR = sys.argv[1]
 
 DUMMY_DATES = {
@@ -235,6 +238,7 @@ def main():
             (siteid, plotid, varname, YEAR, depth, subsample),
         )
 
+    availability.rebuild(pcursor, ["soil"])
     pcursor.close()
     pgconn.commit()
     pgconn.close()
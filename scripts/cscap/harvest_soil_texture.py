@@ -7,6 +7,9 @@ import sys
 import psycopg2
 import pyiem.cscap_utils as util
 
+sys.path.append("/opt/datateam/lib")
+from datateam import availability  # noqa
+
 YEAR = sys.argv[1]
 
 config = util.get_config()
@@ -169,6 +172,7 @@ for key in current:
         )
 
 
+availability.rebuild(pcursor, ["soil"])
 pcursor.close()
 pgconn.commit()
 pgconn.close()
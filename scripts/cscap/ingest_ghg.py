@@ -5,11 +5,13 @@
 Note, set subsample equals to 1!, so pivot works
 """
 import sys
-import StringIO
 
 import pandas as pd
 import psycopg2
 
+sys.path.append("/opt/datateam/lib")
+from datateam import availability, staging  # noqa
+
 
 def main(argv):
     """Process a given filename"""
@@ -30,19 +32,14 @@ def main(argv):
         values="value",
     )
     pdf.reset_index(inplace=True)
+    # the table's columns are the lower cased varnames
+    pdf.columns = [col.lower() for col in pdf.columns]
+    pdf["year"] = pdf["date"].dt.year
     pgconn = psycopg2.connect(database="sustainablecorn", host="iemdb")
+    rows = staging.reload(pgconn, "ghg_data", pdf)
+    print("Replaced ghg_data with %s rows" % (rows,))
     cursor = pgconn.cursor()
-    cursor.execute("""DELETE from ghg_data""")
-    print("Deleted %s rows" % (cursor.rowcount,))
-    data = StringIO.StringIO()
-    for row in pdf.itertuples(index=False):
-        data.write(
-            ("\t".join([str(s) for s in row]) + "\n").replace("nan", "\\N")
-        )
-    data.seek(0)
-    cursor.copy_from(data, "ghg_data", columns=pdf.columns.tolist())
-    print("Added %s rows" % (cursor.rowcount,))
-    cursor.execute("""UPDATE ghg_data SET year = extract(year from date)""")
+    availability.rebuild(cursor, ["ghg"])
     cursor.close()
     pgconn.commit()
 
@@ -1,10 +1,13 @@
 """Process a file provided by Gio with the IPM data"""
+import io
 import sys
-import StringIO
 
 import pandas as pd
 import psycopg2
 
+sys.path.append("/opt/datateam/lib")
+from datateam import availability  # noqa
+
 
 def main(argv):
     """Process a given filename"""
@@ -17,7 +20,7 @@ def main(argv):
     cursor = pgconn.cursor()
     # cursor.execute("""DELETE from ipm_data""")
     # print("Deleted %s rows" % (cursor.rowcount, ))
-    data = StringIO.StringIO()
+    data = io.StringIO()
     for row in df.itertuples(index=False):
         data.write(
             ("\t".join([str(s) for s in row]) + "\n").replace("nan", "\\N")
@@ -25,6 +28,7 @@ def main(argv):
     data.seek(0)
     cursor.copy_from(data, "ipm_data", columns=df.columns.tolist())
     print("Added %s rows" % (cursor.rowcount,))
+    availability.rebuild(cursor, ["ipm"])
     cursor.close()
     pgconn.commit()
 
@@ -24,15 +24,13 @@ CENTRAL_TIME = [
 ]
 
 
-def gio_process(filename):
-    """This is a manually generated file by gio"""
+def read_file(filename, fmt=None, uniqueid=None, plotid=None):
+    """Get {(uniqueid, plotid): DataFrame} of the gio file's rows.
 
-    pgconn = psycopg2.connect(database="sustainablecorn")
-    cursor = pgconn.cursor()
-    sql = """
-        INSERT into tileflow_data(uniqueid, plotid, valid,
-        discharge_mm, discharge_mm_qc) VALUES (%s, %s, %s, %s, %s)
-        """
+    The site and plot come from each line, so the other arguments are
+    only there to match the other ingest scripts.
+    """
+    rows = {}
     for i, line in enumerate(open(filename)):
         if i == 0:
             continue
@@ -47,7 +45,31 @@ def gio_process(filename):
         offset = 6 if uniqueid in CENTRAL_TIME else 5
         ts = ts + datetime.timedelta(hours=offset)
         ts = ts.replace(tzinfo=pytz.utc)
+        rows.setdefault((uniqueid, plotid), []).append((ts, flow))
+    return {
+        key: pd.DataFrame(values, columns=["valid", "discharge_mm"])
+        for key, values in rows.items()
+    }
+
+
+def save_frame(cursor, uniqueid, plotid, df):
+    """Insert the rows of this DataFrame, returns rows loaded."""
+    sql = """
+        INSERT into tileflow_data(uniqueid, plotid, valid,
+        discharge_mm, discharge_mm_qc) VALUES (%s, %s, %s, %s, %s)
+        """
+    for ts, flow in zip(df["valid"], df["discharge_mm"]):
         cursor.execute(sql, (uniqueid, plotid, ts, flow, flow))
+    return len(df.index)
+
+
+def gio_process(filename):
+    """This is a manually generated file by gio"""
+
+    pgconn = psycopg2.connect(database="sustainablecorn")
+    cursor = pgconn.cursor()
+    for (uniqueid, plotid), df in read_file(filename).items():
+        save_frame(cursor, uniqueid, plotid, df)
     cursor.close()
     pgconn.commit()
     pgconn.close()
@@ -1,5 +1,8 @@
-"""Water table ingest"""
-from __future__ import print_function
+"""Water table ingest
+
+Usage: python ingest_watertable.py <filename> <format> <uniqueid> <plotid>
+  <project>
+"""
 import sys
 import datetime
 
@@ -65,7 +68,7 @@ def process5(spreadkey):
 
 def process3(fn):
     """Format 3, STJOHNS"""
-    df = pd.read_excel(fn, sheetname=None)
+    df = pd.read_excel(fn, sheet_name=None)
     for plotid in df:
         print("%s %s" % (plotid, df[plotid].columns))
         df[plotid].dropna(inplace=True)
@@ -86,11 +89,11 @@ def process2(fn):
     """Format 2, SERF"""
     df = pd.read_excel(
         fn,
-        sheetname=None,
+        sheet_name=None,
         skiprows=[
             0,
         ],
-        parse_cols="H,I",
+        usecols="H,I",
     )
     for plotid in df:
         print("%s %s" % (plotid, df[plotid].columns))
@@ -145,9 +148,12 @@ def process4(filename):
     return res
 
 
-def database_save(df, uniqueid, plotid, project):
-    pgconn = psycopg2.connect(database=project, host="iemdb")
-    cursor = pgconn.cursor()
+def save_frame(cursor, uniqueid, plotid, df):
+    """Replace the database rows for the timespan of this DataFrame.
+
+    Returns:
+      int number of rows loaded
+    """
     for i, row in df.iterrows():
         if not isinstance(row["valid"], datetime.datetime):
             print("Row df.index=%s, valid=%s, culling" % (i, row["valid"]))
@@ -191,7 +197,7 @@ def database_save(df, uniqueid, plotid, project):
         try:
             if pd.isnull(val):
                 return "null"
-        except Exception, exp:
+        except Exception as exp:
             print(exp)
             print(
                 ("Plot: %s Val: %s[%s] Name: %s Valid: %s")
@@ -217,21 +223,23 @@ def database_save(df, uniqueid, plotid, project):
         )
 
     print("Processed %s entries" % (len(df.index),))
+    return len(df.index)
+
+
+def database_save(df, uniqueid, plotid, project):
+    """Save the DataFrame within its own transaction."""
+    pgconn = psycopg2.connect(database=project, host="iemdb")
+    cursor = pgconn.cursor()
+    save_frame(cursor, uniqueid, plotid, df)
     cursor.close()
     pgconn.commit()
     pgconn.close()
 
 
-def main(argv):
-    fn = argv[1]
-    fmt = argv[2]
-    uniqueid = argv[3]
-    plotid = argv[4]
-    project = argv[5]
+def read_file(fn, fmt, uniqueid, plotid):
+    """Get {(uniqueid, plotid): DataFrame} of the plots within this file."""
     if fmt == "1":
-        df = process1(fn)
-        database_save(df, uniqueid, plotid, project)
-        return
+        return {(uniqueid, plotid): process1(fn)}
     elif fmt == "2":
         df = process2(fn)
     elif fmt == "3":
@@ -242,8 +250,17 @@ def main(argv):
         df = process5(fn)
     elif fmt == "6":
         df = process6(fn)
-    for plotid in df:
-        database_save(df[plotid], uniqueid, plotid, project)
+    return {(uniqueid, plotid): df[plotid] for plotid in df}
+
+
+def main(argv):
+    fn = argv[1]
+    fmt = argv[2]
+    uniqueid = argv[3]
+    plotid = argv[4]
+    project = argv[5]
+    for (uniqueid, plotid), df in read_file(fn, fmt, uniqueid, plotid).items():
+        database_save(df, uniqueid, plotid, project)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+"""Give the tables of a database a data version, see dlcache.
+
+The download and response caches only cache what reads tables having a
+data version, so this is run once per database, and nightly from
+RUN_6AM.sh to pick up tables added since.  Tables already versioned are
+left alone, as are the staging tables of datateam.staging.
+
+Usage: python ensure_data_versions.py <dbname> [dbname ...]
+"""
+import sys
+
+from pyiem.util import get_dbconn, logger
+
+sys.path.append("/opt/datateam/lib")
+from datateam import dlcache  # noqa
+
+LOG = logger()
+
+
+def unversioned(cursor):
+    """The tables without the data version trigger."""
+    cursor.execute(
+        """
+        SELECT c.relname from pg_class c
+        JOIN pg_namespace n ON (c.relnamespace = n.oid)
+        WHERE n.nspname = 'public' and c.relkind in ('r', 'p')
+        and c.relname not like '%\\_staging'
+        and not exists (
+            SELECT 1 from pg_trigger t
+            WHERE t.tgrelid = c.oid and t.tgname = 'dataversion')
+        ORDER by c.relname
+        """
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def main(argv):
+    """Go Main Go."""
+    for dbname in argv[1:]:
+        pgconn = get_dbconn(dbname)
+        cursor = pgconn.cursor()
+        for table in unversioned(cursor):
+            LOG.info("versioning %s.%s", dbname, table)
+            dlcache.ensure_versioning(cursor, table)
+            pgconn.commit()
+        cursor.close()
+        pgconn.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,343 @@
+"""Load a batch of soil moisture, water table and tile flow logger files.
+
+The manifest is a csv file with the columns kind, filename, format,
+uniqueid, plotid and (optionally) project, one row per file, as would
+otherwise be given to the ingest script of that kind.  The files are parsed
+in a pool of processes and the resulting frames handed to a pool of loader
+threads sharing a few database connections.  The saves of one site and
+plot run one after another in manifest order, so where two files overlap
+the later one in the manifest wins, as when the ingest scripts are run one
+after another, while saves of different plots run side by side.
+
+Usage: python ingest_batch.py <manifest.csv> [parse processes] [loaders]
+"""
+import csv
+import importlib
+import os
+import queue
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from functools import partial
+
+from pyiem.util import get_dbconn
+
+SCRIPTS = "/opt/datateam/scripts"
+# The ingest script of each kind, its directory and default database
+KINDS = {
+    "decagon": ("td/decagon", "ingest_decagon", "td"),
+    "watertable": ("cscap/watertable", "ingest_watertable", "sustainablecorn"),
+    "tileflow": ("cscap/tileflow", "ingest_tileflow", "sustainablecorn"),
+}
+
+
+def get_module(kind):
+    """Import the ingest script of this kind."""
+    dirname, modname, _ = KINDS[kind]
+    path = os.path.join(SCRIPTS, dirname)
+    if path not in sys.path:
+        sys.path.append(path)
+    return importlib.import_module(modname)
+
+
+def read_manifest(filename):
+    """Get the list of files to load."""
+    entries = []
+    basedir = os.path.dirname(os.path.abspath(filename))
+    with open(filename, newline="") as fh:
+        for row in csv.DictReader(fh):
+            if row["kind"] not in KINDS:
+                raise ValueError(f"Unknown kind {row['kind']} in manifest")
+            row["filename"] = os.path.join(basedir, row["filename"])
+            row["project"] = row.get("project") or KINDS[row["kind"]][2]
+            entries.append(row)
+    return entries
+
+
+def prepare(entries):
+    """Let the ingest scripts get their databases ready, once each."""
+    for kind, dbname in {(e["kind"], e["project"]) for e in entries}:
+        mod = get_module(kind)
+        if not hasattr(mod, "prepare"):
+            continue
+        pgconn = get_dbconn(dbname)
+        cursor = pgconn.cursor()
+        mod.prepare(cursor)
+        cursor.close()
+        pgconn.commit()
+        pgconn.close()
+
+
+def parse_entry(entry):
+    """Parse one file, runs within the process pool.
+
+    Returns:
+      dict of (uniqueid, plotid) to DataFrame
+    """
+    mod = get_module(entry["kind"])
+    frames = mod.read_file(
+        entry["filename"], entry["format"], entry["uniqueid"], entry["plotid"]
+    )
+    res = {}
+    for key, df in frames.items():
+        if "valid" not in df.columns:
+            raise ValueError(f"{key} has no valid column")
+        if df.empty:
+            print(f"Skipping {entry['filename']}{key}, no rows")
+            continue
+        res[key] = df
+    return res
+
+
+class ConnectionPool:
+    """Database connections shared by the loader threads."""
+
+    def __init__(self):
+        self.idle = {}
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def _idle(self, dbname):
+        """The idle connections of a database, the caller holds the lock."""
+        if dbname not in self.idle:
+            self.idle[dbname] = queue.LifoQueue()
+        return self.idle[dbname]
+
+    def get(self, dbname):
+        """Get an idle connection, or a new one."""
+        with self.lock:
+            try:
+                return self._idle(dbname).get_nowait()
+            except queue.Empty:
+                self.opened += 1
+        return get_dbconn(dbname)
+
+    def put(self, dbname, pgconn):
+        """Return the connection for reuse."""
+        with self.lock:
+            self._idle(dbname).put(pgconn)
+
+    def close(self):
+        """Close all the connections."""
+        for conns in self.idle.values():
+            while not conns.empty():
+                conns.get_nowait().close()
+
+
+class Loader:
+    """Saves frames, each in its own transaction."""
+
+    def __init__(self):
+        self.pool = ConnectionPool()
+        self.lock = threading.Lock()
+        self.rows = defaultdict(int)
+        self.plots = defaultdict(set)
+
+    def load(self, entry, uniqueid, plotid, df):
+        """Save the frame in its own transaction, runs within a thread."""
+        mod = get_module(entry["kind"])
+        dbname = entry["project"]
+        key = (dbname, uniqueid, str(plotid))
+        pgconn = self.pool.get(dbname)
+        try:
+            cursor = pgconn.cursor()
+            # Keep out anyone else loading this plot
+            cursor.execute(
+                "SELECT pg_advisory_xact_lock(hashtext(%s))",
+                ("|".join(key),),
+            )
+            rows = mod.save_frame(cursor, uniqueid, plotid, df)
+            cursor.close()
+            pgconn.commit()
+        except Exception:
+            pgconn.rollback()
+            raise
+        finally:
+            self.pool.put(dbname, pgconn)
+        with self.lock:
+            self.rows[uniqueid] += rows
+            self.plots[uniqueid].add(str(plotid))
+        return rows
+
+
+class Scheduler:
+    """Hands the parsed frames to the loader threads in manifest order.
+
+    A file's frames are released once every file before it in the manifest
+    has been parsed, and each database, site and plot has a queue of its
+    released loads, the next one submitted only when the one before it is
+    done, failed or not.
+
+    Args:
+      pool (ThreadPoolExecutor): runs the loads.
+      load (callable): called with the entry, uniqueid, plotid and frame.
+      entries (list): the manifest.
+    """
+
+    def __init__(self, pool, load, entries):
+        self.pool = pool
+        self.load = load
+        self.entries = entries
+        self.parses = {}
+        self.released = 0
+        self.lock = threading.Lock()
+        self.pending = defaultdict(deque)
+        self.running = set()
+
+    def parsed(self, index, frames):
+        """Take the frames of a manifest entry, empty should it have failed.
+
+        Returns:
+          list of (Future of the rows loaded, what was loaded)
+        """
+        self.parses[index] = frames
+        res = []
+        while self.released in self.parses:
+            entry = self.entries[self.released]
+            frames = self.parses.pop(self.released)
+            for (uniqueid, plotid), df in frames.items():
+                key = (entry["project"], uniqueid, str(plotid))
+                future = self.submit(key, entry, uniqueid, plotid, df)
+                res.append((future, (entry["filename"], uniqueid, plotid)))
+            self.released += 1
+        return res
+
+    def submit(self, key, *args):
+        """Queue a load of this plot, returns the Future of its result."""
+        res = Future()
+        with self.lock:
+            self.pending[key].append((res, args))
+            if key in self.running:
+                return res
+            self.running.add(key)
+        self._next(key)
+        return res
+
+    def _next(self, key):
+        """Start the next queued load of this plot."""
+        with self.lock:
+            if not self.pending[key]:
+                self.running.discard(key)
+                return
+            res, args = self.pending[key].popleft()
+        future = self.pool.submit(self.load, *args)
+        future.add_done_callback(partial(self._done, key, res))
+
+    def _done(self, key, res, future):
+        """Pass on the result of a load and start the next one."""
+        exp = future.exception()
+        if exp is None:
+            res.set_result(future.result())
+        else:
+            res.set_exception(exp)
+        self._next(key)
+
+
+def print_summary(loader, failures, elapsed):
+    """Print the rows loaded per site and the failures."""
+    total = sum(loader.rows.values())
+    print("-" * 60)
+    print("%-20s %6s %12s" % ("uniqueid", "plots", "rows"))
+    for uniqueid in sorted(loader.rows):
+        print(
+            "%-20s %6s %12s"
+            % (uniqueid, len(loader.plots[uniqueid]), loader.rows[uniqueid])
+        )
+    print(
+        "Loaded %s rows in %.1fs using %s connections, %.0f rows/s"
+        % (total, elapsed, loader.pool.opened, total / max(elapsed, 0.001))
+    )
+    for what, exp in failures:
+        print("FAILED %s: %s" % (what, exp))
+
+
+def main(argv):
+    """Go Main Go."""
+    entries = read_manifest(argv[1])
+    prepare(entries)
+    parsers = int(argv[2]) if len(argv) > 2 else os.cpu_count()
+    loaders = int(argv[3]) if len(argv) > 3 else 4
+    loader = Loader()
+    failures = []
+    loads = {}
+    sts = time.time()
+    with ProcessPoolExecutor(parsers) as parsepool, ThreadPoolExecutor(
+        loaders
+    ) as loadpool:
+        scheduler = Scheduler(loadpool, loader.load, entries)
+        parses = {
+            parsepool.submit(parse_entry, e): i for i, e in enumerate(entries)
+        }
+        for i, future in enumerate(as_completed(parses), 1):
+            entry = entries[parses[future]]
+            try:
+                frames = future.result()
+            except Exception as exp:
+                failures.append((entry["filename"], exp))
+                frames = {}
+            else:
+                print(
+                    "[%s/%s] %.1fs parsed %s, %s plots"
+                    % (
+                        i,
+                        len(entries),
+                        time.time() - sts,
+                        entry["filename"],
+                        len(frames),
+                    )
+                )
+            loads.update(scheduler.parsed(parses[future], frames))
+        for i, future in enumerate(as_completed(loads), 1):
+            what = loads[future]
+            try:
+                rows = future.result()
+            except Exception as exp:
+                failures.append((what, exp))
+                continue
+            print(
+                "[%s/%s] %.1fs loaded %s rows for %s"
+                % (i, len(loads), time.time() - sts, rows, what)
+            )
+    loader.pool.close()
+    print_summary(loader, failures, time.time() - sts)
+    if failures:
+        sys.exit(1)
+
+
+def test_scheduler_order():
+    """Overlapping files of a plot are loaded in manifest order."""
+    applied = defaultdict(list)
+
+    def load(entry, uniqueid, plotid, df):
+        """Record the order, the earlier entries being the slower."""
+        time.sleep(0.01 * (4 - entry["n"]))
+        applied[(uniqueid, plotid)].append(entry["n"])
+        return entry["n"]
+
+    entries = [
+        {"n": n, "filename": f"{n}.csv", "project": "td"} for n in range(4)
+    ]
+    with ThreadPoolExecutor(4) as pool:
+        scheduler = Scheduler(pool, load, entries)
+        loads = {}
+        # parsed last to first, entry 2 not touching plot 1
+        for n in [3, 2, 1, 0]:
+            frames = {("SITE", "1"): n, ("SITE", "2"): n}
+            if n == 2:
+                frames.pop(("SITE", "1"))
+            loads.update(scheduler.parsed(n, frames))
+            assert (n == 0) == bool(loads)
+        assert sorted(f.result() for f in loads) == [0, 0, 1, 1, 2, 3, 3]
+    assert applied[("SITE", "1")] == [0, 1, 3]
+    assert applied[("SITE", "2")] == [0, 1, 2, 3]
+
+
+if __name__ == "__main__":
+    main(sys.argv)
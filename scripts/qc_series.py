@@ -0,0 +1,81 @@
+"""Run the datateam.qcrules rules over a dataset's time series.
+
+Usage: python qc_series.py <database> <dataset> <uniqueid> [start] [end]
+  dataset: decagon, watertable or tileflow
+  uniqueid: the site, or all for every site
+  start, end: optional timestamps (YYYY-MM-DD HH:MM UTC) limiting the QC
+Usage: python qc_series.py <database> stats [days]
+  Summarize the rule hits and time spent over the last days (default 7).
+"""
+import datetime
+import sys
+
+import pandas as pd
+from pyiem.util import get_dbconn
+
+sys.path.append("/opt/datateam/lib")
+from datateam import qcrules  # noqa
+
+
+def get_entries(pgconn, dataset, uniqueid):
+    """Get the (uniqueid, plotid) of the dataset's series."""
+    cursor = pgconn.cursor()
+    cursor.execute(
+        f"""
+        SELECT distinct uniqueid, plotid from
+        {qcrules.DATASETS[dataset]["table"]}
+        WHERE %s = 'all' or uniqueid = %s ORDER by uniqueid, plotid
+        """,
+        (uniqueid, uniqueid),
+    )
+    res = cursor.fetchall()
+    cursor.close()
+    return res
+
+
+def print_stats(pgconn, days):
+    """Print which rules flag the most and take the longest."""
+    cursor = pgconn.cursor()
+    cursor.execute(
+        """
+        SELECT dataset, rule, count(distinct runid), sum(hits),
+        sum(checked), sum(seconds) from qc_rule_stats
+        WHERE runid > now() - %s::interval
+        GROUP by dataset, rule ORDER by sum(seconds) DESC
+        """,
+        (f"{days} days",),
+    )
+    print(
+        "%-10s %-10s %5s %10s %12s %9s"
+        % ("dataset", "rule", "runs", "hits", "checked", "seconds")
+    )
+    for row in cursor:
+        print("%-10s %-10s %5s %10s %12s %9.2f" % row)
+    cursor.close()
+
+
+def main(argv):
+    """Go Main Go."""
+    pgconn = get_dbconn(argv[1])
+    if argv[2] == "stats":
+        print_stats(pgconn, int(argv[3]) if len(argv) > 3 else 7)
+        return
+    dataset = argv[2]
+    uniqueid = argv[3]
+    sts = pd.Timestamp(argv[4], tz="UTC") if len(argv) > 4 else None
+    ets = pd.Timestamp(argv[5], tz="UTC") if len(argv) > 5 else None
+    runid = datetime.datetime.now(datetime.timezone.utc)
+    cursor = pgconn.cursor()
+    qcrules.ensure_stats(cursor)
+    cursor.close()
+    pgconn.commit()
+    for (uniqueid, plotid) in get_entries(pgconn, dataset, uniqueid):
+        cursor = pgconn.cursor()
+        qcrules.run_plot(cursor, dataset, uniqueid, plotid, sts, ets, runid)
+        cursor.close()
+        pgconn.commit()
+    pgconn.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,47 @@
+"""Rebuild the plot rollups of a dataset, see datateam.rollups.
+
+Usage: python refresh_rollups.py <database> <dataset> [siteid] [start] [end]
+  database: td or sustainablecorn
+  dataset: soil_moisture, water_table, tile_flow (td), decagon
+    (sustainablecorn), or init to create the rollups table and fill it for
+    every dataset of the database, which the plots need done once before
+    they can be served
+  siteid: the site, or all for every site
+  start, end: optional dates limiting the rebuild
+"""
+import sys
+
+import pandas as pd
+from pyiem.util import get_dbconn
+
+sys.path.append("/opt/datateam/lib")
+from datateam import dlcache, rollups  # noqa
+
+# The datasets kept in each database
+DATABASES = {
+    "td": ["soil_moisture", "water_table", "tile_flow"],
+    "sustainablecorn": ["decagon"],
+}
+
+
+def main(argv):
+    """Go Main Go."""
+    pgconn = get_dbconn(argv[1])
+    datasets = [argv[2]]
+    cursor = pgconn.cursor()
+    if argv[2] == "init":
+        datasets = DATABASES[argv[1]]
+        rollups.ensure_table(cursor)
+        dlcache.ensure_versioning(cursor, "rollups")
+    siteid = argv[3] if len(argv) > 3 and argv[3] != "all" else None
+    sts = pd.Timestamp(argv[4]) if len(argv) > 4 else None
+    ets = pd.Timestamp(argv[5]) if len(argv) > 5 else None
+    for dataset in datasets:
+        rows = rollups.refresh(cursor, dataset, siteid, sts, ets)
+        print(f"Wrote {rows} {dataset} rollup rows")
+    cursor.close()
+    pgconn.commit()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
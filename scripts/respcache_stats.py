@@ -0,0 +1,28 @@
+"""Print the hit, miss and 304 counts of the response cache.
+
+Usage: python respcache_stats.py [endpoint ...]
+"""
+import sys
+
+sys.path.append("/opt/datateam/lib")
+from datateam import respcache  # noqa
+
+
+def main(argv):
+    """Go Main Go."""
+    stats = respcache.counters(argv[1:] or None)
+    print(
+        f"{'endpoint':30s} {'hit':>8s} {'miss':>8s} {'304':>8s} {'ratio':>6s}"
+    )
+    for endpoint, row in stats.items():
+        served = row["hit"] + row["notmodified"]
+        total = served + row["miss"]
+        ratio = served / total if total else 0
+        print(
+            f"{endpoint:30s} {row['hit']:8d} {row['miss']:8d} "
+            f"{row['notmodified']:8d} {ratio:6.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv)
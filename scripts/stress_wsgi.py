@@ -0,0 +1,160 @@
+"""Fire concurrent requests at the web endpoints and check none get mixed up.
+
+The endpoints run in the threaded iemwsgi_tc daemon group, so a request must
+not see the state of another running next to it.  Each request below is
+first made alone to get its expected response, then all of them are made
+again and again from as many threads as a daemon process has, in a shuffled
+order, and every response must be the same as when it ran alone.  The pairs
+of requests for an endpoint differ in what they would trip over, such as
+plot depths, progress modes or workbook names.  The response cache is
+bypassed, so every request builds its response.  Workbooks are compared
+less the creation time xlsxwriter stamps them with.
+
+Usage: python stress_wsgi.py [rounds] [threads] [htdocs]
+"""
+import hashlib
+import importlib.util
+import os
+import random
+import sys
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+sys.path.append("/opt/datateam/lib")
+
+# endpoint and query strings, none of them write anything
+REQUESTS = [
+    (
+        "cscap/plot_decagon.py",
+        "site=ISUAG::302E&date=2014-06-10&days=7&ptype=1&depth=all&view=js",
+    ),
+    (
+        "cscap/plot_decagon.py",
+        "site=SERF::1S&date=2014-06-10&days=7&ptype=3&depth=10&view=js",
+    ),
+    (
+        "cscap/plot_tileflow.py",
+        "site=SERF&date=2014-01-01&days=30&ptype=1&view=js",
+    ),
+    (
+        "cscap/plot_watertable.py",
+        "site=SERF&date=2014-01-01&days=30&ptype=2&view=excel",
+    ),
+    ("cscap/plot_waterquality.py", "site=SERF&varname=WAT2&view=csv"),
+    ("cscap/dl/filter.py", "sites[]=ISUAG&sites[]=SERF"),
+    ("cscap/dl/filter.py", "sites[]=MASON&treatments[]=TIL1"),
+    (
+        "cscap/dl/wxdl.py",
+        "stations=ISUAG&year1=2014&month1=1&day1=1&year2=2014&month2=12"
+        "&day2=31",
+    ),
+    (
+        "td/dl/wxdl.py",
+        "stations=SERF_IA&year1=2015&month1=1&day1=1&year2=2015&month2=6"
+        "&day2=30",
+    ),
+    (
+        "td/dl/wxdl.py",
+        "stations=ACRE&year1=2016&month1=1&day1=1&year2=2016&month2=6"
+        "&day2=30",
+    ),
+    ("td/plot_agronomic.py", "site=SERF_IA&varname=AGR17&ptype=1&view=js"),
+    ("admin/calc.py", "equation=AGR33+/+AGR4"),
+    ("admin/calc.py", "equation=AGR17+*+2"),
+    ("admin/dataprogress.py", "mode=agronomic&year=2013"),
+    ("admin/dataprogress.py", "mode=soil&year=2014"),
+    ("admin/varprogress.py", "year=2013&varname=AGR1"),
+    ("admin/varprogress.py", "year=2014&varname=AGR2"),
+]
+
+
+def load(htdocs, path, apps):
+    """Import the endpoint's module once, as mod_wsgi does."""
+    if path not in apps:
+        fn = os.path.join(htdocs, path)
+        sys.path.insert(0, os.path.dirname(fn))
+        name = "_stress_" + path.replace("/", "_").replace(".", "_")
+        spec = importlib.util.spec_from_file_location(name, fn)
+        mod = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(mod)
+        # each project's common.py, should a later endpoint want the other
+        sys.modules.pop("common", None)
+        sys.path.pop(0)
+        apps[path] = getattr(mod.application, "__wrapped__", mod.application)
+    return apps[path]
+
+
+def fingerprint(body):
+    """Digest of a response body, of the workbook parts for a workbook."""
+    digest = hashlib.sha256()
+    if not body.startswith(b"PK"):
+        digest.update(body)
+        return digest.hexdigest()
+    with zipfile.ZipFile(BytesIO(body)) as zfh:
+        for name in sorted(zfh.namelist()):
+            if name != "docProps/core.xml":
+                digest.update(name.encode("utf-8") + zfh.read(name))
+    return digest.hexdigest()
+
+
+def call(app, query):
+    """Make a GET request of the application.
+
+    Returns:
+      (status, fingerprint of the body)
+    """
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "QUERY_STRING": query,
+        "CONTENT_TYPE": "",
+        "CONTENT_LENGTH": "",
+        "REMOTE_ADDR": "127.0.0.1",
+        "wsgi.input": BytesIO(),
+    }
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        """Hold on to the status."""
+        response["status"] = status
+
+    body = b"".join(app(environ, start_response))
+    return response.get("status"), fingerprint(body)
+
+
+def main(argv):
+    """Go Main Go."""
+    rounds = int(argv[1]) if len(argv) > 1 else 5
+    threads = int(argv[2]) if len(argv) > 2 else 15
+    htdocs = argv[3] if len(argv) > 3 else "/opt/datateam/htdocs"
+    apps = {}
+    expected = {}
+    for path, query in REQUESTS:
+        try:
+            expected[(path, query)] = call(load(htdocs, path, apps), query)
+        except Exception as exp:
+            print(f"{path} {query} skipped, failed alone: {exp}")
+    work = list(expected) * rounds
+    random.shuffle(work)
+    sts = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        results = list(
+            executor.map(lambda req: call(apps[req[0]], req[1]), work)
+        )
+    secs = time.perf_counter() - sts
+    failures = 0
+    for req, res in zip(work, results):
+        if res != expected[req]:
+            failures += 1
+            print(f"MISMATCH {req[0]} {req[1]}: {res} != {expected[req]}")
+    print(
+        f"{len(work)} requests from {threads} threads in {secs:.1f}s, "
+        f"{failures} mismatched"
+    )
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,11 +1,12 @@
 """Verbatim copy of a csv file to the database."""
 import sys
 import os
-from io import StringIO
 
 from pyiem.util import logger, get_dbconn
 import pandas as pd
-import numpy as np
+
+sys.path.append("/opt/datateam/lib")
+from datateam import rollups, staging  # noqa
 
 LOG = logger()
 COLTYPES = {
@@ -16,36 +17,25 @@ COLTYPES = {
 }
 
 
-def create_table(cursor, table_name, df):
-    """Create the table."""
-    cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
-    sio = StringIO()
-    sio.write(f"CREATE TABLE {table_name} (")
-    tokens = []
+def table_columns(df):
+    """The (name, type) pairs of the table."""
+    res = []
     for col in df.columns:
         coltyp = COLTYPES[str(df[col].dtype)]
         if col.startswith("date"):
             coltyp = "date"
-        tokens.append("%s %s" % (col, coltyp))
-    sio.write(", ".join(tokens))
-    sio.write(")")
-    cursor.execute(sio.getvalue())
-    cursor.execute(f"GRANT SELECT on {table_name} to nobody,apache")
-
-
-def copy_rows(cursor, table_name, df):
-    """Copy data."""
-    ps = ", ".join(["%s"] * len(df.columns))
-    for row in df.itertuples(index=False):
-        cursor.execute(f"INSERT into {table_name} values({ps})", row)
+        res.append((col, coltyp))
+    return res
 
 
-def create_indicies(cursor, table_name, df):
-    """Create indexes."""
+def table_indexes(df):
+    """The columns to index."""
+    res = []
     if "siteid" in df.columns and "plotid" in df.columns:
-        cursor.execute(f"CREATE INDEX on {table_name}(siteid, plotid)")
+        res.append("siteid, plotid")
     if "date" in df.columns:
-        cursor.execute(f"CREATE INDEX on {table_name}(date)")
+        res.append("date")
+    return res
 
 
 def main(argv):
@@ -54,6 +44,8 @@ def main(argv):
     table_name = os.path.basename(csvfn)[:-4]
     LOG.info("dumping %s into table: %s", csvfn, table_name)
     df = pd.read_csv(csvfn, low_memory=False)
+    # the columns were created unquoted, so folded to lower case
+    df.columns = [col.lower() for col in df.columns]
     for col in df.columns:
         if col.startswith("date"):
             df[col] = pd.to_datetime(df[col], errors="coerce")
@@ -63,14 +55,15 @@ def main(argv):
         except Exception:
             LOG.info("failed to convert col: %s to numeric", col)
     pgconn = get_dbconn("td")
-    cursor = pgconn.cursor()
-    create_table(cursor, table_name, df)
-    # Do after schema creation as types will change with the below?
-    df = df.replace({np.nan: None})
-    copy_rows(cursor, table_name, df)
-    create_indicies(cursor, table_name, df)
-    cursor.close()
-    pgconn.commit()
+    staging.reload(
+        pgconn, table_name, df, table_columns(df), table_indexes(df)
+    )
+    if table_name in rollups.TABLES:
+        LOG.info("rebuilding the %s plot rollups", rollups.TABLES[table_name])
+        cursor = pgconn.cursor()
+        rollups.refresh(cursor, rollups.TABLES[table_name])
+        cursor.close()
+        pgconn.commit()
 
 
 if __name__ == "__main__":
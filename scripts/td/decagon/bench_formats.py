@@ -0,0 +1,158 @@
+"""Benchmark parsing each decagon logger format.
+
+A synthetic dump is written for each entry of datateam.decagonfmt.FORMATS
+and parsed twice, first the way the old per format functions did (reading
+every column with openpyxl and leaving the timestamps to pandas) and then
+as configured (reading only the wanted columns, with python-calamine when
+installed, and an explicit timestamp format).  Both
+must give the same DataFrames.
+Usage: python bench_formats.py [number of rows] [format ...]
+"""
+import csv
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append("/opt/datateam/lib")
+from datateam import decagonfmt  # noqa
+
+# Columns in the dumps that no format reads
+EXTRA = 10
+# Excel files are much slower to write and read than csv files
+EXCEL_SHARE = 0.1
+EXTENSIONS = {"csv": "csv", "excel": "xlsx"}
+
+
+def timestamps(rows):
+    """Get rows of five minute timestamps."""
+    start = datetime.datetime(2015, 5, 1)
+    return [start + datetime.timedelta(minutes=5 * i) for i in range(rows)]
+
+
+def values(rng, rows):
+    """Get a column of observations."""
+    return np.round(rng.random(rows) * 40, 3)
+
+
+def header_and_data(spec, rows, rng):
+    """Build the header and data rows of a wide or long dump."""
+    times = timestamps(rows)
+    if spec["reader"] == "csv":
+        times = [t.strftime("%m/%d/%Y %H:%M") for t in times]
+    if "long" in spec:
+        long = spec["long"]
+        depthnames = list(long.get("depths", ["10", "20", "40", "60", "80"]))
+        plots = list(spec.get("plots", ["101", "102"]))
+        header = [long["plot"], long["time"], long["depth"], "note"]
+        header.extend(long["values"])
+        data = []
+        for plotid in plots:
+            for t in times[: rows // len(plots) // len(depthnames)]:
+                for depth in depthnames:
+                    obs = values(rng, len(long["values"]))
+                    data.append([plotid, t, depth, "ok", *obs])
+        return header, data
+    if spec.get("header_rows"):
+        header = ["Site"]
+        extra = [["Measurement Time"], [""]]
+        for port in range(1, 8):
+            for units in ["m3/m3 VWC", "C Temp", "mS/cm Bulk EC"]:
+                header.append(f"Port {port}")
+                extra[0].append("5TE Moisture/Temp/EC")
+                extra[1].append(units)
+        cols = [values(rng, rows) for _ in header[1:]]
+        return header, extra + [list(r) for r in zip(times, *cols)]
+    wanted = decagonfmt.wanted_columns(spec)
+    if all(isinstance(c, int) for c in wanted):
+        header = [f"c{i}" for i in range(max(wanted) + 1 + EXTRA)]
+    else:
+        header = list(wanted) + [f"extra{i}" for i in range(EXTRA)]
+    cols = [values(rng, rows) for _ in header[1:]]
+    return header, [list(r) for r in zip(times, *cols)]
+
+
+def write_dump(filename, spec, rows, rng):
+    """Write a synthetic dump laid out as the entry describes."""
+    header, data = header_and_data(spec, rows, rng)
+    read = spec.get("read", {})
+    lines = [header] + data
+    for i in sorted(read.get("skiprows", [])):
+        lines.insert(i, ["logger metadata"])
+    if spec["reader"] == "csv":
+        with open(filename, "w", newline="") as fh:
+            csv.writer(fh, delimiter=read.get("sep", ",")).writerows(lines)
+        return
+    sheet_name = read.get("sheet_name", "Sheet1")
+    sheets = {sheet_name: lines}
+    if sheet_name is None:
+        half = len(header) + (len(lines) - len(header)) // 2
+        sheets = {"2015": lines[:half], "2016": lines[:1] + lines[half:]}
+        if spec.get("header_rows"):
+            sheets["2016"] = lines[:3] + lines[half:]
+    with pd.ExcelWriter(filename) as writer:
+        for name, sheet in sheets.items():
+            pd.DataFrame(sheet).to_excel(
+                writer, sheet_name=name, header=False, index=False
+            )
+
+
+def legacy(spec):
+    """Get the entry made to read every column and let pandas parse time."""
+    res = dict(spec, usecols=False, timefmt=False)
+    if spec["reader"] == "excel":
+        res["read"] = dict(spec.get("read", {}), engine="openpyxl")
+    if "join" in spec:
+        res["join"] = legacy(spec["join"])
+    return res
+
+
+def timeit(func):
+    """Run func, returning its result and the seconds it took."""
+    sts = time.time()
+    res = func()
+    return res, time.time() - sts
+
+
+def bench(fmt, rows, tmpdir):
+    """Benchmark one format."""
+    rng = np.random.default_rng(0)
+    spec = decagonfmt.FORMATS[fmt]
+    if spec["reader"] == "excel":
+        rows = max(int(rows * EXCEL_SHARE), 10)
+    filename = os.path.join(
+        tmpdir, f"format{fmt}.{EXTENSIONS[spec['reader']]}"
+    )
+    write_dump(filename, spec, rows, rng)
+    if "join" in spec:
+        join = spec["join"]
+        write_dump(os.path.join(tmpdir, join["filename"]), join, rows, rng)
+    old, oldtime = timeit(
+        lambda: decagonfmt.read_format(filename, fmt, legacy(spec))
+    )
+    new, newtime = timeit(lambda: decagonfmt.read_format(filename, fmt))
+    assert list(old) == list(new)
+    for plotid, df in new.items():
+        pd.testing.assert_frame_equal(old[plotid], df)
+    print(
+        f"format: {fmt} reader: {spec['reader']} rows: {rows} "
+        f"plots: {len(new)} all columns: {oldtime:.3f}s "
+        f"configured: {newtime:.3f}s speedup: {oldtime / newtime:.1f}x"
+    )
+
+
+def main(argv):
+    """Go Main Go."""
+    rows = int(argv[1]) if len(argv) > 1 else 100_000
+    fmts = argv[2:] or list(decagonfmt.FORMATS)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for fmt in fmts:
+            bench(fmt, rows, tmpdir)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
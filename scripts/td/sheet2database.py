@@ -1,7 +1,13 @@
 """A direct copy of a Google Spreadsheet to a postgresql database"""
+import sys
+
+import pandas as pd
 import psycopg2
 import pyiem.cscap_utils as util
 
+sys.path.append("/opt/datateam/lib")
+from datateam import staging  # noqa
+
 config = util.get_config()
 pgconn = psycopg2.connect(database="td", host=config["database"]["host"])
 spr_client = util.get_spreadsheet_client(config)
@@ -82,41 +88,26 @@ def cleankey(key):
 
 def do(spreadkey, sheetlabel, tablename, cols):
     """Process"""
-    cursor = pgconn.cursor()
-    cursor.execute("""DROP TABLE IF EXISTS %s""" % (tablename,))
     spread = util.Spreadsheet(spr_client, spreadkey)
     listfeed = spr_client.get_list_feed(
         spreadkey, spread.worksheets[sheetlabel].id
     )
-    for i, entry in enumerate(listfeed.entry):
+    rows = []
+    for entry in listfeed.entry:
         row = entry.to_dict()
-        if i == 0:
-            # Create the table
-            sql = "CREATE TABLE %s (" % (tablename,)
-            for key in cols:
-                sql += "%s varchar," % (cleankey(key),)
-            sql = sql[:-1] + ")"
-            cursor.execute(sql)
-            cursor.execute(
-                """
-            GRANT SELECT on %s to nobody,apache
-            """
-                % (tablename,)
-            )
         values = []
         for key in cols:
             val = row[cleankey(key)]
             if val is None:
                 val = "Unknown"
             values.append(val.strip())
-        sql = "INSERT into %s (%s) VALUES (%s)" % (
-            tablename,
-            ",".join(cols),
-            ",".join(["%s"] * len(cols)),
-        )
-        cursor.execute(sql, values)
-    cursor.close()
-    pgconn.commit()
+        rows.append(values)
+    if not rows:
+        return
+    df = pd.DataFrame(rows, columns=[cleankey(key) for key in cols])
+    staging.reload(
+        pgconn, tablename, df, [(col, "varchar") for col in df.columns]
+    )
 
 
 def main():
@@ -1,8 +1,13 @@
 """A direct copy of a Google Sheet to a postgresql database"""
+import sys
+
 import psycopg2
 import pyiem.cscap_utils as util
 from gspread_pandas import Spread
 
+sys.path.append("/opt/datateam/lib")
+from datateam import staging  # noqa
+
 config = util.get_config()
 pgconn = psycopg2.connect(database="td", host=config["database"]["host"])
 ss = util.get_ssclient(config)
@@ -22,31 +27,13 @@ def cleaner(val):
 
 def workflow(sheetid, tablename):
     """Process"""
-    cursor = pgconn.cursor()
-    cursor.execute(f"DROP TABLE IF EXISTS {tablename}")
     spread = Spread(sheetid, config=config["td"]["service_account"])
     df = spread.sheet_to_df(index=None)
-    cols = [cleaner(c) for c in df.columns]
-    cursor.execute(
-        f"CREATE TABLE {tablename} (ss_order int, %s)"
-        % (",".join([' "%s" varchar' % (s,) for s in cols]),)
-    )
-    cursor.execute(f"GRANT SELECT on {tablename} to nobody,apache")
-    for i, row in enumerate(df.itertuples()):
-        vals = []
-        for col in row[1:]:
-            vals.append(col)
-        sql = """
-        INSERT into %s (ss_order, %s) VALUES (%s, %s)
-        """ % (
-            tablename,
-            ",".join(['"%s"' % (s,) for s in cols]),
-            i,
-            ",".join(["%s"] * len(cols)),
-        )
-        cursor.execute(sql, vals)
-    cursor.close()
-    pgconn.commit()
+    df.columns = [cleaner(c) for c in df.columns]
+    df.insert(0, "ss_order", range(len(df.index)))
+    columns = [("ss_order", "int")]
+    columns.extend((col, "varchar") for col in df.columns[1:])
+    staging.reload(pgconn, tablename, df, columns)
 
 
 def main():